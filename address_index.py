@@ -0,0 +1,222 @@
+"""
+address_index.py
+A local copy of the formatted address of every property in the LLPG
+How it works:
+Instead of joining every request to MV_HDC_LLPG_ADDRESSES_CURRENT and
+formatting ADDRESS_BLOCK on the server, each address is formatted once and
+saved to a file: the UPRNs, a checksum of each address and the length of
+each formatted address in arrays, followed by the addresses themselves.
+Loading it puts the addresses in a dict keyed by UPRN, so looking one up
+is a single hash. To bring it up to date only the UPRN and checksum of
+each property are read from the view, and the addresses are fetched for
+just the properties that are new or whose checksum changed. A property
+added since then is fetched the first time it is looked up
+"""
+import os
+import time
+import array
+import threading
+import converter
+
+MAGIC = b'ADDRESS1\n'
+# Separates the address block from the postal address in the file
+SEPARATOR = '\x1f'
+# The most UPRNs fetched from the view in one query
+BATCH_SIZE = 500
+# The seconds the index is used for before it is refreshed
+MAX_AGE = 24 * 60 * 60
+
+
+def format_block(address_block: str) -> str:
+    """
+    Formats an address the way the letter queries used to on the server
+    Args:
+        address_block (str): ADDRESS_BLOCK from the view, with a line for
+        the county
+    Returns:
+        (str): The address with <br> between its lines
+    """
+    address_block = address_block.replace('North Yorkshire\r\n', '')
+    return address_block.replace('\r\n', '<br>')
+
+
+class AddressIndex():
+    """
+    Represents the formatted addresses of the properties in the LLPG
+    """
+    def __init__(self, addresses: dict = None, refreshed: float = 0.0):
+        """
+        Args:
+            addresses (dict): The (checksum, address, postal address) of
+            each UPRN
+            refreshed (float): When the index was last brought up to date
+            with the view, as a timestamp
+        """
+        self.addresses = addresses or {}
+        self.refreshed = refreshed
+        self.lookups = 0
+        self.fetched = 0
+        # Whether addresses were fetched since the index was saved
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def __str__(self) -> str:
+        return f'Address index: {len(self)} properties, {self.lookups} ' \
+            f'lookups, {self.fetched} addresses fetched'
+
+    @classmethod
+    def load(cls, path: str) -> 'AddressIndex':
+        """
+        Args:
+            path (str): The path of the index file
+        Returns:
+            (AddressIndex): The saved index, or an empty one if there isn't
+            one or it can't be read
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as index_f:
+            if index_f.readline() != MAGIC:
+                return cls()
+            uprns = array.array('q')
+            checksums = array.array('i')
+            lengths = array.array('L')
+            try:
+                refreshed = float(index_f.readline())
+                count = int(index_f.readline())
+                uprns.fromfile(index_f, count)
+                checksums.fromfile(index_f, count)
+                lengths.fromfile(index_f, count)
+            # A file cut short by an interrupted save is built again. One
+            # cut partway through a line or a value raises ValueError
+            except (EOFError, ValueError):
+                return cls()
+            data = index_f.read()
+        if len(data) != sum(lengths):
+            return cls()
+        addresses = {}
+        start = 0
+        for uprn, checksum, length in zip(uprns, checksums, lengths):
+            block, postal = data[start:start + length].decode('utf-8').split(
+                SEPARATOR)
+            addresses[uprn] = (checksum, block, postal)
+            start += length
+        return cls(addresses, refreshed)
+
+    def save(self, path: str):
+        """
+        Writes the index under a temporary name first, so a run that dies
+        while saving leaves the previous file as it was
+        Args:
+            path (str): The path of the index file
+        """
+        uprns = array.array('q', sorted(self.addresses))
+        checksums = array.array('i')
+        lengths = array.array('L')
+        records = []
+        for uprn in uprns:
+            checksum, block, postal = self.addresses[uprn]
+            record = f'{block}{SEPARATOR}{postal}'.encode('utf-8')
+            checksums.append(checksum)
+            lengths.append(len(record))
+            records.append(record)
+        with open(f'{path}.tmp', 'wb') as index_f:
+            index_f.write(MAGIC)
+            index_f.write(f'{self.refreshed}\n{len(uprns)}\n'.encode())
+            uprns.tofile(index_f)
+            checksums.tofile(index_f)
+            lengths.tofile(index_f)
+            index_f.write(b''.join(records))
+        os.replace(f'{path}.tmp', path)
+        self.dirty = False
+
+    def stale(self, max_age: float = MAX_AGE) -> bool:
+        """
+        Args:
+            max_age (float): The seconds the index is used for before it is
+            refreshed
+        Returns:
+            (bool): True if the index needs refreshing
+        """
+        return time.time() - self.refreshed > max_age
+
+    def get(self, uprn) -> tuple:
+        """
+        Args:
+            uprn: The UPRN of a property
+        Returns:
+            (tuple): The address of the property with <br> between its
+            lines, and its postal address, or None if it isn't in the index
+        """
+        self.lookups += 1
+        address = self.addresses.get(int(uprn))
+        return None if address is None else address[1:]
+
+    def update(self, rows):
+        """
+        Args:
+            rows (iterable): The (uprn, checksum, ADDRESS_BLOCK, postal
+            address) of the properties to add or replace
+        """
+        for uprn, checksum, address_block, postal in rows:
+            self.addresses[int(uprn)] = (
+                checksum, format_block(address_block), postal)
+            self.fetched += 1
+            self.dirty = True
+
+    def fetch(self, uprns: list, fetch, batch_size: int = BATCH_SIZE):
+        """
+        Args:
+            uprns (list): The UPRNs to fetch the addresses of
+            fetch (callable): Takes a list of UPRNs and returns the rows for
+            update()
+            batch_size (int): The most UPRNs to fetch at once
+        """
+        for batch in converter.chunk(uprns, batch_size):
+            self.update(fetch(batch))
+
+    def refresh(self, checksums, fetch, batch_size: int = BATCH_SIZE) -> int:
+        """
+        Brings the index up to date with the view, fetching only the
+        addresses that are new or have changed
+        Args:
+            checksums (iterable): The (uprn, checksum) of every property in
+            the view
+            fetch (callable): Takes a list of UPRNs and returns the rows for
+            update()
+            batch_size (int): The most UPRNs to fetch at once
+        Returns:
+            (int): The number of addresses fetched
+        """
+        live = {int(uprn): checksum for uprn, checksum in checksums}
+        for uprn in set(self.addresses) - set(live):
+            del self.addresses[uprn]
+        changed = [uprn for uprn, checksum in live.items()
+                   if self.addresses.get(uprn, (None,))[0] != checksum]
+        with self.lock:
+            self.fetch(changed, fetch, batch_size)
+        self.refreshed = time.time()
+        return len(changed)
+
+    def resolve(self, uprns, fetch, batch_size: int = BATCH_SIZE) -> int:
+        """
+        Fetches the addresses of any properties added since the index was
+        refreshed. Queries running at the same time take turns, so they
+        can share a connection to fetch on
+        Args:
+            uprns (iterable): The UPRNs about to be looked up
+            fetch (callable): Takes a list of UPRNs and returns the rows for
+            update()
+            batch_size (int): The most UPRNs to fetch at once
+        Returns:
+            (int): The number of UPRNs that weren't in the index
+        """
+        missing = sorted({int(uprn) for uprn in uprns
+                          if int(uprn) not in self.addresses})
+        if missing:
+            with self.lock:
+                self.fetch(missing, fetch, batch_size)
+        return len(missing)
@@ -0,0 +1,5 @@
+"""
+benchmark
+Offline benchmark of gen_html.py and new_rounds_gen_html.py, using a
+stand-in database and converter so no live systems are touched
+"""
@@ -0,0 +1,143 @@
+"""
+fake_converter.py
+A stand-in for wkhtmltopdf with a configurable conversion time
+How it works:
+The benchmark swaps converter.subprocess for a FakeWkhtmltopdf, so
+converter.convert_one() still builds the command line as normal but, in
+place of starting wkhtmltopdf, waits for the configured time and writes
+a small valid PDF with one page per HTML file, or returns it as the
+process's output when the HTML is piped in. Every HANG_EVERY-th process
+hangs instead, until its timeout runs out
+"""
+import time
+import subprocess
+
+
+# Stands in for the font wkhtmltopdf embeds in every PDF it writes
+FONT = bytes(range(256)) * 64
+# Every this many processes one hangs, or 0 for none to hang
+HANG_EVERY = 0
+# The seconds a hung process waits when it has no timeout
+HANG_SECONDS = 60
+
+
+def minimal_pdf(pages: int) -> bytes:
+    """
+    Builds the smallest valid PDF with the given number of blank A4 pages,
+    which embeds a copy of FONT like wkhtmltopdf's PDFs embed their fonts
+    Args:
+        pages (int): The number of pages
+    Returns:
+        (bytes): The PDF
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [' + b' '.join(
+            f'{i + 6} 0 R'.encode() for i in range(pages)) +
+        f'] /Count {pages} >>'.encode(),
+        b'<< /Type /Font /Subtype /TrueType /BaseFont /Calibri '
+        b'/FontDescriptor 4 0 R >>',
+        b'<< /Type /FontDescriptor /FontName /Calibri /Flags 32 '
+        b'/FontFile2 5 0 R >>',
+        f'<< /Length {len(FONT)} >>\nstream\n'.encode() + FONT +
+        b'\nendstream']
+    for _ in range(pages):
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> >>')
+    pdf = b'%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(pdf))
+        pdf += f'{i + 1} 0 obj\n'.encode() + obj + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        pdf += f'{offset:010} 00000 n \n'.encode()
+    pdf += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n' \
+        f'startxref\n{xref}\n%%EOF\n'.encode()
+    return pdf
+
+
+class FakeWkhtmltopdf():
+    """
+    Stands in for the subprocess module inside converter.py
+    """
+    list2cmdline = staticmethod(subprocess.list2cmdline)
+    PIPE = subprocess.PIPE
+    CompletedProcess = subprocess.CompletedProcess
+    TimeoutExpired = subprocess.TimeoutExpired
+
+    def __init__(self, latency: float = 0.0, page_latency: float = 0.0):
+        """
+        Args:
+            latency (float): The seconds each process takes to start
+            page_latency (float): The seconds each HTML file takes to
+            convert
+        """
+        self.latency = latency
+        self.page_latency = page_latency
+        self.calls = 0
+
+    def hang(self, args: list, timeout: float):
+        """
+        Makes every HANG_EVERY-th process hang
+        Args:
+            args (list): The wkhtmltopdf command line
+            timeout (float): The seconds the process is allowed, or None
+        """
+        self.calls += 1
+        if not HANG_EVERY or self.calls % HANG_EVERY:
+            return
+        time.sleep(timeout if timeout is not None else HANG_SECONDS)
+        if timeout is not None:
+            raise subprocess.TimeoutExpired(args, timeout)
+
+    def call(
+            self,
+            args: list,
+            shell: bool = False,
+            timeout: float = None) -> int:
+        """
+        Pretends to run wkhtmltopdf
+        Args:
+            args (list): The wkhtmltopdf command line, which ends with the
+            HTML files and then the PDF
+            shell (bool): Ignored
+            timeout (float): The seconds to wait before giving up on a hung
+            process
+        Returns:
+            (int): The exit code, always 0
+        """
+        self.hang(args, timeout)
+        # The HTML files are the arguments before the PDF ending in .html
+        htmls = [arg for arg in args[1:-1] if arg.endswith('.html')]
+        pages = max(1, len(htmls))
+        # time.sleep lets other worker threads run, like waiting on a process
+        time.sleep(self.latency + self.page_latency * pages)
+        with open(args[-1], 'wb') as pdf_f:
+            pdf_f.write(minimal_pdf(pages))
+        return 0
+
+    def run(
+            self,
+            args: list,
+            input: bytes = None,
+            stdout: int = None,
+            timeout: float = None) -> subprocess.CompletedProcess:
+        """
+        Pretends to run wkhtmltopdf with the HTML piped to it
+        Args:
+            args (list): The wkhtmltopdf command line, reading from stdin
+            and writing to stdout
+            input (bytes): The HTML of the letter
+            stdout (int): Ignored, the PDF is always returned
+            timeout (float): The seconds to wait before giving up on a hung
+            process
+        Returns:
+            (subprocess.CompletedProcess): The finished process, with the
+            PDF as its stdout
+        """
+        self.hang(args, timeout)
+        time.sleep(self.latency + self.page_latency)
+        return subprocess.CompletedProcess(args, 0, stdout=minimal_pdf(1))
@@ -0,0 +1,414 @@
+"""
+fake_pyodbc.py
+A stand-in for pyodbc that answers the scripts' queries from a Dataset
+How it works:
+The benchmark puts this module in sys.modules as pyodbc before it runs a
+script. Each statement the scripts send is recognised by its text and
+answered from the Dataset in DATABASE, after waiting QUERY_LATENCY seconds
+to stand in for the round trip to SQL Server. Which letters have been sent
+and which requests are leased to which worker is kept in the Dataset, or
+in a SQLite file when several processes share the stand-in database
+"""
+import sys
+import time
+import sqlite3
+import threading
+
+# The Dataset every connection reads from, set by the benchmark
+DATABASE = None
+# The seconds each execute waits before returning
+QUERY_LATENCY = 0.0
+# The seconds each fetch of a batch of rows waits
+FETCH_LATENCY = 0.0
+# The SQLite file shared by several processes, set by the benchmark
+SHARED = None
+
+_LOCK = threading.Lock()
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class Row():
+    """
+    Represents a result row, with each column as an attribute
+    """
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+    def __getitem__(self, index: int):
+        return list(self.__dict__.values())[index]
+
+
+class LocalState():
+    """
+    Represents the sent flags and leases of a Dataset in this process
+    """
+    def __init__(self, database):
+        self.database = database
+
+    def unsent(self, flag: str) -> set:
+        return {case['case_ref'] for case in self.database.missed
+                if not case[flag]}
+
+    def mark(self, case_ref: str, flag: str):
+        with _LOCK:
+            self.database.cases[case_ref][flag] = True
+
+    def claim(self, claim: str, limit: int, lease: int) -> int:
+        now = time.time()
+        with _LOCK:
+            claimed = 0
+            for case in self.database.missed:
+                if claimed == limit:
+                    break
+                if claimable(case, now):
+                    case['claim'] = (claim, now + lease)
+                    claimed += 1
+        return claimed
+
+    def renew(self, claim: str, lease: int) -> int:
+        now = time.time()
+        with _LOCK:
+            renewed = 0
+            for case in self.database.missed:
+                if case.get('claim', (None, 0))[0] == claim and \
+                        case['claim'][1] > now:
+                    case['claim'] = (claim, now + lease)
+                    renewed += 1
+        return renewed
+
+    def claimed(self, claim: str, now: float = 0) -> set:
+        return {case['case_ref'] for case in self.database.missed
+                if case.get('claim', (None,))[0] == claim and
+                case['claim'][1] > now}
+
+
+def claimable(case: dict, now: float) -> bool:
+    """
+    Args:
+        case (dict): A missed collection report
+        now (float): The current time
+    Returns:
+        (bool): True if the report needs a letter and isn't leased
+    """
+    unsent = (case['gw_requested'] and not case['gw_sent']) or (
+        case['rec_requested'] and not case['rec_sent'])
+    return unsent and case.get('claim', (None, 0))[1] < now
+
+
+class SharedState():
+    """
+    Represents the sent flags and leases of a Dataset in a SQLite file that
+    several processes use at once
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def unsent(self, flag: str) -> set:
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT case_ref FROM cases WHERE {flag} = 0').fetchall()
+        return {row[0] for row in rows}
+
+    def mark(self, case_ref: str, flag: str):
+        # Every letter marked as sent is counted, so a letter sent by two
+        # workers shows up as a duplicate
+        with self._connect() as conn:
+            conn.execute(
+                f'UPDATE cases SET {flag} = 1, {flag}_count = '
+                f'{flag}_count + 1 WHERE case_ref = ?', (case_ref,))
+
+    def claim(self, claim: str, limit: int, lease: int) -> int:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            refs = [row[0] for row in conn.execute(
+                'SELECT case_ref FROM cases '
+                'WHERE ((gw_requested AND NOT gw_sent) '
+                'OR (rec_requested AND NOT rec_sent)) '
+                'AND claim_expires < ? ORDER BY id LIMIT ?', (now, limit))]
+            conn.executemany(
+                'UPDATE cases SET claimed_by = ?, claim_expires = ? '
+                'WHERE case_ref = ?',
+                [(claim, now + lease, ref) for ref in refs])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return len(refs)
+
+    def renew(self, claim: str, lease: int) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                'UPDATE cases SET claim_expires = ? '
+                'WHERE claimed_by = ? AND claim_expires > ?',
+                (now + lease, claim, now)).rowcount
+
+    def claimed(self, claim: str, now: float = 0) -> set:
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT case_ref FROM cases '
+                'WHERE claimed_by = ? AND claim_expires > ?',
+                (claim, now)).fetchall()
+        return {row[0] for row in rows}
+
+
+def share(path: str):
+    """
+    Copies the sent flags of DATABASE into a new SQLite file, for several
+    processes to share by setting SHARED to its path
+    Args:
+        path (str): The path of the SQLite file
+    """
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            'CREATE TABLE cases (case_ref TEXT PRIMARY KEY, id INTEGER, '
+            'gw_requested INTEGER, rec_requested INTEGER, gw_sent INTEGER, '
+            'rec_sent INTEGER, gw_sent_count INTEGER DEFAULT 0, '
+            'rec_sent_count INTEGER DEFAULT 0, claimed_by TEXT, '
+            'claim_expires REAL DEFAULT 0)')
+        conn.executemany(
+            'INSERT INTO cases (case_ref, id, gw_requested, rec_requested, '
+            'gw_sent, rec_sent) VALUES (?, ?, ?, ?, ?, ?)',
+            [(case['case_ref'], case['id'], case['gw_requested'],
+              case['rec_requested'], case['gw_sent'], case['rec_sent'])
+             for case in DATABASE.missed])
+
+
+def shared_report(path: str) -> dict:
+    """
+    Args:
+        path (str): The path of a SQLite file made by share()
+    Returns:
+        (dict): The number of letters still to send, and the number sent
+        more than once
+    """
+    with sqlite3.connect(path) as conn:
+        unsent, duplicates = conn.execute(
+            'SELECT SUM((gw_requested AND NOT gw_sent) + '
+            '(rec_requested AND NOT rec_sent)), '
+            'SUM((gw_sent_count > 1) + (rec_sent_count > 1)) '
+            'FROM cases').fetchone()
+    return {'unsent': unsent, 'duplicates': duplicates}
+
+
+class Cursor():
+    """
+    Represents a cursor over the results of the last statement it ran
+    """
+    def __init__(self, database, state):
+        self.database = database
+        self.state = state
+        self.rows = []
+        self.position = 0
+        self.rowcount = -1
+        self.fast_executemany = False
+
+    def execute(self, sql: str, *params):
+        time.sleep(QUERY_LATENCY)
+        self.rows = self._answer(sql, params)
+        self.position = 0
+        return self
+
+    def executemany(self, sql: str, params: list):
+        time.sleep(QUERY_LATENCY)
+        for values in params:
+            self._answer(sql, values)
+        self.rows = []
+        self.position = 0
+
+    def fetchmany(self, size: int) -> list:
+        time.sleep(FETCH_LATENCY)
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self) -> list:
+        return self.fetchmany(len(self.rows))
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def _answer(self, sql: str, params) -> list:
+        data = self.database
+        if 'information_schema.tables' in sql:
+            return [Row(table_name='PropertyServiceRounds_I_2018100100000')]
+        if '@lease_seconds' in sql:
+            if 'ClaimExpires > GETDATE()' in sql:
+                self.rowcount = self.state.renew(*params)
+            else:
+                self.rowcount = self.state.claim(*params)
+            return []
+        if 'UPDATE ' in sql:
+            return self._update(sql, params)
+        if 'GWLics' in sql:
+            return self._requests(sql, params, 'gw')
+        if 'RecSacksRequested' in sql:
+            return self._requests(sql, params, 'rec')
+        if 'days_ref' in sql:
+            if 'PropertyServiceRounds_I_' in sql:
+                rounds = data.old_rounds
+            else:
+                rounds = data.new_rounds
+            return [self._days(uprn, days) for uprn, days in rounds.items()]
+        if 'CHECKSUM(' in sql:
+            if 'l.UPRN IN (' in sql:
+                uprns = [str(uprn) for uprn in params]
+            else:
+                uprns = list(data.addresses)
+            return [self._llpg(uprn) for uprn in uprns
+                    if uprn in data.addresses]
+        if 'l.UPRN IN (' in sql:
+            return [self._address(uprn) for uprn in params
+                    if str(uprn) in data.addresses]
+        if 'PIVOT' in sql:
+            return [self._change(uprn) for uprn in data.new_rounds]
+        if '@uprn varchar(12) = ?' in sql:
+            return [Row(html=self._html_table(params[0]))]
+        if 'tvfPropertyCollectionsCalendar_U_2' in sql:
+            return [Row(uprn=uprn, **row)
+                    for uprn in params for row in data.calendar(uprn)]
+        raise DatabaseError(f'The stand-in database has no answer for: '
+                            f'{sql.strip()[:60]}')
+
+    def _update(self, sql: str, params) -> list:
+        flag = 'gw_sent' if 'GWSacksLetterSent' in sql else 'rec_sent'
+        if 'ClaimedBy = ?' not in sql:
+            self.state.mark(params[0], flag)
+            return []
+        # Only the requests still leased to the worker are marked, and
+        # their case references returned
+        claim, *case_refs = params
+        marked = self.state.claimed(claim, time.time()) & \
+            self.state.unsent(flag)
+        rows = []
+        for case_ref in case_refs:
+            if case_ref in marked:
+                self.state.mark(case_ref, flag)
+                rows.append(Row(case_ref=case_ref))
+        self.rowcount = len(rows)
+        return rows
+
+    def _requests(self, sql: str, params, kind: str) -> list:
+        unsent = self.state.unsent(f'{kind}_sent')
+        cases = [case for case in self.database.missed
+                 if case[f'{kind}_requested'] and case['case_ref'] in unsent]
+        if 'ClaimedBy = ?' in sql:
+            claimed = self.state.claimed(params[0])
+            cases = [case for case in cases if case['case_ref'] in claimed]
+        return self._new(
+            sql, params, [self._request(case, kind == 'gw') for case in cases])
+
+    def _new(self, sql: str, params, rows: list) -> list:
+        # The watch mode statements take the most rows to return and the
+        # id to return them after
+        if 'TOP (?)' not in sql:
+            return rows
+        limit, watermark = params
+        return [row for row in rows if row.id > watermark][:limit]
+
+    def _request(self, case: dict, gw: bool) -> Row:
+        address = self.database.addresses[case['uprn']]
+        row = Row(
+            id=case['id'],
+            uprn=case['uprn'],
+            occupier='The Occupier',
+            address=address.block,
+            case_ref=case['case_ref'],
+            addr_str=address.postal)
+        if gw:
+            row.num_subs = self.database.subscriptions[case['uprn']]
+        return row
+
+    def _days(self, uprn: str, days: tuple) -> Row:
+        return Row(
+            uprn=uprn,
+            days_ref=days[0],
+            days_recy=days[1],
+            days_mix=days[2],
+            days_glass=days[3],
+            days_gw=days[4])
+
+    def _address(self, uprn) -> Row:
+        return Row(
+            occup='The Occupier',
+            uprn=str(uprn),
+            addr=self.database.addresses[str(uprn)].postal)
+
+    def _llpg(self, uprn: str) -> Row:
+        address = self.database.addresses[uprn]
+        return Row(
+            uprn=uprn,
+            checksum=address.checksum,
+            address_block=address.address_block,
+            addr_str=address.postal)
+
+    def _change(self, uprn: str) -> Row:
+        new = self.database.new_rounds[uprn]
+        return Row(
+            occup='The Occupier',
+            uprn=uprn,
+            addr=self.database.addresses[uprn].postal,
+            new_ref=new[0],
+            new_recy=new[1],
+            new_mix=new[2],
+            new_glass=new[3],
+            new_gw=new[4])
+
+    def _html_table(self, uprn: str) -> str:
+        # There is no p_pccQueryToHtmlTable here, so the table is built
+        # the way the running script builds its bulk tables. The script's
+        # check of its bulk tables against this query always passes here,
+        # and only tables captured from the database test build_html_table
+        script = sys.modules['__main__']
+        rows = [Row(**row) for row in self.database.calendar(uprn)]
+        return script.build_html_table(rows)
+
+
+class Connection():
+    """
+    Represents a connection to the stand-in database
+    """
+    def __init__(self, database, state):
+        self.database = database
+        self.state = state
+
+    def cursor(self) -> Cursor:
+        return Cursor(self.database, self.state)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect(**kwargs) -> Connection:
+    """
+    Opens a connection to DATABASE, sharing the state in SHARED if it is
+    set. The connection details are ignored
+    Returns:
+        (Connection): The connection
+    """
+    if DATABASE is None:
+        raise InterfaceError('The benchmark has not set up a database')
+    state = SharedState(SHARED) if SHARED else LocalState(DATABASE)
+    return Connection(DATABASE, state)
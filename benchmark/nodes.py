@@ -0,0 +1,110 @@
+"""
+nodes.py
+Runs several gen_html.py workers at once in claim mode, and checks that
+between them they sent every letter exactly once
+How to run:
+From the repository, run `py -3 -m benchmark.nodes --nodes 4 --scenario 10k`
+How it works:
+The sent flags and leases of the stand-in database are copied into a
+SQLite file, and each worker is started as its own process with the same
+Dataset, sharing the file. Every letter marked as sent is counted in the
+file, so once the workers finish any letter sent twice, or not at all,
+shows up there
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmark import fake_pyodbc, run, synthetic
+
+
+def start_worker(
+        number: int,
+        shared: str,
+        letters: int,
+        latency: float,
+        settings: dict) -> subprocess.Popen:
+    """
+    Args:
+        number (int): The number of the worker, used to name it
+        shared (str): The SQLite file the workers share
+        letters (int): The number of letters in the Dataset
+        latency (float): The seconds each stub conversion takes
+        settings (dict): Extra settings for the worker's config
+    Returns:
+        (subprocess.Popen): The worker's process, which prints its metrics
+        summary as JSON when it finishes
+    """
+    settings = dict(settings, claim=True, worker=f'node-{number}')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'benchmark.nodes',
+         '--worker', shared,
+         '--letters', str(letters),
+         '--latency', str(latency),
+         '--settings', json.dumps(settings)],
+        cwd=run.REPO,
+        stdout=subprocess.PIPE)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument(
+        '--nodes', type=int, default=4,
+        help='the number of workers to run at once (defaults to 4)')
+    parser.add_argument(
+        '--scenario', choices=run.SCENARIOS, default='1k',
+        help='the number of letters to produce (defaults to 1k)')
+    parser.add_argument(
+        '--latency', type=float, default=0.01,
+        help='the seconds each stub conversion takes (defaults to 0.01)')
+    parser.add_argument(
+        '--set', action='append', default=[], metavar='KEY=VALUE',
+        help='a setting to add to the config, with a JSON value')
+    # Used by the worker processes this starts
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--letters', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--settings', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        summary = run.run_script(
+            'gen_html',
+            args.letters,
+            json.loads(args.settings),
+            args.latency,
+            memory=False,
+            shared=args.worker)
+        print(json.dumps(summary))
+        return 0
+    settings = {}
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        settings[key] = json.loads(value)
+    letters = run.SCENARIOS[args.scenario]
+    shared = os.path.join(tempfile.mkdtemp(prefix='bench-nodes-'), 'state')
+    fake_pyodbc.DATABASE = synthetic.Dataset(letters)
+    fake_pyodbc.share(shared)
+    workers = [
+        start_worker(number, shared, letters, args.latency, settings)
+        for number in range(args.nodes)]
+    total = 0
+    seconds = 0.0
+    for number, worker in enumerate(workers):
+        output, _ = worker.communicate()
+        summary = json.loads(output.decode().splitlines()[-1])
+        print(f'node-{number}: {summary["letters"]} letters in '
+              f'{summary["seconds"]:.2f}s')
+        total += summary['letters']
+        seconds = max(seconds, summary['seconds'])
+    result = fake_pyodbc.shared_report(shared)
+    shutil.rmtree(os.path.dirname(shared), ignore_errors=True)
+    print(f'{args.nodes} nodes: {total} letters in {seconds:.2f}s '
+          f'({total / seconds:.0f} letters/s), {result["unsent"]} unsent, '
+          f'{result["duplicates"]} sent more than once')
+    return 1 if result['unsent'] or result['duplicates'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
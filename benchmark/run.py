@@ -0,0 +1,222 @@
+"""
+run.py
+Runs gen_html.py and new_rounds_gen_html.py offline and reports where the
+time and memory go
+How to run:
+From the repository, run `py -3 -m benchmark.run --scenario 10k`
+How it works:
+Each script is run as it would be from the command line, in a scratch
+directory with its own config, against the stand-in pyodbc and with
+wkhtmltopdf replaced by a stub that waits for a set time. The timings each
+script writes to its metrics file are read back, together with the peak
+memory tracemalloc saw, and compared against a saved baseline
+"""
+import os
+import io
+import sys
+import json
+import shutil
+import runpy
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from benchmark import fake_converter, fake_pyodbc, synthetic
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = {
+    'gen_html': ('gen_html.py', '.\\.config'),
+    'new_rounds_gen_html': ('new_rounds_gen_html.py', '.\\.config_chngs')}
+SCENARIOS = {'1k': 1000, '10k': 10000, '100k': 100000}
+BASELINE = os.path.join(REPO, 'benchmark', 'baseline.json')
+# How much slower than the baseline a stage can get before it counts as a
+# regression, and the smallest slow down in seconds that counts at all
+TOLERANCE = 0.2
+MIN_SECONDS = 0.05
+# The directories the scripts expect to exist on Windows
+DIRECTORIES = ['htmls/gw', 'htmls/rec', 'htmls/changes', 'htmls/css',
+               'pdfs/gw', 'pdfs/rec', 'pdfs/changes/out']
+
+
+def run_script(
+        script: str,
+        letters: int,
+        settings: dict,
+        latency: float,
+        memory: bool = True,
+        shared: str = None) -> dict:
+    """
+    Runs one script end to end against a fresh Dataset
+    Args:
+        script (str): A key of SCRIPTS
+        letters (int): The number of letters to produce
+        settings (dict): Extra settings for the script's config
+        latency (float): The seconds each stub conversion takes
+        memory (bool): Whether to trace memory use, which slows the run
+        shared (str): The SQLite file to keep the stand-in database's sent
+        flags and leases in, when other processes share them
+    Returns:
+        (dict): The script's metrics summary, with the peak memory of the
+        whole run added
+    """
+    file_name, config_name = SCRIPTS[script]
+    fake_pyodbc.DATABASE = synthetic.Dataset(letters)
+    fake_pyodbc.SHARED = shared
+    workdir = tempfile.mkdtemp(prefix=f'bench-{script}-')
+    metrics_path = os.path.join(workdir, 'metrics')
+    config = {
+        'driver': 'stand-in', 'server': 'stand-in', 'database': 'stand-in',
+        'uid': 'stand-in', 'pwd': 'stand-in',
+        'pdf_dir': 'pdfs', 'journal': False, 'metrics_path': metrics_path}
+    config.update(settings)
+    cwd = os.getcwd()
+    modules = dict(sys.modules)
+    try:
+        os.chdir(workdir)
+        for directory in DIRECTORIES:
+            os.makedirs(directory, exist_ok=True)
+        with open(config_name, 'w') as config_f:
+            json.dump(config, config_f)
+        sys.modules['pyodbc'] = fake_pyodbc
+        sys.path.insert(0, REPO)
+        import converter
+        converter.subprocess = fake_converter.FakeWkhtmltopdf(latency)
+        if memory:
+            tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(
+                os.path.join(REPO, file_name), run_name='__main__')
+        peak = tracemalloc.get_traced_memory()[1] if memory else 0
+        with open(f'{metrics_path}.json', 'r') as metrics_f:
+            summary = json.load(metrics_f)
+        summary['peak_memory'] = peak
+        return summary
+    finally:
+        tracemalloc.stop()
+        os.chdir(cwd)
+        sys.path.remove(REPO)
+        # The scripts' helper modules are imported fresh for every run
+        for name in list(sys.modules):
+            if name not in modules:
+                del sys.modules[name]
+        sys.modules.update(modules)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report(name: str, summary: dict) -> str:
+    """
+    Args:
+        name (str): The name of the run
+        summary (dict): The output of run_script()
+    Returns:
+        (str): The time and memory of each stage of the run
+    """
+    lines = [
+        f'{name}: {summary["letters"]} letters in '
+        f'{summary["seconds"]:.2f}s '
+        f'({summary["letters_per_second"]:.0f} letters/s), '
+        f'peak memory {summary["peak_memory"] / 2 ** 20:.1f} MB']
+    for stage, values in summary['stages'].items():
+        lines.append(
+            f'  {stage:<12} {values["count"]:>8} '
+            f'{values["total_seconds"]:>9.3f}s '
+            f'p95 {values["p95_seconds"] * 1000:>8.2f}ms '
+            f'{values["peak_memory"] / 2 ** 20:>8.1f} MB')
+    return '\n'.join(lines)
+
+
+def compare(name: str, summary: dict, baseline: dict) -> list:
+    """
+    Finds the stages of a run that got slower than the baseline
+    Args:
+        name (str): The name of the run
+        summary (dict): The output of run_script()
+        baseline (dict): The saved summary of the same run
+    Returns:
+        (list): A message for each regression, empty if there are none
+    """
+    regressions = []
+    timings = [('run', summary['seconds'], baseline['seconds'])]
+    for stage, values in summary['stages'].items():
+        if stage in baseline['stages']:
+            timings.append((
+                stage,
+                values['total_seconds'],
+                baseline['stages'][stage]['total_seconds']))
+    for stage, now, before in timings:
+        if now > before * (1 + TOLERANCE) and now - before > MIN_SECONDS:
+            regressions.append(
+                f'{name} {stage}: {now:.3f}s, baseline {before:.3f}s')
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument(
+        '--scenario', choices=SCENARIOS, action='append',
+        help='the number of letters to produce, can be given more than '
+             'once (defaults to 1k)')
+    parser.add_argument(
+        '--script', choices=SCRIPTS, action='append',
+        help='the script to run, can be given more than once '
+             '(defaults to both)')
+    parser.add_argument(
+        '--latency', type=float, default=0.01,
+        help='the seconds each stub conversion takes (defaults to 0.01)')
+    parser.add_argument(
+        '--query-latency', type=float, default=0.0,
+        help='the seconds each stand-in query takes (defaults to 0)')
+    parser.add_argument(
+        '--hang-every', type=int, default=0,
+        help='make every this many stub conversions hang until their '
+             'timeout (defaults to 0, none)')
+    parser.add_argument(
+        '--set', action='append', default=[], metavar='KEY=VALUE',
+        help='a setting to add to the config, with a JSON value')
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help="don't trace memory use, which makes the run faster")
+    parser.add_argument(
+        '--baseline', default=BASELINE,
+        help='the baseline file to compare against')
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='save these runs as the baseline instead of comparing')
+    args = parser.parse_args(argv)
+    settings = {}
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        settings[key] = json.loads(value)
+    fake_pyodbc.QUERY_LATENCY = args.query_latency
+    fake_converter.HANG_EVERY = args.hang_every
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_f:
+            baseline = json.load(baseline_f)
+    else:
+        baseline = {}
+    regressions = []
+    for scenario in args.scenario or ['1k']:
+        for script in args.script or list(SCRIPTS):
+            name = f'{script}-{scenario}'
+            summary = run_script(
+                script,
+                SCENARIOS[scenario],
+                settings,
+                args.latency,
+                not args.no_memory)
+            print(report(name, summary))
+            if args.save_baseline:
+                baseline[name] = summary
+            elif name in baseline:
+                regressions += compare(name, summary, baseline[name])
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_f:
+            json.dump(baseline, baseline_f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
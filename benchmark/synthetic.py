@@ -0,0 +1,148 @@
+"""
+synthetic.py
+Generates the data the benchmark's stand-in database serves
+How it works:
+A seeded random generator builds an LLPG address register, missed
+collection reports with their garden waste subscriptions, and the old and
+new collection rounds of a set of properties. The same seed always gives
+the same data, so runs can be compared with each other
+"""
+import zlib
+import random
+import datetime
+
+STREETS = ['High Street', 'Church Lane', 'Station Road', 'Mill Lane',
+           'Springfield Road', 'The Green', 'Northallerton Road',
+           'Thirsk Road', 'Bedale Road', 'Stokesley Road']
+TOWNS = [('Northallerton', 'DL6'), ('Thirsk', 'YO7'), ('Bedale', 'DL8'),
+         ('Stokesley', 'TS9'), ('Easingwold', 'YO61')]
+# The services in the order changes_info.sql selects their schedules
+SERVICES = ['REF', 'RECY', 'MIX', 'GLASS', 'GW']
+# The calendar column each service appears in
+CALENDAR = {'REF': 'Refuse', 'RECY': 'Recycling', 'MIX': 'Mix',
+            'GLASS': 'Glass', 'GW': 'Garden'}
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+# Mirrors the cut off in gw_address_info.sql and rec_address_info.sql
+CUTOFF = datetime.datetime(2018, 6, 7, 12)
+
+
+class Address():
+    """
+    Represents a property in the LLPG
+    """
+    def __init__(self, uprn: str, lines: list):
+        """
+        Args:
+            uprn (str): The UPRN of the property
+            lines (list): The lines of the postal address
+        """
+        self.uprn = uprn
+        self.lines = lines
+
+    @property
+    def block(self) -> str:
+        """
+        Returns:
+            (str): The address as gw_address_info.sql formats ADDRESS_BLOCK
+        """
+        return '<br>'.join(self.lines)
+
+    @property
+    def postal(self) -> str:
+        """
+        Returns:
+            (str): The address as ADDRESS_STR_ORG_POSTAL
+        """
+        return ', '.join(self.lines)
+
+    @property
+    def address_block(self) -> str:
+        """
+        Returns:
+            (str): The address as ADDRESS_BLOCK, with the county on a line
+            of its own before the postcode
+        """
+        return '\r\n'.join(self.lines[:-1] + ['North Yorkshire'] +
+                             self.lines[-1:])
+
+    @property
+    def checksum(self) -> int:
+        """
+        Returns:
+            (int): A signed 32 bit checksum of the address, standing in for
+            CHECKSUM() in llpg_checksums.sql
+        """
+        return zlib.crc32(self.address_block.encode()) - 2 ** 31
+
+
+class Dataset():
+    """
+    Represents every table the scripts read, for one benchmark scenario
+    """
+    def __init__(self, letters: int, seed: int = 0):
+        """
+        Args:
+            letters (int): The number of letters each script should produce
+            seed (int): The seed of the random generator
+        """
+        rand = random.Random(seed)
+        self.letters = letters
+        self.addresses = {}
+        for i in range(letters):
+            uprn = str(100000000000 + i)
+            town, postcode = rand.choice(TOWNS)
+            self.addresses[uprn] = Address(uprn, [
+                f'{rand.randint(1, 200)} {rand.choice(STREETS)}',
+                town,
+                f'{postcode} {rand.randint(1, 9)}{rand.choice("ABDEFGHJ")}'
+                f'{rand.choice("ABDEFGHJ")}'])
+        uprns = list(self.addresses)
+        self.missed = []
+        for i, uprn in enumerate(uprns):
+            gw = rand.random() < 0.6
+            self.missed.append({
+                'id': i + 100,
+                'case_ref': f'MC{i:07}',
+                'uprn': uprn,
+                'gw_requested': gw,
+                'rec_requested': not gw,
+                'gw_sent': False,
+                'rec_sent': False,
+                'added': CUTOFF - datetime.timedelta(minutes=i + 1)})
+        self.cases = {case['case_ref']: case for case in self.missed}
+        # Most properties have one licence, some have more
+        self.subscriptions = {
+            uprn: rand.choice([1, 1, 1, 1, 2, 3]) for uprn in uprns}
+        self.old_rounds = {}
+        self.new_rounds = {}
+        for uprn in uprns:
+            old = tuple(rand.randint(1, 10) for _ in SERVICES)
+            new = list(old)
+            new[rand.randrange(len(SERVICES))] = rand.randint(1, 10)
+            if tuple(new) == old:
+                new[0] = old[0] % 10 + 1
+            self.old_rounds[uprn] = old
+            self.new_rounds[uprn] = tuple(new)
+        self.week = datetime.date(2018, 11, 5)
+
+    def calendar(self, uprn: str) -> list:
+        """
+        Builds the rows tvfPropertyCollectionsCalendar_U_2 would return for
+        a property, which only depend on its new schedule days
+        Args:
+            uprn (str): The UPRN of the property
+        Returns:
+            (list): A dict of column values for each week
+        """
+        rows = []
+        for week in range(2):
+            start = self.week + datetime.timedelta(weeks=week)
+            row = {'WeekCommencing': start}
+            for service, day in zip(SERVICES, self.new_rounds[uprn]):
+                # Each service is collected fortnightly on odd or even weeks
+                if (day + week) % 2:
+                    row[CALENDAR[service]] = DAYS[day % len(DAYS)]
+                else:
+                    row[CALENDAR[service]] = ''
+            rows.append(row)
+        return rows
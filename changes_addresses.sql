@@ -0,0 +1,6 @@
+SELECT
+      'The Occupier' AS occup,
+      l.UPRN AS uprn,
+      l.ADDRESS_STR_ORG_POSTAL AS addr
+FROM dbo.MV_HDC_LLPG_ADDRESSES_CURRENT l
+WHERE l.UPRN IN (<uprns>)
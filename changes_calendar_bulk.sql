@@ -0,0 +1,27 @@
+DECLARE @backdatedBy varchar(4) = '-1'
+DECLARE @text varchar(4) = 'Y'
+DECLARE @numWeeks int = 2
+DECLARE @datelimit date = '2018-11-30'
+DECLARE @showCurrent varchar(4) = 'N'
+
+IF (DATEADD(WEEK, @numWeeks, GETDATE()) > @datelimit)
+	SET @numWeeks = DATEDIFF(ww, GETDATE(), @datelimit) + @backdatedBy
+
+SELECT
+	u.uprn,
+	c.WeekCommencing,
+	c.Refuse,
+	c.Recycling,
+	c.Mix,
+	c.Glass,
+	c.Garden
+FROM (
+	VALUES <uprns>
+) u (uprn)
+CROSS APPLY dbo.[tvfPropertyCollectionsCalendar_U_2] (
+	u.uprn,
+	@backdatedBy,
+	@numWeeks,
+	@text,
+	@showCurrent
+) c
\ No newline at end of file
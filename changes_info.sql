@@ -1,7 +1,12 @@
 SELECT
       'The Occupier' AS occup,
       a.UPRN AS uprn,
-      a.ADDRESS_STR_ORG_POSTAL AS addr
+      a.ADDRESS_STR_ORG_POSTAL AS addr,
+      a.newREF AS new_ref,
+      a.newRECY AS new_recy,
+      a.newMIX AS new_mix,
+      a.newGLASS AS new_glass,
+      a.newGW AS new_gw
 FROM
       (
 	SELECT
@@ -0,0 +1,65 @@
+"""
+connections.py
+Database connection pool shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+Connections are opened the first time they are needed, up to a fixed
+number, and handed back to the pool when a query is done with them. A
+pyodbc connection can only run one query at a time, so queries that run
+at the same time each take a connection of their own
+"""
+import queue
+import threading
+import contextlib
+
+# The number of connections to open at most
+POOL_SIZE = 2
+
+
+class ConnectionPool():
+    """
+    Represents a bounded set of connections to the database
+    """
+    def __init__(self, connect, size: int = POOL_SIZE):
+        """
+        Args:
+            connect (callable): Opens a new connection
+            size (int): The most connections to have open at once
+        """
+        self.connect = connect
+        self.size = size
+        self.opened = []
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Lends out a connection, waiting for one to be handed back if they
+        are all in use
+        Yields:
+            (pyodbc.Connection): The connection to run queries on
+        """
+        conn = None
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                if len(self.opened) < self.size:
+                    conn = self.connect()
+                    self.opened.append(conn)
+        if conn is None:
+            conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        """
+        Closes every connection the pool opened
+        """
+        with self.lock:
+            for conn in self.opened:
+                conn.close()
+            self.opened = []
+            self.idle = queue.LifoQueue()
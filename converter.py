@@ -0,0 +1,446 @@
+"""
+converter.py
+Shared wkhtmltopdf helpers used by gen_html.py and new_rounds_gen_html.py
+How it works:
+Runs wkhtmltopdf over a list of HTML files using a bounded pool of workers,
+returning the result of each conversion in the same order it was given.
+A job can also hand several HTML files to a single wkhtmltopdf process,
+which writes them out as consecutive pages of one PDF. A letter that is
+only held in memory, as a Document, is piped into wkhtmltopdf and its PDF
+read back from it, so its HTML never touches the disk. If a PdfCache is
+given, conversions it has already seen are copied from it instead.
+Each wkhtmltopdf process is killed if it runs past its deadline, and a
+conversion that fails is tried again after a growing wait. A letter that
+fails every attempt is handed back as a failed result for the script to
+add to its DeadLetters, and the rest of the run carries on
+"""
+import os
+import json
+import time
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+EXE = 'C:\\Program Files\\wkhtmltopdf\\bin\\wkhtmltopdf.exe'
+# The seconds wkhtmltopdf may spend on each HTML file before it is killed
+TIMEOUT = 60
+# The most seconds a process converting a batch of HTML files may run for
+BATCH_TIMEOUT = 10 * 60
+# The number of times a conversion is tried before it is given up on
+ATTEMPTS = 3
+# The seconds to wait before the first retry, doubled for each one after
+BACKOFF = 1.0
+
+
+class Document():
+    """
+    Represents a rendered letter that is held in memory instead of in an
+    HTML file
+    """
+    def __init__(self, html: str, key: str):
+        """
+        Args:
+            html (str): The HTML of the letter
+            key (str): Identifies the letter, like its case reference
+        """
+        self.html = html
+        self.key = key
+
+    def __str__(self) -> str:
+        return str(self.key)
+
+
+class ConversionResult():
+    """
+    Represents the outcome of converting a single HTML file to a PDF
+    """
+    def __init__(
+            self,
+            html: str,
+            pdf: str,
+            returncode: int,
+            cached: bool = False,
+            seconds: float = 0.0,
+            error: str = None):
+        """
+        Args:
+            html (str, Document or list): The path of the HTML file that
+            was converted, the Document, or the list of paths for a batch
+            pdf (str): The path of the PDF that was written
+            returncode (int): The exit code of the wkhtmltopdf process
+            cached (bool): True if the PDF was copied from the PDF cache
+            instead of being converted
+            seconds (float): How long the conversion took
+            error (str): Why wkhtmltopdf didn't finish, if it timed out or
+            couldn't be started
+        """
+        self.html = html
+        self.pdf = pdf
+        self.returncode = returncode
+        self.cached = cached
+        self.seconds = seconds
+        self.error = error
+        self.attempts = 1
+
+    @property
+    def ok(self) -> bool:
+        """
+        Returns:
+            (bool): True if wkhtmltopdf exited cleanly
+        """
+        return self.returncode == 0 and self.error is None
+
+    @property
+    def reason(self) -> str:
+        """
+        Returns:
+            (str): Why the conversion failed
+        """
+        return self.error or f'exit code {self.returncode}'
+
+    def __str__(self) -> str:
+        if self.cached:
+            return f'Converted {self.pdf} (cached)'
+        if self.ok:
+            return f'Converted {self.pdf}'
+        if isinstance(self.html, (str, Document)):
+            source = str(self.html)
+        else:
+            source = f'{len(self.html)} HTMLs for {self.pdf}'
+        if self.attempts > 1:
+            return f'Failed to convert {source} ({self.reason}, ' \
+                f'{self.attempts} attempts)'
+        return f'Failed to convert {source} ({self.reason})'
+
+
+class RetryPolicy():
+    """
+    Represents how long each conversion may take and how it is retried
+    """
+    def __init__(
+            self,
+            timeout: float = TIMEOUT,
+            attempts: int = ATTEMPTS,
+            backoff: float = BACKOFF,
+            batch_timeout: float = BATCH_TIMEOUT):
+        """
+        Args:
+            timeout (float): The seconds wkhtmltopdf may spend on each HTML
+            file before it is killed, or None to wait as long as it takes
+            attempts (int): The number of times a conversion is tried
+            backoff (float): The seconds to wait before the first retry,
+            doubled for each one after
+            batch_timeout (float): The most seconds a process converting a
+            batch may run for, however many files it has, or None for no
+            limit
+        """
+        self.timeout = timeout
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.batch_timeout = batch_timeout
+
+    def deadline(self, pages: int) -> float:
+        """
+        Args:
+            pages (int): The number of HTML files one process converts
+        Returns:
+            (float): The seconds the process may run, or None. A batch gets
+            timeout for each file, up to batch_timeout, but never less than
+            a single file gets
+        """
+        if not self.timeout:
+            return None
+        if not self.batch_timeout:
+            return self.timeout * pages
+        return min(self.timeout * pages, max(self.timeout, self.batch_timeout))
+
+    def delay(self, attempt: int) -> float:
+        """
+        Args:
+            attempt (int): The number of the attempt that just failed
+        Returns:
+            (float): The seconds to wait before trying again
+        """
+        return self.backoff * 2 ** (attempt - 1)
+
+
+class DeadLetters():
+    """
+    Represents the letters that still failed to convert after every
+    attempt, or whose files couldn't be written or published
+    """
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The path of the JSON file to list the letters in
+        """
+        self.path = path
+        # The failure of each letter, by key
+        self.letters = {}
+
+    def __len__(self) -> int:
+        return len(self.letters)
+
+    def __contains__(self, key) -> bool:
+        return str(key) in self.letters
+
+    def __str__(self) -> str:
+        if not self.letters:
+            return 'Every letter converted'
+        return f'{len(self)} letters failed, listed in {self.path}'
+
+    def add(self, key, result: ConversionResult):
+        """
+        Args:
+            key: Identifies the letter, like its case reference or UPRN
+            result (ConversionResult): The last failed attempt
+        """
+        self.letters[str(key)] = {
+            'key': str(key),
+            'pdf': result.pdf,
+            'reason': result.reason,
+            'attempts': result.attempts}
+
+    def discard(self, key):
+        """
+        Args:
+            key: Identifies a letter that has since converted
+        """
+        self.letters.pop(str(key), None)
+
+    def write(self) -> str:
+        """
+        Writes the list, or removes the one left by an earlier run if every
+        letter converted this time
+        Returns:
+            (str): A summary of the dead letters
+        """
+        if self.letters:
+            with open(self.path, 'w') as dead_f:
+                json.dump(list(self.letters.values()), dead_f, indent=2)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        return str(self)
+
+
+def default_workers() -> int:
+    """
+    Returns:
+        (int): The number of workers to use when none is configured
+    """
+    return os.cpu_count() or 1
+
+
+def convert_one(
+        html,
+        pdf: str,
+        flags: list,
+        cache=None,
+        timeout: float = None) -> ConversionResult:
+    """
+    Converts a single HTML file, or a batch of them, to a PDF
+    Args:
+        html (str, Document or list): The path of the HTML file to
+        convert, a Document to pipe into wkhtmltopdf, or a list of paths to
+        render as consecutive pages of the same PDF
+        pdf (str): The path to write the PDF to
+        flags (list): The command line flags to pass to wkhtmltopdf
+        cache (PdfCache): The PDFs converted by earlier runs, if any
+        timeout (float): The seconds to let wkhtmltopdf run before killing
+        it, or None to wait as long as it takes
+    Returns:
+        (ConversionResult): The outcome of the conversion
+    """
+    start = time.perf_counter()
+    htmls = [html] if isinstance(html, (str, Document)) else list(html)
+    if cache:
+        key = cache.key([source(html) for html in htmls], flags)
+        if cache.fetch(key, pdf):
+            return ConversionResult(
+                html, pdf, 0, True, time.perf_counter() - start)
+    try:
+        if isinstance(html, Document):
+            returncode = pipe_one(html, pdf, flags, timeout)
+        else:
+            args = [EXE] + flags + htmls + [pdf]
+            print(subprocess.list2cmdline(args))
+            returncode = subprocess.call(args, shell=False, timeout=timeout)
+    # The process has already been killed by the time this is raised
+    except subprocess.TimeoutExpired:
+        return ConversionResult(
+            html, pdf, None, seconds=time.perf_counter() - start,
+            error=f'timed out after {timeout:g}s')
+    except OSError as error:
+        return ConversionResult(
+            html, pdf, None, seconds=time.perf_counter() - start,
+            error=str(error))
+    if cache and returncode == 0:
+        cache.store(key, pdf)
+    return ConversionResult(
+        html, pdf, returncode, seconds=time.perf_counter() - start)
+
+
+def convert_retrying(
+        html,
+        pdf: str,
+        flags: list,
+        cache=None,
+        policy: RetryPolicy = None) -> ConversionResult:
+    """
+    Converts a single HTML file, or a batch of them, trying again after a
+    wait each time it fails. The PDF of a conversion that never succeeds is
+    removed, so a half-written file is never published or merged
+    Args:
+        html (str, Document or list): As for convert_one()
+        pdf (str): The path to write the PDF to
+        flags (list): The command line flags to pass to wkhtmltopdf
+        cache (PdfCache): The PDFs converted by earlier runs, if any
+        policy (RetryPolicy): The deadline and retries, defaults to
+        RetryPolicy()
+    Returns:
+        (ConversionResult): The outcome of the last attempt, with how long
+        every attempt took between them
+    """
+    policy = policy or RetryPolicy()
+    pages = 1 if isinstance(html, (str, Document)) else len(html)
+    start = time.perf_counter()
+    for attempt in range(1, policy.attempts + 1):
+        result = convert_one(html, pdf, flags, cache, policy.deadline(pages))
+        if result.ok or attempt == policy.attempts:
+            break
+        delay = policy.delay(attempt)
+        print(f'{result}, retrying in {delay:.1f}s')
+        time.sleep(delay)
+    result.attempts = attempt
+    result.seconds = time.perf_counter() - start
+    if not result.ok and os.path.exists(pdf):
+        os.remove(pdf)
+    return result
+
+
+def pipe_one(
+        document: Document,
+        pdf: str,
+        flags: list,
+        timeout: float = None) -> int:
+    """
+    Converts a letter held in memory by writing it to wkhtmltopdf's stdin
+    and reading the PDF from its stdout
+    Args:
+        document (Document): The letter to convert
+        pdf (str): The path to write the PDF to
+        flags (list): The command line flags to pass to wkhtmltopdf
+        timeout (float): The seconds to let wkhtmltopdf run before killing
+        it, or None to wait as long as it takes
+    Returns:
+        (int): The exit code of the wkhtmltopdf process
+    """
+    args = [EXE] + flags + ['--encoding', 'utf-8', '-', '-']
+    print(f'{subprocess.list2cmdline(args)} ({document} to {pdf})')
+    process = subprocess.run(
+        args,
+        input=document.html.encode('utf-8'),
+        stdout=subprocess.PIPE,
+        timeout=timeout)
+    if process.returncode == 0:
+        with open(pdf, 'wb') as pdf_f:
+            pdf_f.write(process.stdout)
+    return process.returncode
+
+
+def source(html) -> bytes:
+    """
+    Args:
+        html (str or Document): The path of an HTML file, or a Document
+    Returns:
+        (bytes): The HTML being converted
+    """
+    if isinstance(html, Document):
+        return html.html.encode('utf-8')
+    with open(html, 'rb') as html_f:
+        return html_f.read()
+
+
+def convert_all(
+        jobs: list,
+        flags: list,
+        workers: int = None,
+        cache=None,
+        policy: RetryPolicy = None) -> list:
+    """
+    Converts many HTML files to PDFs using a bounded pool of workers
+    Args:
+        jobs (list): A list of (html, pdf) path tuples to convert, where
+        html may be a list of paths to convert in one process
+        flags (list): The command line flags to pass to wkhtmltopdf
+        workers (int): The maximum number of wkhtmltopdf processes to run
+        at once, defaults to the number of CPUs
+        cache (PdfCache): The PDFs converted by earlier runs, if any
+        policy (RetryPolicy): The deadline and retries of each job,
+        defaults to RetryPolicy()
+    Returns:
+        (list): A ConversionResult for each job, in the same order as jobs
+    """
+    return list(convert_stream(jobs, flags, workers, cache, policy))
+
+
+def convert_stream(
+        jobs,
+        flags: list,
+        workers: int = None,
+        cache=None,
+        policy: RetryPolicy = None):
+    """
+    Converts HTML files to PDFs as the jobs arrive, only reading ahead
+    enough jobs to keep every worker busy
+    Args:
+        jobs (iterable): (html, pdf) path tuples to convert, which may be a
+        generator that is still producing them
+        flags (list): The command line flags to pass to wkhtmltopdf
+        workers (int): The maximum number of wkhtmltopdf processes to run
+        at once, defaults to the number of CPUs
+        cache (PdfCache): The PDFs converted by earlier runs, if any
+        policy (RetryPolicy): The deadline and retries of each job,
+        defaults to RetryPolicy()
+    Yields:
+        (ConversionResult): The result of each job, in the same order as jobs
+    """
+    if not workers:
+        workers = default_workers()
+    pending = deque()
+    # Each worker only waits on a subprocess, so threads are enough here
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for html, pdf in jobs:
+            pending.append(
+                pool.submit(
+                    convert_retrying, html, pdf, flags, cache, policy))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def chunk(items: list, size: int) -> list:
+    """
+    Splits a list into consecutive chunks
+    Args:
+        items (list): The list to split
+        size (int): The maximum length of each chunk
+    Returns:
+        (list): A list of lists, each at most size long
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def retry_policy(config: dict) -> RetryPolicy:
+    """
+    Args:
+        config (dict): The settings from .config or .config_chngs
+    Returns:
+        (RetryPolicy): The deadline and retries from the settings
+    """
+    return RetryPolicy(
+        config.get('convert_timeout', TIMEOUT),
+        config.get('convert_attempts', ATTEMPTS),
+        config.get('convert_backoff', BACKOFF),
+        config.get('convert_batch_timeout', BATCH_TIMEOUT))
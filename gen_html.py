@@ -7,12 +7,198 @@ How it works:
 Generates an HTML file and uses wkhtmltopdf to convert it to a PDF
 """
 import os
-import glob
-import subprocess
 import datetime
 import sys
+import time
 import json
+import math
+import shutil
+import socket
+import itertools
+from collections import deque
 import pyodbc
+import address_index
+import connections
+import converter
+import journal
+import letter_templates
+import metrics
+import output_sink
+import overlay
+import pdf_cache
+import pipeline
+import run_log
+import statements
+
+FLAGS = ['--disable-smart-shrinking', '--enable-local-file-access',
+         '-B', '25.4mm', '-L', '25.4mm', '-R', '25.4mm', '-T', '25.4mm']
+
+GW_CONTENT = '' \
+    '<br>\n' \
+    '<br>\n' \
+    '<br>\n' \
+    '<br>\n' \
+    '<p>\n' \
+    'Further to your report of a missed garden waste bin collection, ' \
+    'you are probably aware that from 4 June refuse, recycling and ' \
+    'garden waste collections were revised to improve the efficiency ' \
+    'of the service. These changes involve new collection routes with ' \
+    'different drivers and have resulted in occasional missed ' \
+    'collections.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Unfortunately we are unable to return to collect your bin(s), ' \
+    'however please find enclosed three sacks for your garden waste. ' \
+    'Please place one of the enclosed stickers on each sack so that the ' \
+    'licence can be seen by the collection crews. Please ensure sacks ' \
+    'are tied, intact and not overflowing.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Please present filled sacks alongside your green wheeled bin by ' \
+    '6am on your collection day. Please ensure that your green waste ' \
+    'bin(s) correctly display current garden waste licences using the ' \
+    'ties provided.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Please refer to your collection day postcard or visit ' \
+    'hambleton.gov.uk to check collection day details and for other ' \
+    'information.\n' \
+    '<p>\n' \
+    'Thank you for your patience during this time.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    '<strong>Hambleton District Council</strong>\n' \
+    '<br>\n' \
+    '01609 779977\n' \
+    '<br>\n' \
+    'info@hambleton.gov.uk\n' \
+    '</p>\n'
+
+REC_CONTENT = '' \
+    '<br>\n' \
+    '<br>\n' \
+    '<br>\n' \
+    '<br>\n' \
+    '<p>\n' \
+    'Further to your report of a missed recycling bin collection. As ' \
+    'you are most probably aware as of 4 June refuse, recycling and ' \
+    'garden waste collections have been revised to improve the ' \
+    'efficiency of the service. These changes involve new collection ' \
+    'routes with different drivers and have resulted in occasional ' \
+    'missed collections.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Unfortunately we are unable to return to collect your bin(s), ' \
+    'however please find enclosed two clear recycling sacks which can ' \
+    'be used to contain extra recycling which can’t fit into your blue ' \
+    'lidded bin.\n ' \
+    '</p>\n' \
+    '<p>\n' \
+    'Please ensure sacks are tied, intact and not overflowing.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Please present filled sacks alongside your recycling bin by 06:00 ' \
+    'on your collection day.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Please note this is the only type of plastic bag which can be used ' \
+    'to contain your recycling, all other forms of plastic bags such as ' \
+    'shopping bags or black plastic bin bags are not recyclable on our ' \
+    'kerbside collection scheme and must be kept out of your recycling ' \
+    'bin.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Please refer to your collection day postcard or visit ' \
+    'hambleton.gov.uk to check collect day details and for other ' \
+    'information.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Thank you for your patience during this time.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    '<strong>Hambleton District Council</strong>\n' \
+    '<br>\n' \
+    '01609 779977\n' \
+    '<br>\n' \
+    'info@hambleton.gov.uk\n' \
+    '</p>\n'
+
+CSS = '' \
+    'body {\n' \
+    'font-family: sans-serif;\n' \
+    '}\n' \
+    'h1 {\n' \
+    'font-weight: normal;\n' \
+    'text-align: center;\n' \
+    'font-size: 36pt;\n' \
+    'text-decoration: underline;\n' \
+    '}\n' \
+    ' p {\n' \
+    'font-size: 13pt;\n' \
+    '}' \
+    '.addr {\n' \
+    'font-weight: bold;\n' \
+    'padding-top: 70px;\n' \
+    'font-size: 18px;\n' \
+    '}\n' \
+    '.content {\n' \
+    'font-family: "Calibri"\n' \
+    '}\n'
+
+LETTER = '' \
+    '<!DOCTYPE html>\n' \
+    '<html>\n' \
+    '<head>\n' \
+    '{{stylesheet}}\n' \
+    '</head>\n' \
+    '<body>\n' \
+    '<section>\n' \
+    '<div class="addr">\n' \
+    '{{occup}}<br>\n' \
+    '{{addr}}\n' \
+    '</div>\n' \
+    '<div class="content">\n' \
+    '{{content}}\n' \
+    '</div>\n' \
+    '</section>\n' \
+    '</body>\n' \
+    '</html>'
+
+STYLESHEET = '.\\htmls\\css\\missed_bin_letters.css'
+# Gives the address block a fixed height in overlay mode, so the body of
+# the letter doesn't move with the number of address lines
+OVERLAY_CSS = '' \
+    '<style>\n' \
+    '.addr {\n' \
+    'height: 55mm;\n' \
+    'padding-top: 18mm;\n' \
+    'box-sizing: border-box;\n' \
+    '}\n' \
+    '</style>'
+# The millimetres from the left and top edges of the page to the first
+# address line, the page margin plus the padding in OVERLAY_CSS
+ADDRESS_LEFT = 25.4
+ADDRESS_TOP = 25.4 + 18
+
+# The most new requests of each kind handled at once in watch mode
+WATCH_BATCH_SIZE = 20
+# The seconds watch mode waits between polls for new requests
+WATCH_INTERVAL = 5
+# The number of batches watch mode tries a letter that failed every
+# conversion attempt in, before moving the watermark past it
+WATCH_ATTEMPTS = 3
+# The most rows of Missed_Collections each worker leases at once
+CLAIM_BATCH_SIZE = 50
+# The seconds a worker's lease lasts before other workers can take it over
+CLAIM_LEASE = 600
+# Whether letters are piped to wkhtmltopdf instead of saved as HTML files
+IN_MEMORY = False
+# The local addresses looked up by UPRN, if the address index is used
+ADDRESSES = None
+# Moves PDFs directly to Y: drive
+PDF_DIR = '\\\\wilma\\shared\\Groups and Services\\WaSS\\' \
+    'Route Optimisation\\missed bins\\sack letters\\pdfs'
+
 
 class Request():
     """
@@ -31,6 +217,14 @@ class Request():
         self.addr_str = addr_str
         self.case_ref = case_ref
 
+    @property
+    def key(self) -> str:
+        """
+        Returns:
+            (str): The key of the request's letter in the journal
+        """
+        return f'{self.req_type}-{self.case_ref}'
+
 
 class GardenWasteRequest(Request):
     """
@@ -74,20 +268,28 @@ def query_gw_requests() -> list:
         A list of GardenWasteRequest objects containing the information
         from the query
     """
-    gw_requests = []
-    with open('.\\gw_address_info.sql', 'r') as gw_query_f:
-        gw_query = gw_query_f.read()
-    cursor = CONN.cursor()
-    cursor.execute(gw_query)
-    results = cursor.fetchall()
-    for result in results:
-        gw_requests.append(GardenWasteRequest(
+    return list(iter_gw_requests())
+
+def iter_gw_requests(
+        fetch_size: int = pipeline.FETCH_SIZE,
+        conn: pyodbc.Connection = None):
+    """
+    Queries the SQL database for the addresses of people who requested
+    garden waste sacks, reading the results a batch at a time
+    Args:
+        fetch_size (int): The number of rows to read at a time
+        conn (pyodbc.Connection): The connection to run the query on,
+        defaults to CONN
+    Yields:
+        (GardenWasteRequest): The information from each row of the query
+    """
+    for result, address, addr_str in request_rows('gw', fetch_size, conn):
+        yield GardenWasteRequest(
             result.occupier,
-            result.address,
-            result.addr_str,
+            address,
+            addr_str,
             result.case_ref,
-            result.num_subs))
-    return gw_requests
+            result.num_subs)
 
 def query_rec_requests() -> list:
     """
@@ -97,19 +299,267 @@ def query_rec_requests() -> list:
         A list of RecyclingRequest objects containing the information from
         the query
     """
-    rec_requests = []
-    with open('.\\rec_address_info.sql', 'r') as rec_query_f:
-        rec_query = rec_query_f.read()
-    cursor = CONN.cursor()
-    cursor.execute(rec_query)
-    results = cursor.fetchall()
-    for result in results:
-        rec_requests.append(RecyclingRequest(
+    return list(iter_rec_requests())
+
+def iter_rec_requests(
+        fetch_size: int = pipeline.FETCH_SIZE,
+        conn: pyodbc.Connection = None):
+    """
+    Queries the SQL database for the addresses of people who requested
+    recycling sacks, reading the results a batch at a time
+    Args:
+        fetch_size (int): The number of rows to read at a time
+        conn (pyodbc.Connection): The connection to run the query on,
+        defaults to CONN
+    Yields:
+        (RecyclingRequest): The information from each row of the query
+    """
+    for result, address, addr_str in request_rows('rec', fetch_size, conn):
+        yield RecyclingRequest(
             result.occupier,
-            result.address,
-            result.addr_str,
-            result.case_ref))
-    return rec_requests
+            address,
+            addr_str,
+            result.case_ref)
+
+def request_rows(
+        req_type: str,
+        fetch_size: int = pipeline.FETCH_SIZE,
+        conn: pyodbc.Connection = None):
+    """
+    Runs the query for one type of request, reading the results a batch at
+    a time. With the address index loaded, the query only gets each
+    request's UPRN and its address is looked up locally instead. Requests
+    for properties not in the LLPG are left out either way
+    Args:
+        req_type (str): 'gw' or 'rec'
+        fetch_size (int): The number of rows to read at a time
+        conn (pyodbc.Connection): The connection to run the query on,
+        defaults to CONN
+    Yields:
+        (tuple): Each row of the query, with its address and its address
+        with commas instead of <br> tags
+    """
+    name = 'address_info' if ADDRESSES is None else 'uprn_info'
+    with METRICS.time('query', count=0):
+        cursor = SQL.execute(conn or CONN, f'{req_type}_{name}')
+    rows = METRICS.iterate(
+        'fetch', pipeline.fetch_batches(cursor, fetch_size))
+    if ADDRESSES is None:
+        for result in rows:
+            yield result, result.address, result.addr_str
+        return
+    # Properties missing from the index are fetched on CONN, which can't
+    # run another query until this one's results have all been read
+    if conn is None:
+        rows = list(rows)
+    for batch in pipeline.batched(rows, fetch_size):
+        ADDRESSES.resolve([result.uprn for result in batch], fetch_addresses)
+        for result in batch:
+            address = ADDRESSES.get(result.uprn)
+            if address is not None:
+                yield (result,) + address
+
+def fetch_addresses(uprns: list, conn: pyodbc.Connection = None) -> list:
+    """
+    Args:
+        uprns (list): The UPRNs to fetch the addresses of
+        conn (pyodbc.Connection): The connection to run the query on,
+        defaults to CONN
+    Returns:
+        (list): The (uprn, checksum, ADDRESS_BLOCK, postal address) of each
+        property found in the LLPG
+    """
+    placeholders = ', '.join(['?'] * len(uprns))
+    with METRICS.time('addresses', count=len(uprns)):
+        cursor = SQL.execute(
+            conn or CONN, 'llpg_addresses', *uprns, uprns=placeholders)
+        return [(row.uprn, row.checksum, row.address_block, row.addr_str)
+                for row in cursor.fetchall()]
+
+def load_addresses(
+        path: str,
+        max_age: float = address_index.MAX_AGE) -> address_index.AddressIndex:
+    """
+    Loads the address index, refreshing it from the LLPG first if it is
+    older than max_age
+    Args:
+        path (str): The path of the index file
+        max_age (float): The seconds the index is used for before it is
+        refreshed
+    Returns:
+        (AddressIndex): The addresses of the properties in the LLPG
+    """
+    index = address_index.AddressIndex.load(path)
+    if index.stale(max_age):
+        cursor = SQL.execute(CONN, 'llpg_checksums')
+        rows = pipeline.fetch_rows(cursor)
+        fetched = index.refresh(
+            ((row.uprn, row.checksum) for row in rows), fetch_addresses)
+        index.save(path)
+        LOG.event('addresses', f'Refreshed {path}', fetched=fetched)
+    return index
+
+def compile_templates() -> dict:
+    """
+    Writes the shared stylesheet and compiles the letter for each type of
+    request, so each letter only needs its address filling in
+    Returns:
+        (dict): The Template for each request type
+    """
+    stylesheet = letter_templates.write_stylesheet(STYLESHEET, CSS)
+    letter = letter_templates.Template(LETTER).bind(stylesheet=stylesheet)
+    return {
+        'gw': letter.bind(content=GW_CONTENT),
+        'rec': letter.bind(content=REC_CONTENT)}
+
+def compile_overlays() -> dict:
+    """
+    Converts the body of the letter for each type of request once, with an
+    empty address block, for the addresses to be stamped onto
+    Returns:
+        (dict): The Overlay for each request type
+    """
+    stylesheet = letter_templates.stylesheet_link(STYLESHEET)
+    letter = letter_templates.Template(LETTER).bind(
+        stylesheet=f'{stylesheet}\n{OVERLAY_CSS}', occup='', addr='')
+    overlays = {}
+    for req_type, content in [('gw', GW_CONTENT), ('rec', REC_CONTENT)]:
+        body = converter.Document(
+            letter.bind(content=content).render(), f'{req_type}-body')
+        pdf = f'.\\htmls\\{req_type}\\body.pdf'
+        result = converter.convert_retrying(
+            body, pdf, FLAGS, PDF_CACHE, POLICY)
+        print(result)
+        if not result.ok:
+            log_error(IOError(f'Failed to convert the {req_type} letter body'))
+        with open(pdf, 'rb') as pdf_f:
+            overlays[req_type] = overlay.Overlay(
+                pdf_f.read(), ADDRESS_LEFT, ADDRESS_TOP)
+        os.remove(pdf)
+    return overlays
+
+def iter_requests(fetch_size: int = pipeline.FETCH_SIZE):
+    """
+    Runs the garden waste and recycling queries at the same time, each on
+    its own connection from POOL, so the run only waits as long as the
+    slower of the two
+    Args:
+        fetch_size (int): The number of rows to read at a time
+    Yields:
+        (Request): The requests from either query, as soon as they are read
+    """
+    def query(iter_requests):
+        with POOL.connection() as conn:
+            yield from iter_requests(fetch_size, conn)
+
+    return pipeline.merge([
+        query(iter_gw_requests),
+        query(iter_rec_requests)])
+
+def poll_requests(watermark: int, limit: int) -> tuple:
+    """
+    Queries the SQL database for the requests added after the high
+    watermark, at most limit of each kind
+    Args:
+        watermark (int): The id of the last request already handled
+        limit (int): The most requests of each kind to read
+    Returns:
+        (tuple): The new requests in id order as (id, Request) tuples, and
+        the id they are complete up to
+    """
+    queries = [
+        ('gw_address_new', lambda row: GardenWasteRequest(
+            row.occupier, row.address, row.addr_str, row.case_ref,
+            row.num_subs)),
+        ('rec_address_new', lambda row: RecyclingRequest(
+            row.occupier, row.address, row.addr_str, row.case_ref))]
+    polled = []
+    # A query that hit the limit may have more requests after its last
+    # one, which the other query's requests can't be allowed to skip
+    complete = None
+    for name, request in queries:
+        start = time.perf_counter()
+        rows = SQL.execute(CONN, name, limit, watermark).fetchall()
+        METRICS.record('query', time.perf_counter() - start, len(rows))
+        for row in rows:
+            polled.append((row.id, request(row)))
+        if len(rows) == limit:
+            last = rows[-1].id
+            complete = last if complete is None else min(complete, last)
+    if complete is None:
+        complete = max([watermark] + [id_ for id_, _ in polled])
+    polled = sorted(
+        [(id_, request) for id_, request in polled if id_ <= complete],
+        key=lambda polled_request: polled_request[0])
+    return polled, complete
+
+def read_watermark(path: str) -> int:
+    """
+    Args:
+        path (str): The path of the watermark file
+    Returns:
+        (int): The id to poll for requests after in watch mode, or 0 if
+        there is no watermark yet. If an earlier run moved past letters
+        that failed to convert, it is just before the first of them, so
+        they are tried again
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r') as watermark_f:
+        watermark = json.load(watermark_f)
+    if watermark.get('retry') is not None:
+        return min(watermark['id'], watermark['retry'] - 1)
+    return watermark['id']
+
+def write_watermark(path: str, watermark: int, retry: int = None) -> None:
+    """
+    Saves the watermark under a temporary name first, so it is never left
+    half written
+    Args:
+        path (str): The path of the watermark file
+        watermark (int): The id of the last request handled
+        retry (int): The id of the first request the watermark moved past
+        without sending its letter, for the next run to try again
+    """
+    with open(f'{path}.tmp', 'w') as watermark_f:
+        json.dump({'id': watermark, 'retry': retry}, watermark_f)
+    os.replace(f'{path}.tmp', path)
+
+def unfinished(requests, done: list):
+    """
+    Skips the requests whose letters were converted by an interrupted run,
+    so only unfinished letters are rendered and converted again. In stream
+    mode this runs on the thread reading the queries, so it leaves
+    publishing the skipped letters to publish_resumed()
+    Args:
+        requests (iterable): The requests from the queries
+        done (list): Collects the requests whose letters were already
+        converted
+    Yields:
+        (Request): The requests that still need a letter
+    """
+    for request in requests:
+        if JOURNAL.reached(request.key, 'converted'):
+            done.append(request)
+        else:
+            JOURNAL.record(request.key, 'queried')
+            yield request
+
+def publish_resumed(done: list, start: int = 0) -> int:
+    """
+    Hands the letters converted by an interrupted run that weren't
+    published to the output sink
+    Args:
+        done (list): The requests unfinished() skipped
+        start (int): The number of them already handled
+    Returns:
+        (int): The number of them handled, to pass as start next time
+    """
+    end = len(done)
+    for request in done[start:end]:
+        if not JOURNAL.reached(request.key, 'published'):
+            publish(request)
+    return end
 
 def create_html(request: Request) -> str:
     """
@@ -120,251 +570,681 @@ def create_html(request: Request) -> str:
     Returns:
         (str): The HTML template with the information filed in
     """
-    if isinstance(request, GardenWasteRequest):
-        content = '' \
-        '<br>\n' \
-        '<br>\n' \
-        '<br>\n' \
-        '<br>\n' \
-        '<p>\n' \
-        'Further to your report of a missed garden waste bin collection, ' \
-        'you are probably aware that from 4 June refuse, recycling and ' \
-        'garden waste collections were revised to improve the efficiency ' \
-        'of the service. These changes involve new collection routes with ' \
-        'different drivers and have resulted in occasional missed ' \
-        'collections.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Unfortunately we are unable to return to collect your bin(s), ' \
-        'however please find enclosed three sacks for your garden waste. ' \
-        'Please place one of the enclosed stickers on each sack so that the ' \
-        'licence can be seen by the collection crews. Please ensure sacks ' \
-        'are tied, intact and not overflowing.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Please present filled sacks alongside your green wheeled bin by ' \
-        '6am on your collection day. Please ensure that your green waste ' \
-        'bin(s) correctly display current garden waste licences using the ' \
-        'ties provided.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Please refer to your collection day postcard or visit ' \
-        'hambleton.gov.uk to check collection day details and for other ' \
-        'information.\n' \
-        '<p>\n' \
-        'Thank you for your patience during this time.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        '<strong>Hambleton District Council</strong>\n' \
-        '<br>\n' \
-        '01609 779977\n' \
-        '<br>\n' \
-        'info@hambleton.gov.uk\n' \
-        '</p>\n'
-    elif isinstance(request, RecyclingRequest):
-        content = '' \
-        '<br>\n' \
-        '<br>\n' \
-        '<br>\n' \
-        '<br>\n' \
-        '<p>\n' \
-        'Further to your report of a missed recycling bin collection. As ' \
-        'you are most probably aware as of 4 June refuse, recycling and ' \
-        'garden waste collections have been revised to improve the ' \
-        'efficiency of the service. These changes involve new collection ' \
-        'routes with different drivers and have resulted in occasional ' \
-        'missed collections.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Unfortunately we are unable to return to collect your bin(s), ' \
-        'however please find enclosed two clear recycling sacks which can ' \
-        'be used to contain extra recycling which can’t fit into your blue ' \
-        'lidded bin.\n ' \
-        '</p>\n' \
-        '<p>\n' \
-        'Please ensure sacks are tied, intact and not overflowing.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Please present filled sacks alongside your recycling bin by 06:00 ' \
-        'on your collection day.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Please note this is the only type of plastic bag which can be used ' \
-        'to contain your recycling, all other forms of plastic bags such as ' \
-        'shopping bags or black plastic bin bags are not recyclable on our ' \
-        'kerbside collection scheme and must be kept out of your recycling ' \
-        'bin.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Please refer to your collection day postcard or visit ' \
-        'hambleton.gov.uk to check collect day details and for other ' \
-        'information.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Thank you for your patience during this time.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        '<strong>Hambleton District Council</strong>\n' \
-        '<br>\n' \
-        '01609 779977\n' \
-        '<br>\n' \
-        'info@hambleton.gov.uk\n' \
-        '</p>\n'
-    html = '' \
-        '<!DOCTYPE html>\n' \
-        '<html>\n' \
-        '<head>\n' \
-        '<style>\n' \
-        'body {\n' \
-        'font-family: sans-serif;\n' \
-        '}\n' \
-        'h1 {\n' \
-        'font-weight: normal;\n' \
-        'text-align: center;\n' \
-        'font-size: 36pt;\n' \
-        'text-decoration: underline;\n' \
-        '}\n' \
-        ' p {\n' \
-        'font-size: 13pt;\n' \
-        '}' \
-        '.addr {\n' \
-        'font-weight: bold;\n' \
-        'padding-top: 70px;\n' \
-        'font-size: 18px;\n' \
-        '}\n' \
-        '.content {\n' \
-        'font-family: "Calibri"\n' \
-        '}\n' \
-        '</style>\n' \
-        '</head>\n' \
-        '<body>\n' \
-        '<section>\n' \
-        '<div class="addr">\n' \
-       f'{request.occup}<br>\n' \
-       f'{request.addr}\n' \
-        '</div>\n' \
-        '<div class="content">\n' \
-       f'{content}\n' \
-        '</div>\n' \
-        '</section>\n' \
-        '</body>\n' \
-        '</html>'
-    return html
-
-def save_html(html: str, request: Request) -> None:
-    """
-    Writes the HTML to file, creating additional files for properties with
-    more than one garden waste subscription
+    with METRICS.time('render'):
+        return TEMPLATES[request.req_type].render(
+            occup=request.occup,
+            addr=request.addr)
+
+def letter_name(request: Request) -> str:
+    """
+    Gets the name of the HTML and PDF files of a request's letter
+    Args:
+        request (Request): The Request the letter is for
+    Returns:
+        (str): The file name without its extension
+    """
+    return f'{request.case_ref}-{request.addr_str}-1'
+
+def html_path(request: Request) -> str:
+    """
+    Gets the path to write the HTML for a request to
+    Args:
+        request (Request): The Request the letter is for
+    Returns:
+        (str): The path of the HTML file
+    """
+    return f'.\\htmls\\{request.req_type}\\{letter_name(request)}.html'
+
+def keep_html(html: str, request: Request):
+    """
+    Keeps a rendered letter until it is converted, either in an HTML file
+    or, with in_memory set, as a Document that is piped to wkhtmltopdf
+    Args:
+        html (str): The HTML of the letter
+        request (Request): The Request this HTML was generated from
+    Returns:
+        (str or Document): The path of the HTML file, or the Document
+    """
+    if not IN_MEMORY:
+        return save_html(html, request)
+    JOURNAL.record(request.key, 'rendered')
+    return converter.Document(html, request.key)
+
+def render_letter(request: Request):
+    """
+    Renders and keeps a request's letter, or with overlay set, only gets
+    the address lines to stamp onto the letter body
+    Args:
+        request (Request): The Request the letter is for
+    Returns:
+        (str, Document or Stamp): The letter to convert
+    """
+    if not OVERLAYS:
+        return keep_html(create_html(request), request)
+    JOURNAL.record(request.key, 'rendered')
+    return overlay.Stamp(
+        overlay.address_lines(request.occup, request.addr),
+        request.key,
+        OVERLAYS[request.req_type])
+
+def render_letters(requests):
+    """
+    Renders and keeps the letter for each request, leaving out any whose
+    HTML couldn't be saved
+    Args:
+        requests (iterable): The requests to render letters for
+    Yields:
+        (tuple): Each request and its letter to convert
+    """
+    for request in requests:
+        letter = render_letter(request)
+        if letter is not None:
+            yield request, letter
+
+def save_html(html: str, request: Request) -> str:
+    """
+    Writes the HTML to file. Properties with more than one garden waste
+    subscription still only get one HTML file, the extra letters are
+    copied from its PDF by copy_licences()
     Args:
         html (str): The HTML to write to file and later convert
         request (Request): The Request this HTML was generated from
+    Returns:
+        (str): The path of the HTML file that was written, or None if it
+        couldn't be written
     """
+    path = html_path(request)
     try:
-        dir_path = f'.\\htmls\\{request.req_type}'
-        html_path = f'{dir_path}\\{request.case_ref}-{request.addr_str}-1.html'
-        with open(html_path, 'w+') as html_f:
-            html_f.write(html)
-        success_str = f'{SYSTIME} - Successfully saved {html_path}'
-        with open('.\\missed_bin_letters.log', 'a') as log:
-            log.write(f'{success_str}\n')
-        # If there is more than one license, create multiple letters
-        if isinstance(request, GardenWasteRequest):
-            for i in range(1, int(request.num_subs)):
-                html_f = f'{request.case_ref}-{request.addr_str}-{i + 1}.html'
-                html_path = f'{dir_path}\\{html_f}'
-                with open(html_path, 'w+') as html_f:
-                    html_f.write(html)
-                success_str = f'{SYSTIME} - Successfully saved {html_path}'
-                print(success_str)
-                with open('.\\missed_bin_letters.log', 'a') as log:
-                    log.write(f'{success_str}\n')
+        with METRICS.time('write', size=len(html.encode())):
+            with open(path, 'w+') as html_f:
+                html_f.write(html)
+        JOURNAL.record(request.key, 'rendered')
+        LOG.event('save', f'Successfully saved {path}', key=request.key)
+        return path
     except (IOError, FileNotFoundError) as error:
-        log_error('.\\missed_bin_letters.log', error)
+        record_error(request.key, path, error)
 
-def convert_html() -> None:
+def copy_licences(request: Request) -> list:
     """
-    Converts each HTML file to a PDF using wkhtmltopdf
+    Copies a converted letter once for each extra garden waste licence, so
+    the letter is only rendered and converted once per property
+    Args:
+        request (Request): The Request the letter was generated from
+    Returns:
+        (list): The paths of the copies that were made, or None if they
+        couldn't all be made
+    """
+    copies = []
+    if not isinstance(request, GardenWasteRequest):
+        return copies
+    pdf = pdf_path(request)
+    try:
+        for i in range(1, int(request.num_subs)):
+            copy = f'{pdf[:-len("-1.pdf")]}-{i + 1}.pdf'
+            shutil.copyfile(pdf, copy)
+            copies.append(copy)
+        for copy in copies:
+            success_str = f'Successfully copied {copy}'
+            print(success_str)
+            LOG.event('copy', success_str, key=request.key)
+        return copies
+    except (IOError, FileNotFoundError) as error:
+        record_error(request.key, pdf, error)
+
+def pdf_path(request: Request) -> str:
+    """
+    Gets the path to write the PDF for a request's letter to
+    Args:
+        request (Request): The Request the letter is for
+    Returns:
+        (str): The path of the PDF on the Y: drive, or in the staging
+        directory if the PDFs are staged
+    """
+    return f'{SINK.directory}\\{request.req_type}\\' \
+        f'{letter_name(request)}.pdf'
+
+def publish(request: Request) -> bool:
+    """
+    Copies the licences for a converted letter and hands its files to the
+    output sink
+    Args:
+        request (Request): The Request the letter was generated from
+    Returns:
+        (bool): False if the licences couldn't be copied
+    """
+    copies = copy_licences(request)
+    if copies is None:
+        return False
+    record_published(SINK.add(request.key, [pdf_path(request)] + copies))
+    return True
+
+def record_published(batches: list) -> None:
+    """
+    Records the letters the output sink has finished publishing. The
+    letters of a batch that couldn't be published are left unpublished in
+    the journal, so they aren't marked as sent and the next run publishes
+    them again
+    Args:
+        batches (list): The Batch objects from the output sink
+    """
+    for batch in batches:
+        if batch.error is not None:
+            for key in batch.keys:
+                record_error(key, SINK.destination, batch.error)
+            continue
+        METRICS.record('publish', batch.seconds, len(batch.keys), batch.size)
+        JOURNAL.record_many(batch.keys, 'published')
+        LOG.event(
+            'publish',
+            f'Published batch {batch.number} to {SINK.destination}',
+            letters=len(batch.keys))
+
+def publish_remaining() -> str:
+    """
+    Publishes the letters still waiting in the output sink
+    Returns:
+        A string denoting success
+    """
+    record_published(SINK.flush())
+    SINK.close()
+    return str(SINK)
+
+def convert_html(saved: list, workers: int = None) -> list:
+    """
+    Converts each letter to a PDF using a pool of wkhtmltopdf workers
+    Args:
+        saved (list): (request, html) tuples from keep_html()
+        workers (int): The number of conversions to run at once, defaults
+        to the number of CPUs
+    Returns:
+        (list): A ConversionResult for each letter, in the same order as
+        saved
     """
     try:
-        exe = '"C:\\Program Files\\wkhtmltopdf\\bin\\wkhtmltopdf.exe"'
-        html_dirs = ['.\\htmls\\gw\\*', '.\\htmls\\rec\\*']
-        for html_dir in html_dirs:
-            htmls = glob.glob(html_dir)
-            for html in htmls:
-                if html_dir == '.\\htmls\\gw\\*':
-                    case_ref = html[11:-5]
-                    # Moves PDFs directly to Y: drive
-                    pdf = '\\\\wilma\\shared\\Groups and Services\\WaSS\\' \
-                    'Route Optimisation\\missed bins\\sack letters\\pdfs\\' \
-                    f'gw\\{case_ref}.pdf'
-                elif html_dir == '.\\htmls\\rec\\*':
-                    case_ref = html[12:-5]
-                    pdf = '\\\\wilma\\shared\\Groups and Services\\WaSS\\' \
-                    'Route Optimisation\\missed bins\\sack letters\\pdfs\\' \
-                    f'rec\\{case_ref}.pdf'
-                flags = '--disable-smart-shrinking ' \
-                '-B 25.4mm -L 25.4mm -R 25.4mm -T 25.4mm'
-                args = f'{exe} {flags} "{html}" "{pdf}"'
-                print(args)
-                subprocess.call(args, shell=False)
+        jobs = [(html, pdf_path(request)) for request, html in saved]
+        if OVERLAYS:
+            results = overlay.convert_all(jobs)
+        else:
+            results = converter.convert_all(
+                jobs, FLAGS, workers, PDF_CACHE, POLICY)
+        for result in results:
+            print(result)
+            METRICS.record('convert', result.seconds)
+            LOG.event('convert', str(result), ok=result.ok)
+        return results
     except (IOError, FileNotFoundError) as error:
-        log_error('.\\missed_bin_letters.log', error)
+        log_error(error)
+
+def stream_letters(
+        workers: int = None,
+        fetch_size: int = pipeline.FETCH_SIZE) -> list:
+    """
+    Reads, renders, saves and converts the letters as a stream, so that
+    conversion starts on the first letter while the rest are still being
+    fetched and only a bounded number of letters are in memory at once
+    Args:
+        workers (int): The number of conversions to run at once, defaults
+        to the number of CPUs
+        fetch_size (int): The number of rows to read from the database at
+        a time
+    Returns:
+        (list): The requests whose letters were all converted, including
+        any converted by an interrupted run
+    """
+    done = []
+    requests = unfinished(iter_requests(fetch_size), done)
+    letters = pipeline.stream(
+        requests, [lambda request: (request, render_letter(request))])
+    # The requests waiting on a conversion, in job order
+    pending = deque()
+
+    def jobs():
+        for request, html in letters:
+            # A letter whose HTML couldn't be saved is already a dead letter
+            if html is None:
+                continue
+            pending.append(request)
+            yield (html, pdf_path(request))
+
+    sent = []
+    # The letters in done already handed to the output sink
+    resumed = 0
+    try:
+        if OVERLAYS:
+            results = overlay.convert_stream(jobs())
+        else:
+            results = converter.convert_stream(
+                jobs(), FLAGS, workers, PDF_CACHE, POLICY)
+        for result in results:
+            print(result)
+            resumed = publish_resumed(done, resumed)
+            request = pending.popleft()
+            METRICS.record('convert', result.seconds)
+            LOG.event('convert', str(result), key=request.key, ok=result.ok)
+            if result.ok:
+                JOURNAL.record(request.key, 'converted')
+                if publish(request):
+                    sent.append(request)
+            else:
+                record_failed(request, result)
+        publish_resumed(done, resumed)
+    except (IOError, FileNotFoundError) as error:
+        log_error(error)
+    return done + sent
+
+def send_letters(
+        requests: list,
+        workers: int = None,
+        claim: str = None,
+        lease: int = None) -> list:
+    """
+    Renders, converts and publishes the letters for a small batch of
+    requests, then marks them as sent
+    Args:
+        requests (list): The requests to send letters for
+        workers (int): The number of conversions to run at once, defaults
+        to the number of CPUs
+        claim (str): The lease the requests were claimed under, in claim
+        mode. It is renewed before the letters are published, and they are
+        only published and marked as sent if it is still held
+        lease (int): The seconds to renew the lease for
+    Returns:
+        (list): The requests whose letters were sent
+    """
+    resumed = []
+    saved = list(render_letters(unfinished(requests, resumed)))
+    results = convert_html(saved, workers)
+    if claim and not renew_claim(claim, lease):
+        # Another worker has taken the requests over and sends them itself,
+        # so PDFs converted straight into the destination are taken back
+        for request, _ in saved:
+            if os.path.exists(pdf_path(request)):
+                os.remove(pdf_path(request))
+        LOG.event('run', f'Lost the lease on {claim}', letters=len(saved))
+        remove_htmls()
+        return []
+    publish_resumed(resumed)
+    sent = resumed + converted_requests(saved, results)
+    record_published(SINK.flush())
+    sent = published(sent)
+    if sent:
+        print(update_database(sent, claim))
+    remove_htmls()
+    return [request for request in sent
+            if JOURNAL.reached(request.key, 'flagged')]
+
+def claim_requests(claim: str, limit: int, lease: int) -> list:
+    """
+    Leases a batch of unsent requests to this worker, so that other workers
+    skip them until the lease runs out, and reads them back
+    Args:
+        claim (str): Identifies this batch of this worker
+        limit (int): The most rows of Missed_Collections to lease
+        lease (int): The seconds the lease lasts
+    Returns:
+        (list): The leased requests, or None if there were none left to
+        lease
+    """
+    queries = [
+        ('gw_address_claimed', lambda row: GardenWasteRequest(
+            row.occupier, row.address, row.addr_str, row.case_ref,
+            row.num_subs)),
+        ('rec_address_claimed', lambda row: RecyclingRequest(
+            row.occupier, row.address, row.addr_str, row.case_ref))]
+    try:
+        with METRICS.time('claim', count=0):
+            claimed = SQL.execute(
+                CONN, 'missed_claim', claim, limit, lease).rowcount
+            CONN.commit()
+        if not claimed:
+            return None
+        requests = []
+        for name, request in queries:
+            start = time.perf_counter()
+            rows = SQL.execute(CONN, name, claim).fetchall()
+            METRICS.record('query', time.perf_counter() - start, len(rows))
+            requests += [request(row) for row in rows]
+        return requests
+    except (pyodbc.DatabaseError, pyodbc.InterfaceError) as error:
+        CONN.rollback()
+        log_error(error)
+
+def renew_claim(claim: str, lease: int) -> bool:
+    """
+    Extends the lease on a batch of requests, if this worker still holds it
+    Args:
+        claim (str): Identifies the batch of this worker
+        lease (int): The seconds from now the lease lasts
+    Returns:
+        (bool): False if the lease ran out before it could be renewed
+    """
+    try:
+        with METRICS.time('claim', count=0):
+            renewed = SQL.execute(CONN, 'missed_renew', claim, lease).rowcount
+            CONN.commit()
+        return renewed > 0
+    except (pyodbc.DatabaseError, pyodbc.InterfaceError) as error:
+        CONN.rollback()
+        log_error(error)
+
+def claim_lease(config: dict, policy: converter.RetryPolicy) -> int:
+    """
+    Args:
+        config (dict): The settings from .config
+        policy (RetryPolicy): The deadline and retries of each conversion
+    Returns:
+        (int): The seconds to lease each batch for, which is claim_lease or
+        long enough for every letter of a full batch to use up all of its
+        attempts, whichever is longer
+    """
+    lease = config.get('claim_lease', CLAIM_LEASE)
+    if not policy.timeout:
+        return lease
+    limit = config.get('claim_batch_size', CLAIM_BATCH_SIZE)
+    workers = config.get('workers') or converter.default_workers()
+    letter = policy.attempts * policy.deadline(1) + sum(
+        policy.delay(attempt) for attempt in range(1, policy.attempts))
+    return max(lease, math.ceil(math.ceil(limit / workers) * letter))
+
+def work_claims(config: dict) -> list:
+    """
+    Keeps leasing batches of requests and sending their letters until
+    there are none left, so several machines can share the work without
+    sending the same letter twice. A batch whose letters fail keeps its
+    lease until it runs out, and is then picked up again by any worker.
+    The lease is renewed once the letters are converted, and a letter is
+    only counted as sent if its request was still leased to this worker
+    when it was marked as sent
+    Args:
+        config (dict): The settings from .config
+    Returns:
+        (list): The requests whose letters this worker sent
+    """
+    worker = config.get('worker', f'{socket.gethostname()}-{os.getpid()}')
+    limit = config.get('claim_batch_size', CLAIM_BATCH_SIZE)
+    lease = claim_lease(config, POLICY)
+    sent = []
+    for batch in itertools.count():
+        claim = f'{worker}-{batch}'
+        requests = claim_requests(claim, limit, lease)
+        if requests is None:
+            break
+        batch_sent = send_letters(
+            requests, config.get('workers'), claim, lease)
+        sent += batch_sent
+        LOG.event(
+            'run', f'Sent {len(batch_sent)} letters', worker=worker)
+        LOG.flush()
+    return sent
+
+def watch(config: dict) -> int:
+    """
+    Keeps polling for requests added after the high watermark and sends
+    their letters in small batches, reusing the connections, templates and
+    cache of the one run instead of starting a new run for each batch.
+    A letter that fails to convert holds the watermark back, so it is
+    polled again with the next batch, until it has failed in
+    watch_attempts batches. The watermark then moves past it and it is
+    left for the next time watch mode starts. Runs until watch_polls polls
+    have been made, or until interrupted with Ctrl+C
+    Only the letters still being tried are kept between batches, in the
+    journal and in memory, so a script left running doesn't grow
+    Args:
+        config (dict): The settings from .config
+    Returns:
+        (int): The number of letters sent
+    """
+    path = config.get('watermark', '.\\missed_bin_letters.watermark')
+    limit = config.get('watch_batch_size', WATCH_BATCH_SIZE)
+    interval = config.get('watch_interval', WATCH_INTERVAL)
+    polls = config.get('watch_polls')
+    max_attempts = config.get('watch_attempts', WATCH_ATTEMPTS)
+    watermark = read_watermark(path)
+    # The number of batches each unsent letter has failed in
+    attempts = {}
+    # The id of the first request given up on, for the next run to retry
+    retry = None
+    count = 0
+    while polls is None or polls > 0:
+        if polls is not None:
+            polls -= 1
+        try:
+            polled, complete = poll_requests(watermark, limit)
+        except (pyodbc.DatabaseError, pyodbc.InterfaceError) as error:
+            log_error(error)
+        except KeyboardInterrupt:
+            break
+        if not polled:
+            if complete != watermark:
+                write_watermark(path, complete, retry)
+                watermark = complete
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
+            continue
+        ids = {request.key: id_ for id_, request in polled}
+        sent = send_letters(
+            [request for _, request in polled], config.get('workers'))
+        for request in sent:
+            attempts.pop(request.key, None)
+            DEAD_LETTERS.discard(request.key)
+        # Failed letters are polled again, along with anything after them,
+        # until they have failed in max_attempts batches
+        held = []
+        for key in set(ids) - {request.key for request in sent}:
+            attempts[key] = attempts.get(key, 0) + 1
+            if attempts[key] < max_attempts:
+                held.append(ids[key])
+            else:
+                del attempts[key]
+                retry = ids[key] if retry is None else min(retry, ids[key])
+        if held:
+            complete = min(held) - 1
+        write_watermark(path, complete, retry)
+        watermark = complete
+        JOURNAL.forget(key for key in ids if key not in attempts)
+        DEAD_LETTERS.write()
+        count += len(sent)
+        METRICS.letters = count
+        METRICS.write(
+            config.get('metrics_path', '.\\missed_bin_letters_metrics'))
+        LOG.event('run', f'Sent {len(sent)} letters', watermark=watermark)
+        LOG.flush()
+        # A full batch means more requests are probably waiting already
+        if len(polled) < limit:
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
+    return count
 
 def remove_htmls() -> None:
     """
     Removes the HTML files so they don't accidentally get reprocessed
     """
     try:
+        start = time.perf_counter()
+        count = 0
         html_ds = ['.\\htmls\\gw', '.\\htmls\\rec']
         for html_d in html_ds:
             for d, _, files in os.walk(html_d):
                 for f in files:
                     f_path = os.path.join(d, f)
                     os.unlink(f_path)
+                    count += 1
+        METRICS.record('cleanup', time.perf_counter() - start, count)
     except WindowsError as error:
-        log_error('.\\missed_bin_letters.log', error)
+        log_error(error)
 
-def update_database(request: Request) -> str:
+def update_database(requests: list, claim: str = None) -> str:
     """
-    Runs the two UPDATE queries to keep track of which requests have been
-    processed
+    Marks the letters for the given requests as sent in a single
+    transaction, passing the case references to each UPDATE as a batch
     Args:
-        request (Request): The request in the database to update
+        requests (list): The requests whose letters were produced
+        claim (str): The lease the requests were claimed under, in claim
+        mode. Only the requests still leased under it are marked
     Returns:
         (str): A string indicating success
     """
     try:
-        with open('.\\gw_update.sql', 'r') as gw_update_f:
-            gw_update = gw_update_f.read()
-        with open('.\\rec_update.sql', 'r') as rec_update_f:
-            rec_update = rec_update_f.read()
-        cursor = CONN.cursor()
-        cursor.execute(gw_update)
-        cursor.execute(rec_update)
-        CONN.commit()
-        success_str = f'{SYSTIME} - Updated database for {request.case_ref}'
-        with open('.\\missed_bin_letters.log', 'a') as log:
-            log.write(f'{success_str}\n')
-        return success_str
+        gw_refs = [
+            (request.case_ref,) for request in requests
+            if isinstance(request, GardenWasteRequest)]
+        rec_refs = [
+            (request.case_ref,) for request in requests
+            if isinstance(request, RecyclingRequest)]
+        with METRICS.time('update', count=len(requests)):
+            if claim:
+                flagged = update_claimed(requests, claim)
+            else:
+                if gw_refs:
+                    SQL.executemany(CONN, 'gw_update', gw_refs)
+                if rec_refs:
+                    SQL.executemany(CONN, 'rec_update', rec_refs)
+                flagged = requests
+            CONN.commit()
+        JOURNAL.record_many(
+            [request.key for request in flagged], 'flagged')
+        flagged_keys = {request.key for request in flagged}
+        for request in requests:
+            if request.key in flagged_keys:
+                message = f'Updated database for {request.case_ref}'
+            else:
+                message = f'{request.case_ref} is no longer leased to {claim}'
+            LOG.event('update', message, key=request.key)
+        gw_count = sum(
+            isinstance(request, GardenWasteRequest) for request in flagged)
+        return f'{SYSTIME} - Updated database for {gw_count} garden ' \
+            f'waste and {len(flagged) - gw_count} recycling requests'
     except (pyodbc.DatabaseError, pyodbc.InterfaceError) as error:
-        log_error('.\\missed_bin_letters.log', error)
+        CONN.rollback()
+        log_error(error)
+
+def update_claimed(requests: list, claim: str) -> list:
+    """
+    Marks the letters for the given requests as sent, but only where the
+    request is still leased to this worker, so a request another worker
+    has taken over isn't counted twice
+    Args:
+        requests (list): The requests whose letters were produced
+        claim (str): The lease the requests were claimed under
+    Returns:
+        (list): The requests that were marked as sent
+    """
+    flagged = set()
+    for name, kind in [('gw_update_claimed', GardenWasteRequest),
+                       ('rec_update_claimed', RecyclingRequest)]:
+        refs = [request.case_ref for request in requests
+                if isinstance(request, kind)]
+        if not refs:
+            continue
+        cursor = SQL.execute(
+            CONN, name, claim, *refs, case_refs=', '.join(['?'] * len(refs)))
+        flagged.update((kind, row.case_ref) for row in cursor.fetchall())
+    return [request for request in requests
+            if (type(request), request.case_ref) in flagged]
+
+def converted_requests(saved: list, results: list) -> list:
+    """
+    Finds the requests whose letters were converted successfully and
+    publishes them, with the extra copies for their garden waste licences
+    Args:
+        saved (list): (request, html) tuples from keep_html()
+        results (list): The ConversionResult objects from convert_html(),
+        in the same order as saved
+    Returns:
+        (list): The requests that can be marked as sent
+    """
+    sent = []
+    for (request, _), result in zip(saved, results):
+        if result.ok:
+            JOURNAL.record(request.key, 'converted')
+            if publish(request):
+                sent.append(request)
+        else:
+            record_failed(request, result)
+    return sent
 
-def log_error(log_path: str, error: Exception):
+def record_failed(request: Request, result: converter.ConversionResult):
     """
-    Writes exception messages to the log file and exits the program
+    Adds a letter that failed every conversion attempt to the dead letters.
+    It isn't marked as sent, so the next run tries it again
+    Args:
+        request (Request): The Request the letter was generated from
+        result (ConversionResult): The last failed attempt
+    """
+    DEAD_LETTERS.add(request.key, result)
+    LOG.event(
+        'dead_letter',
+        str(result),
+        key=request.key,
+        attempts=result.attempts)
+
+def record_error(key: str, path: str, error: Exception):
+    """
+    Adds a letter whose files couldn't be written, copied or published to
+    the dead letters, so the rest of the run carries on without it. It
+    isn't marked as sent, so the next run tries it again
+    Args:
+        key (str): The journal key of the letter
+        path (str): The file that couldn't be written, copied or published
+        error (Exception): What went wrong
+    """
+    DEAD_LETTERS.add(
+        key, converter.ConversionResult(path, path, None, error=str(error)))
+    LOG.event('error', str(error), key=key)
+
+def published(requests: list) -> list:
+    """
+    Args:
+        requests (list): The requests whose letters were converted
+    Returns:
+        (list): The requests whose letters the output sink published, which
+        are the only ones that can be marked as sent
+    """
+    return [request for request in requests
+            if JOURNAL.reached(request.key, 'published')]
+
+def log_error(error: Exception):
+    """
+    Writes exception messages to the log file and exits the program. The
+    rest of the log is written out as the program exits
     Args:
-        log_path (str): The path of the log file to write to
         error (Exception): The error message given by an exception
     """
-    with open(log_path, 'a') as log:
-        log.write(f'{SYSTIME} - {error}\n')
+    LOG.event('error', str(error))
     sys.exit(1)
 
 
 if __name__ == '__main__':
     SYSTIME = datetime.datetime.now().strftime('%d-%b-%Y %H:%M:%S')
+    LOG = run_log.RunLog('.\\missed_bin_letters.log')
+    LOG.event('run', 'Started')
+    METRICS = metrics.Metrics('gen_html')
     with open ('.\\.config', 'r') as config_f:
         config = json.load(config_f)
+    try:
+        SQL = statements.Registry([
+            'gw_address_info',
+            'rec_address_info',
+            'gw_uprn_info',
+            'rec_uprn_info',
+            'llpg_checksums',
+            'llpg_addresses',
+            'gw_address_new',
+            'rec_address_new',
+            'missed_claim',
+            'gw_address_claimed',
+            'rec_address_claimed',
+            'missed_renew',
+            'gw_update',
+            'rec_update',
+            'gw_update_claimed',
+            'rec_update_claimed'])
+    except ValueError as error:
+        log_error(error)
     try:
         CONN = pyodbc.connect(
             driver=config['driver'],
@@ -373,16 +1253,85 @@ if __name__ == '__main__':
             uid=config['uid'],
             pwd=config['pwd'])
     except (pyodbc.DatabaseError, pyodbc.InterfaceError) as error:
-        log_error('.\\missed_bin_letters.log', error)
-    gw_requests = query_gw_requests()
-    rec_requests = query_rec_requests()
-    requests = gw_requests + rec_requests
-    for request in requests:
-        html = create_html(request)
-        save_html(html, request)
-    convert_html()
-    for request in requests:
-        update_database(request)
+        log_error(error)
+    POOL = connections.ConnectionPool(
+        lambda: pyodbc.connect(
+            driver=config['driver'],
+            server=config['server'],
+            database=config['database'],
+            uid=config['uid'],
+            pwd=config['pwd']),
+        config.get('connections', connections.POOL_SIZE))
+    JOURNAL = journal.Journal(
+        '.\\missed_bin_letters.journal' if config.get('journal', True)
+        else None)
+    # HTML left by an interrupted run would otherwise be converted again
+    remove_htmls()
+    PDF_DIR = config.get('pdf_dir', PDF_DIR)
+    SINK = output_sink.from_config(
+        config, PDF_DIR, datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+    if config.get('staging_dir'):
+        for req_type in ['gw', 'rec']:
+            os.makedirs(f'{SINK.directory}\\{req_type}', exist_ok=True)
+    IN_MEMORY = config.get('in_memory', False)
+    if config.get('address_index'):
+        ADDRESSES = load_addresses(
+            config.get('address_index_path', '.\\llpg.addresses'),
+            config.get('address_index_age', address_index.MAX_AGE))
+    TEMPLATES = compile_templates()
+    PDF_CACHE = pdf_cache.from_config(config, CSS)
+    POLICY = converter.retry_policy(config)
+    DEAD_LETTERS = converter.DeadLetters(
+        config.get('dead_letters', '.\\missed_bin_letters_failed.json'))
+    OVERLAYS = compile_overlays() if config.get('overlay') else None
+    sent = []
+    # The letters sent in watch mode, which doesn't keep them
+    watched = 0
+    if config.get('watch'):
+        # Each batch is published and marked as sent as it goes
+        watched = watch(config)
+    elif config.get('claim'):
+        sent = work_claims(config)
+    elif config.get('stream'):
+        sent = stream_letters(
+            config.get('workers'),
+            config.get('fetch_size', pipeline.FETCH_SIZE))
+    else:
+        resumed = []
+        requests = unfinished(
+            iter_requests(config.get('fetch_size', pipeline.FETCH_SIZE)),
+            resumed)
+        # Each letter is rendered as soon as its row arrives
+        saved = list(render_letters(requests))
+        if resumed:
+            print(f'Resumed {len(resumed)} letters from the journal')
+            publish_resumed(resumed)
+        results = convert_html(saved, config.get('workers'))
+        sent = resumed + converted_requests(saved, results)
+    print(publish_remaining())
+    sent = published(sent)
+    print(DEAD_LETTERS.write())
+    print(letter_templates.render_report(TEMPLATES.values()))
+    if OVERLAYS:
+        for req_type, body in OVERLAYS.items():
+            print(f'{req_type}: {body}')
+    if PDF_CACHE:
+        print(PDF_CACHE)
+    if not config.get('watch') and not config.get('claim'):
+        print(update_database(sent))
+    print(SQL)
+    if ADDRESSES is not None:
+        print(ADDRESSES)
+        # Keeps the addresses of properties added since the last refresh
+        if ADDRESSES.dirty:
+            ADDRESSES.save(
+                config.get('address_index_path', '.\\llpg.addresses'))
     remove_htmls()
-    with open('.\\missed_bin_letters.log', 'a') as log:
-        log.write(f'{SYSTIME}\n')
+    JOURNAL.clear()
+    POOL.close()
+    METRICS.letters = watched + len(sent)
+    print(METRICS)
+    print(METRICS.write(
+        config.get('metrics_path', '.\\missed_bin_letters_metrics')))
+    LOG.event('run', 'Finished', letters=METRICS.letters)
+    LOG.flush()
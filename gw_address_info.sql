@@ -22,4 +22,5 @@ JOIN wasscollections.dbo.MV_HDC_LLPG_ADDRESSES_CURRENT l
 	WHERE m.id NOT IN (12, 13, 17)
   	AND GWSacksRequested = 'yes'
   	AND GWSacksLetterSent = 0
-  	AND AddedDateTime < @gw_cutoff
\ No newline at end of file
+  	AND AddedDateTime < @gw_cutoff
+ORDER BY case_ref
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+journal.py
+Checkpoint journal shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+Each letter's progress through a run is appended to a journal file as one
+JSON line per stage, keyed by its case reference or UPRN. The lines of
+each record are flushed and synced to disk as soon as they are written,
+under a lock since the letters of a run are recorded from several threads,
+so if a run dies partway through, or the machine loses power, the next
+run reads the journal back and skips the letters that already got far
+enough. The journal is removed once a run finishes cleanly
+"""
+import os
+import json
+import threading
+
+# The stages a letter goes through, in order
+STAGES = ['queried', 'rendered', 'converted', 'published', 'flagged']
+
+
+class Journal():
+    """
+    Represents the stage each letter reached in the current, or an
+    interrupted, run
+    """
+    def __init__(self, path: str, run: str = None):
+        """
+        Args:
+            path (str): The path of the journal file, or None to keep the
+            journal in memory only
+            run (str): Identifies the work the run is for. A journal left
+            by a run with a different identifier is discarded
+        """
+        self.path = path
+        self.run = run
+        self.stages = {}
+        self.log = None
+        self.lock = threading.Lock()
+        if path is None:
+            return
+        if os.path.exists(path):
+            self._load()
+        self.log = open(path, 'a' if self.stages else 'w')
+        if self.stages:
+            # Starts a fresh line in case the last one was cut short
+            self.log.write('\n')
+        else:
+            self._write({'run': run})
+        self._sync()
+
+    def __str__(self) -> str:
+        return f'Journal: {len(self.stages)} letters recorded'
+
+    def _load(self):
+        """
+        Reads back the stages recorded by an interrupted run
+        """
+        with open(self.path, 'r') as journal_f:
+            lines = journal_f.read().splitlines()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            # The last line is cut short if the run died while writing it
+            except json.JSONDecodeError:
+                continue
+        if not entries or entries[0].get('run') != self.run:
+            return
+        for entry in entries[1:]:
+            self.stages[entry['key']] = entry['stage']
+
+    def _write(self, entry: dict):
+        self.log.write(f'{json.dumps(entry)}\n')
+
+    def _sync(self):
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def reached(self, key, stage: str) -> bool:
+        """
+        Args:
+            key: The case reference or UPRN of the letter
+            stage (str): One of STAGES
+        Returns:
+            (bool): True if the letter got to stage, or past it
+        """
+        current = self.stages.get(str(key))
+        if current is None:
+            return False
+        return STAGES.index(current) >= STAGES.index(stage)
+
+    def record(self, key, stage: str):
+        """
+        Records that a letter got to a stage
+        Args:
+            key: The case reference or UPRN of the letter
+            stage (str): One of STAGES
+        """
+        self.record_many([key], stage)
+
+    def record_many(self, keys, stage: str):
+        """
+        Records that several letters got to a stage, syncing the journal to
+        disk once for all of them
+        Args:
+            keys (iterable): The case references or UPRNs of the letters
+            stage (str): One of STAGES
+        """
+        with self.lock:
+            written = False
+            for key in keys:
+                if self.reached(key, stage):
+                    continue
+                self.stages[str(key)] = stage
+                if self.log:
+                    self._write({'key': str(key), 'stage': stage})
+                    written = True
+            if written:
+                self._sync()
+
+    def forget(self, keys):
+        """
+        Drops letters that are finished with, like those watch mode has
+        marked as sent, and rewrites the file without them, so a journal
+        that is never cleared only holds the letters still in progress. The
+        file is written under a temporary name first
+        Args:
+            keys (iterable): The case references or UPRNs of the letters
+        """
+        with self.lock:
+            for key in keys:
+                self.stages.pop(str(key), None)
+            if not self.log:
+                return
+            self.log.close()
+            with open(f'{self.path}.tmp', 'w') as journal_f:
+                self.log = journal_f
+                self._write({'run': self.run})
+                for key, stage in self.stages.items():
+                    self._write({'key': key, 'stage': stage})
+                self._sync()
+            os.replace(f'{self.path}.tmp', self.path)
+            self.log = open(self.path, 'a')
+
+    def close(self):
+        """
+        Makes sure the journal is on disk and closes it
+        """
+        with self.lock:
+            if self.log:
+                self._sync()
+                self.log.close()
+                self.log = None
+
+    def clear(self):
+        """
+        Removes the journal once the run has finished cleanly
+        """
+        self.close()
+        self.stages = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
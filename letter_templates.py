@@ -0,0 +1,119 @@
+"""
+letter_templates.py
+Precompiled letter templates shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+A letter's HTML is split once into static segments and {{slot}} markers.
+Slots that are the same for every letter in a run, like the body text or
+the date, are bound into the static segments up front, so rendering a
+letter only joins the segments with its address and table. The stylesheet
+is written to its own file once and linked from every letter
+"""
+import os
+import re
+import time
+import pathlib
+
+_SLOT = re.compile(r'{{(\w+)}}')
+
+
+class Template():
+    """
+    Represents a letter split into static segments and the slots between
+    them
+    """
+    def __init__(self, source: str):
+        """
+        Args:
+            source (str): The HTML of the letter, with a {{name}} marker
+            wherever a value is filled in
+        """
+        parts = _SLOT.split(source)
+        # Even parts are static text, odd parts are slot names
+        self.segments = parts[0::2]
+        self.slots = parts[1::2]
+        self.renders = 0
+        self.seconds = 0.0
+
+    def bind(self, **values) -> 'Template':
+        """
+        Fills in slots that are the same for every letter in a run
+        Args:
+            values: The value for each slot to fill in
+        Returns:
+            (Template): A new template with those slots made static
+        """
+        segments = [self.segments[0]]
+        slots = []
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            if slot in values:
+                segments[-1] += str(values[slot]) + segment
+            else:
+                slots.append(slot)
+                segments.append(segment)
+        bound = Template('')
+        bound.segments = segments
+        bound.slots = slots
+        return bound
+
+    def render(self, **values) -> str:
+        """
+        Fills in the remaining slots for a single letter
+        Args:
+            values: The value for each remaining slot
+        Returns:
+            (str): The HTML of the letter
+        """
+        start = time.perf_counter()
+        parts = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            parts.append(str(values[slot]))
+            parts.append(segment)
+        html = ''.join(parts)
+        self.seconds += time.perf_counter() - start
+        self.renders += 1
+        return html
+
+
+def stylesheet_link(path: str) -> str:
+    """
+    Gets the tag linking a letter to a shared stylesheet. The link is an
+    absolute file URL so it still resolves wherever the HTML is written
+    Args:
+        path (str): The path of the stylesheet
+    Returns:
+        (str): The <link> tag for the stylesheet
+    """
+    uri = pathlib.Path(os.path.abspath(path)).as_uri()
+    return f'<link rel="stylesheet" type="text/css" href="{uri}">'
+
+
+def write_stylesheet(path: str, css: str) -> str:
+    """
+    Writes the stylesheet shared by every letter in a run
+    Args:
+        path (str): The path to write the stylesheet to
+        css (str): The contents of the stylesheet
+    Returns:
+        (str): The <link> tag for the stylesheet
+    """
+    with open(path, 'w') as css_f:
+        css_f.write(css)
+    return stylesheet_link(path)
+
+
+def render_report(templates) -> str:
+    """
+    Summarises how long rendering took, separately from conversion
+    Args:
+        templates (iterable): The templates used this run
+    Returns:
+        (str): The number of letters rendered and the rendering rate
+    """
+    renders = 0
+    seconds = 0.0
+    for template in templates:
+        renders += template.renders
+        seconds += template.seconds
+    rate = renders / seconds if seconds else 0.0
+    return f'Rendered {renders} letters in {seconds:.3f}s ' \
+        f'({rate:.0f} letters/s)'
@@ -0,0 +1,7 @@
+SELECT
+	l.UPRN AS uprn,
+	CHECKSUM(l.ADDRESS_BLOCK, l.ADDRESS_STR_ORG_POSTAL) AS checksum,
+	l.ADDRESS_BLOCK AS address_block,
+	l.ADDRESS_STR_ORG_POSTAL AS addr_str
+FROM wasscollections.dbo.MV_HDC_LLPG_ADDRESSES_CURRENT l
+WHERE l.UPRN IN (<uprns>)
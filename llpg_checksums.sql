@@ -0,0 +1,4 @@
+SELECT
+	l.UPRN AS uprn,
+	CHECKSUM(l.ADDRESS_BLOCK, l.ADDRESS_STR_ORG_POSTAL) AS checksum
+FROM wasscollections.dbo.MV_HDC_LLPG_ADDRESSES_CURRENT l
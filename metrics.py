@@ -0,0 +1,240 @@
+"""
+metrics.py
+Per-stage timings shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+Each stage of a run, like rendering or converting, records how long every
+call took, how many letters it handled and how many bytes it wrote. Each
+stage keeps running totals and a fixed size random sample of its calls, so
+a long run doesn't keep every timing. At the end of the run the totals,
+mean and 95th percentile of each stage are
+printed and written to a JSON file and a Prometheus textfile. If
+tracemalloc is tracing, the most memory in use at the end of any call of
+each stage is recorded as well
+"""
+import os
+import math
+import json
+import time
+import random
+import threading
+import tracemalloc
+import contextlib
+
+# The most timings each stage keeps to take the 95th percentile from
+RESERVOIR_SIZE = 10000
+
+
+class Stage():
+    """
+    Represents the timings recorded for one stage of a run
+    """
+    def __init__(self, reservoir_size: int = RESERVOIR_SIZE):
+        """
+        Args:
+            reservoir_size (int): The most timings to keep
+        """
+        self.count = 0
+        self.bytes = 0
+        self.calls = 0
+        self.total = 0.0
+        self.samples = []
+        self.reservoir_size = reservoir_size
+        self.random = random.Random(0)
+        self.peak_memory = 0
+
+    def add(self, seconds: float):
+        """
+        Adds the timing of one call, keeping it in the sample with the same
+        chance as every other call
+        Args:
+            seconds (float): How long the call took
+        """
+        self.calls += 1
+        self.total += seconds
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(seconds)
+            return
+        index = self.random.randrange(self.calls)
+        if index < self.reservoir_size:
+            self.samples[index] = seconds
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            (dict): The count, bytes and latencies of the stage
+        """
+        total = self.total
+        calls = self.calls
+        return {
+            'count': self.count,
+            'calls': calls,
+            'bytes': self.bytes,
+            'total_seconds': total,
+            'mean_seconds': total / calls if calls else 0.0,
+            'p95_seconds': percentile(self.samples, 0.95),
+            'peak_memory': self.peak_memory}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """
+    Args:
+        samples (list): The values to take the percentile of
+        fraction (float): The percentile as a fraction, like 0.95
+    Returns:
+        (float): The smallest value at least fraction of samples are under
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Metrics():
+    """
+    Represents the timings of every stage of a run
+    """
+    def __init__(self, script: str):
+        """
+        Args:
+            script (str): The name of the script, used to label the metrics
+        """
+        self.script = script
+        self.start = time.perf_counter()
+        self.letters = 0
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(
+            self,
+            stage: str,
+            seconds: float,
+            count: int = 1,
+            size: int = 0):
+        """
+        Records one call of a stage
+        Args:
+            stage (str): The name of the stage
+            seconds (float): How long the call took
+            count (int): The number of letters the call handled
+            size (int): The number of bytes the call wrote
+        """
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Stage()
+            self.stages[stage].add(seconds)
+            self.stages[stage].count += count
+            self.stages[stage].bytes += size
+            if tracemalloc.is_tracing():
+                memory = tracemalloc.get_traced_memory()[0]
+                self.stages[stage].peak_memory = max(
+                    self.stages[stage].peak_memory, memory)
+
+    @contextlib.contextmanager
+    def time(self, stage: str, count: int = 1, size: int = 0):
+        """
+        Times the code run inside the with block as one call of a stage
+        Args:
+            stage (str): The name of the stage
+            count (int): The number of letters the call handles
+            size (int): The number of bytes the call writes
+        """
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start, count, size)
+
+    def iterate(self, stage: str, batches):
+        """
+        Times reading each batch of an iterable of batches, such as the
+        fetchmany() calls of a query, as one call of a stage
+        Args:
+            stage (str): The name of the stage
+            batches (iterable): The lists of items to read
+        Yields:
+            Each item of each batch, in order
+        """
+        batches = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            self.record(stage, time.perf_counter() - start, len(batch))
+            yield from batch
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            (dict): The totals of the run and the summary of each stage
+        """
+        seconds = time.perf_counter() - self.start
+        with self.lock:
+            stages = {
+                name: stage.summary() for name, stage in self.stages.items()}
+        return {
+            'script': self.script,
+            'seconds': seconds,
+            'letters': self.letters,
+            'letters_per_second': self.letters / seconds if seconds else 0.0,
+            'stages': stages}
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        lines = [
+            f'{summary["letters"]} letters in {summary["seconds"]:.1f}s '
+            f'({summary["letters_per_second"]:.1f} letters/s)']
+        for name, stage in summary['stages'].items():
+            lines.append(
+                f'  {name}: {stage["count"]} in '
+                f'{stage["total_seconds"]:.3f}s, mean '
+                f'{stage["mean_seconds"] * 1000:.1f}ms, p95 '
+                f'{stage["p95_seconds"] * 1000:.1f}ms, '
+                f'{stage["bytes"]} bytes')
+        return '\n'.join(lines)
+
+    def prometheus(self, summary: dict) -> str:
+        """
+        Formats a summary for the Prometheus node exporter's textfile
+        collector
+        Args:
+            summary (dict): The output of summary()
+        Returns:
+            (str): The metrics in the Prometheus text format
+        """
+        script = f'script="{self.script}"'
+        lines = [
+            '# TYPE letters_run_seconds gauge',
+            f'letters_run_seconds{{{script}}} {summary["seconds"]}',
+            '# TYPE letters_run_letters gauge',
+            f'letters_run_letters{{{script}}} {summary["letters"]}',
+            '# TYPE letters_run_letters_per_second gauge',
+            f'letters_run_letters_per_second{{{script}}} '
+            f'{summary["letters_per_second"]}']
+        for key in ['count', 'bytes', 'total_seconds', 'mean_seconds',
+                    'p95_seconds', 'peak_memory']:
+            lines.append(f'# TYPE letters_stage_{key} gauge')
+            for name, stage in summary['stages'].items():
+                lines.append(
+                    f'letters_stage_{key}{{{script},stage="{name}"}} '
+                    f'{stage[key]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> str:
+        """
+        Writes the summary of the run to path.json and path.prom. Each file
+        is written under a temporary name first, so nothing reading them
+        sees half a file
+        Args:
+            path (str): The path of the files without an extension
+        Returns:
+            (str): A string denoting success
+        """
+        summary = self.summary()
+        outputs = [
+            (f'{path}.json', json.dumps(summary, indent=2)),
+            (f'{path}.prom', self.prometheus(summary))]
+        for out_path, text in outputs:
+            with open(f'{out_path}.tmp', 'w') as out_f:
+                out_f.write(text)
+            os.replace(f'{out_path}.tmp', out_path)
+        return f'Wrote metrics to {path}.json and {path}.prom'
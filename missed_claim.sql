@@ -0,0 +1,22 @@
+--CLAIM A BATCH OF REQUESTS
+DECLARE @claim varchar(64) = ?;
+DECLARE @batch_size int = ?;
+DECLARE @lease_seconds int = ?;
+DECLARE @cutoff datetime = '2018-06-07 12:00:00.00';
+WITH batch AS (
+	SELECT TOP (@batch_size)
+		ClaimedBy,
+		ClaimExpires
+	FROM HDC_AF_GW_Missed_Collections.dbo.Missed_Collections m
+		WITH (ROWLOCK, UPDLOCK, READPAST)
+	WHERE m.id NOT IN (12, 13, 17)
+	AND (
+		(GWSacksRequested = 'yes' AND GWSacksLetterSent = 0) OR
+		(RecSacksRequested = 'yes' AND RECYSacksLetterSent = 0))
+	AND AddedDateTime < @cutoff
+	AND (ClaimExpires IS NULL OR ClaimExpires < GETDATE())
+	ORDER BY m.id
+)
+UPDATE batch
+SET ClaimedBy = @claim,
+	ClaimExpires = DATEADD(SECOND, @lease_seconds, GETDATE())
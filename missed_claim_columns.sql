@@ -0,0 +1,6 @@
+--RUN ONCE BEFORE USING CLAIM MODE
+ALTER TABLE HDC_AF_GW_Missed_Collections.dbo.Missed_Collections
+ADD ClaimedBy varchar(64) NULL,
+	ClaimExpires datetime NULL;
+CREATE INDEX IX_Missed_Collections_ClaimedBy
+ON HDC_AF_GW_Missed_Collections.dbo.Missed_Collections (ClaimedBy);
@@ -0,0 +1,7 @@
+--RENEW THE LEASE ON A BATCH OF REQUESTS
+DECLARE @claim varchar(64) = ?;
+DECLARE @lease_seconds int = ?;
+UPDATE HDC_AF_GW_Missed_Collections.dbo.Missed_Collections
+SET ClaimExpires = DATEADD(SECOND, @lease_seconds, GETDATE())
+WHERE ClaimedBy = @claim
+AND ClaimExpires > GETDATE()
@@ -8,29 +8,220 @@ Generates an HTML file and uses wkhtmltopdf to convert it to a PDF
 Contains changes to a round
 """
 import os
+import ntpath
 import glob
-import subprocess
 import datetime
 import json
-from PyPDF2 import PdfFileMerger, PdfFileReader
+import time
 import pyodbc
+import address_index
+import connections
+import converter
+import journal
+import letter_templates
+import metrics
+import pdf_cache
+import pdf_merge
+import pipeline
+import rounds_snapshot
+import statements
+
+FLAGS = ['--disable-smart-shrinking', '--enable-local-file-access',
+         '-B', '0mm', '-L', '0mm', '-R', '0mm', '-T', '0mm']
+# The number of letters handed to each wkhtmltopdf process in batch mode
+BATCH_SIZE = 200
+# The most pages in each merged output file, or None for a single file
+SHARD_PAGES = None
+# Whether each postcode sector gets merged output files of its own
+SHARD_BY_SECTOR = False
+# Whether fonts and images identical across letters are merged only once
+DEDUPE_RESOURCES = False
+# The number of UPRNs to fetch calendar rows for in each bulk query
+TABLE_BATCH_SIZE = 500
+# The number of bulk built tables to check against changes_html_table.sql,
+# on top of one table of each shape
+TABLE_VERIFY_SAMPLE = 3
+# The shapes of the bulk built tables already found to match
+# changes_html_table.sql this run
+VERIFIED_SHAPES = set()
+# The saved schedule days of the newest rounds table, set when changes are
+# found against it locally instead of with changes_info.sql
+SNAPSHOT = None
+# The local addresses looked up by UPRN, set when the changed properties'
+# addresses are looked up instead of fetched with changes_addresses.sql
+ADDRESSES = None
+# The calendar columns in table order, and the name they are selected as in
+# changes_html_table.sql
+CALENDAR_COLUMNS = [
+    ('Refuse', 'Refuse'),
+    ('Recycling', 'Recycling'),
+    ('Mix', 'NEWRecycling'),
+    ('Glass', 'Glass'),
+    ('Garden', 'Garden')]
+
+CSS = '' \
+    'body {\n' \
+    'font-family: "Calibri", sans-serif;\n' \
+    '}\n' \
+    'h1 {\n' \
+    'font-weight: normal;\n' \
+    'text-align: center;\n' \
+    'font-size: 36pt;\n' \
+    'text-decoration: underline;\n' \
+    '}\n' \
+    'p {\n' \
+    'font-size: 12pt;\n' \
+    '}\n' \
+    '.addr {\n' \
+    'position: fixed;\n' \
+    'top: 5cm;\n' \
+    'height: 4cm;\n' \
+    'left: 1.8cm;\n' \
+    'width: 9cm;\n' \
+    'font-weight: bold;\n' \
+    'font-size: 12pt;\n' \
+    '}\n' \
+    '.content {\n' \
+    'position: fixed;\n' \
+    'top: 11cm;\n' \
+    'left: 1.8cm;\n' \
+    'width: 17cm;\n' \
+    'height: 13cm;\n' \
+    'font-family: "Calibri";\n' \
+    'font-size: 12pt;\n' \
+    '}\n' \
+    '.header {\n' \
+    'text-decoration: underline;\n' \
+    '}\n' \
+    '.signature {\n' \
+    'position: fixed;\n' \
+    'left: 1.8cm;\n' \
+    'top: 22cm;\n' \
+    '}\n' \
+    '.footer {\n' \
+    'position: fixed;\n' \
+    'left: 1.8cm;\n' \
+    'font-size: 9pt;\n' \
+    'top: 27.5cm;\n' \
+    'color: #808080;\n' \
+    '}\n' \
+    '.hdc-td-greenborder {\n' \
+    'font-size: 12pt;\n' \
+    '}\n' \
+    '#collections-table {\n' \
+    'color: #444444;\n' \
+    'margin: 0 auto;\n' \
+    '}\n' \
+    '.table {\n' \
+    'width: 450px;\n' \
+    '}\n' \
+    '.table-striped tbody tr:nth-of-type(odd) {\n' \
+    'background-color: #FFFFFF;\n' \
+    '}\n' \
+    'tr {\n' \
+    'border-bottom: 1px solid #C8C8C8;\n' \
+    '}\n'
+
+LETTER = '' \
+    '<!DOCTYPE html>\n' \
+    '<html>\n' \
+    '<head>\n' \
+    '{{stylesheet}}\n' \
+    '</head>\n' \
+    '<body>\n' \
+    '<section>\n' \
+    '<div class="addr">\n' \
+    '{{occup}}<br>\n' \
+    '{{addr}}\n' \
+    '</div>\n' \
+    '<br>\n' \
+    '<div class="content">\n' \
+    '{{date}}\n' \
+    '<p>\n' \
+    'Dear Sir/Madam\n' \
+    '</p>\n' \
+    '<p class="header">\n' \
+    '<strong>Waste and Recycling Collections</strong>\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'At the start of June 2018 we implemented changes to our ' \
+    'collections for waste and recycling which meant changes for your ' \
+    'home. Unfortunately we have identified further amendments needed ' \
+    'to ensure the most efficient service deliver for our residents. ' \
+    'This only affects a small number of properties - but it includes ' \
+    'your home.\n' \
+    '</p>\n' \
+    '<p>\n' \
+    'Below are the details of the new fortnightly collection ' \
+    'arrangements for your property, which come into effect as ' \
+    'detailed below:\n' \
+    '</p>\n' \
+    '{{table}}\n' \
+    '<br>\n' \
+    'Please put your containers at your collection point by 6am. I ' \
+    'would like to apologise for any inconvenience caused as a result ' \
+    'of these further changes.\n' \
+    '</div>\n' \
+    '<div class="signature">\n' \
+    'Gary Brown\n' \
+    '<br>\n' \
+    '<span>\n' \
+    'Waste & Street Scene Manager\n' \
+    '</span>\n' \
+    '<br> WasteandStreetScene@hambleton.gov.uk\n' \
+    '</div>\n' \
+    '<div class="footer">\n' \
+    '<span style="color: #9EB4D0">\n' \
+    'Hambleton District Council\n' \
+    '</span>\n' \
+    '<br> Waste and Street Scene, Bridge End House\n' \
+    '<br> Darlington Road, Northallerton, North Yorkshire DL6 2PL\n' \
+    '<br>\n' \
+    '<span style="font-size: 7pt">\n' \
+    'Some of our calls are recorded. For further information visit ' \
+    'our website www.hambleton.gov.uk to view the Call Recording ' \
+    'Policy\n' \
+    '</span>\n' \
+    '</div style="page-break-after: always;">\n' \
+    '</body>\n' \
+    '</html>\n'
+
+STYLESHEET = '.\\htmls\\css\\changes.css'
 
 class CollectionChange():
     """
     Represents a generic change in collection arrangements
     """
-    def __init__(self, occup: str, addr: str, uprn: str):
+    def __init__(self, occup: str, addr: str, uprn: str, schedule: tuple = ()):
         """
         Args:
             occup (str): The occupier of the property
             addr (str): The address of the property
             uprn (str): The UPRN of the property
+            schedule (tuple): The new REF, RECY, MIX, GLASS and GW schedule
+            days of the property
         """
         self.occup = occup
         self.addr = addr
         # Used for display on the letter
         self.addr_str = addr.replace(', ', '<br>')
         self.uprn = uprn
+        self.schedule = schedule
+
+
+class TableCache():
+    """
+    Holds the HTML tables already built this run, keyed by the schedule
+    days of the properties they were built for
+    """
+    def __init__(self):
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return f'Table cache: {self.hits} hits, {self.misses} misses, ' \
+            f'{len(self.tables)} distinct tables'
 
 def get_latest_table() -> str:
     """
@@ -58,155 +249,293 @@ def query_changes(table: str) -> list:
     Returns:
         A list of CollectionChange objects
     """
-    changes = []
-    with open('.\\changes_info.sql', 'r') as changes_query_f:
-        changes_query = changes_query_f.read()
-    changes_query = changes_query.replace('<newest_table>', table)
-    cursor = CONN.cursor()
-    cursor.execute(changes_query)
-    results = cursor.fetchall()
-    for result in results:
-        changes.append(CollectionChange(
+    return list(iter_changes(table))
+
+def iter_changes(
+        table: str,
+        fetch_size: int = pipeline.FETCH_SIZE,
+        conn: pyodbc.Connection = None):
+    """
+    Queries the SQL database for addresses of properties that are
+    having a change in the collections, reading the results a batch at a
+    time
+    Args:
+        table (str): The most recent table to query from
+        fetch_size (int): The number of rows to read at a time
+        conn (pyodbc.Connection): The connection to run the query on,
+        defaults to CONN
+    Yields:
+        (CollectionChange): The information from each row of the query
+    """
+    if SNAPSHOT:
+        yield from diff_changes(SNAPSHOT, fetch_size, conn)
+        return
+    with METRICS.time('query', count=0):
+        cursor = SQL.execute(
+            conn or CONN, 'changes_info', newest_table=table)
+    rows = pipeline.fetch_batches(cursor, fetch_size)
+    for result in METRICS.iterate('fetch', rows):
+        yield CollectionChange(
             result.occup,
             result.addr,
-            result.uprn))
-    return changes
+            result.uprn,
+            (result.new_ref,
+             result.new_recy,
+             result.new_mix,
+             result.new_glass,
+             result.new_gw))
+
+def schedule_days(row) -> tuple:
+    """
+    Args:
+        row (pyodbc.Row): A row from rounds_days.sql
+    Returns:
+        (tuple): The UPRN and the schedule days of the row
+    """
+    return (row.uprn, (row.days_ref,
+                       row.days_recy,
+                       row.days_mix,
+                       row.days_glass,
+                       row.days_gw))
+
+def load_snapshot(
+        table: str,
+        path: str,
+        fetch_size: int = pipeline.FETCH_SIZE) -> rounds_snapshot.Snapshot:
+    """
+    Loads the saved schedule days of the newest rounds table, reading them
+    from the database and saving them the first time the table is used
+    Args:
+        table (str): The most recent table, from get_latest_table()
+        path (str): The path of the snapshot file
+        fetch_size (int): The number of rows to read at a time
+    Returns:
+        (Snapshot): The schedule days of every property in table
+    """
+    snapshot = rounds_snapshot.Snapshot.load(path, table)
+    if snapshot is None:
+        start = time.perf_counter()
+        cursor = SQL.execute(CONN, 'rounds_days', rounds_table=table)
+        rows = pipeline.fetch_rows(cursor, fetch_size)
+        snapshot = rounds_snapshot.Snapshot.from_rows(
+            table, [schedule_days(row) for row in rows])
+        snapshot.save(path)
+        METRICS.record('snapshot', time.perf_counter() - start, 0)
+    return snapshot
+
+def fetch_addresses(uprns: list, conn: pyodbc.Connection = None) -> list:
+    """
+    Args:
+        uprns (list): The UPRNs to fetch the addresses of
+        conn (pyodbc.Connection): The connection to run the query on,
+        defaults to CONN
+    Returns:
+        (list): The (uprn, checksum, ADDRESS_BLOCK, postal address) of each
+        property found in the LLPG
+    """
+    placeholders = ', '.join(['?'] * len(uprns))
+    with METRICS.time('addresses', count=len(uprns)):
+        cursor = SQL.execute(
+            conn or CONN, 'llpg_addresses', *uprns, uprns=placeholders)
+        return [(row.uprn, row.checksum, row.address_block, row.addr_str)
+                for row in cursor.fetchall()]
 
-def create_html(change: CollectionChange) -> str:
+def load_addresses(
+        path: str,
+        max_age: float = address_index.MAX_AGE,
+        fetch_size: int = pipeline.FETCH_SIZE) -> address_index.AddressIndex:
+    """
+    Loads the address index, refreshing it from the LLPG first if it is
+    older than max_age
+    Args:
+        path (str): The path of the index file
+        max_age (float): The seconds the index is used for before it is
+        refreshed
+        fetch_size (int): The number of rows to read at a time
+    Returns:
+        (AddressIndex): The addresses of the properties in the LLPG
+    """
+    index = address_index.AddressIndex.load(path)
+    if index.stale(max_age):
+        cursor = SQL.execute(CONN, 'llpg_checksums')
+        rows = pipeline.fetch_rows(cursor, fetch_size)
+        fetched = index.refresh(
+            ((row.uprn, row.checksum) for row in rows), fetch_addresses)
+        index.save(path)
+        print(f'Refreshed {path}, fetched {fetched} addresses')
+    return index
+
+def diff_changes(
+        snapshot: rounds_snapshot.Snapshot,
+        fetch_size: int = pipeline.FETCH_SIZE,
+        conn: pyodbc.Connection = None):
+    """
+    Finds the properties having a change in their collections by comparing
+    their live schedule days against the snapshot, then fetches the
+    addresses of only the changed properties, or looks them up in
+    ADDRESSES if it is set
+    Args:
+        snapshot (Snapshot): The schedule days of the newest rounds table
+        fetch_size (int): The number of rows to read at a time
+        conn (pyodbc.Connection): The connection to run the queries on,
+        defaults to CONN
+    Yields:
+        (CollectionChange): Each property having a change
+    """
+    conn = conn or CONN
+    start = time.perf_counter()
+    cursor = SQL.execute(
+        conn, 'rounds_days', rounds_table='dbo.PropertyServiceRounds')
+    changed = {}
+    rows = pipeline.fetch_rows(cursor, fetch_size)
+    for uprn, days in map(schedule_days, rows):
+        if snapshot.changed(uprn, days):
+            changed[int(uprn)] = days
+    METRICS.record('detect', time.perf_counter() - start, len(changed))
+    for batch in converter.chunk(list(changed), TABLE_BATCH_SIZE):
+        if ADDRESSES is not None:
+            ADDRESSES.resolve(
+                batch, lambda uprns: fetch_addresses(uprns, conn))
+            for uprn in batch:
+                address = ADDRESSES.get(uprn)
+                if address is not None:
+                    # As changes_addresses.sql gives the occupier
+                    yield CollectionChange(
+                        'The Occupier',
+                        address[1],
+                        str(uprn),
+                        tuple(day or None for day in changed[uprn]))
+            continue
+        placeholders = ', '.join(['?'] * len(batch))
+        with METRICS.time('query', count=0):
+            cursor = SQL.execute(
+                conn, 'changes_addresses', *batch, uprns=placeholders)
+        rows = pipeline.fetch_batches(cursor, fetch_size)
+        for result in METRICS.iterate('fetch', rows):
+            # changes_info.sql gives a service the property doesn't have
+            # as NULL
+            days = changed[int(result.uprn)]
+            yield CollectionChange(
+                result.occup,
+                result.addr,
+                result.uprn,
+                tuple(day or None for day in days))
+
+def unfinished(changes):
+    """
+    Skips the changes whose letters were converted by an interrupted run.
+    Their PDFs are still waiting in pdfs/changes to be merged
+    Args:
+        changes (iterable): The CollectionChange objects from the query
+    Yields:
+        (CollectionChange): The changes that still need a letter
+    """
+    for change in changes:
+        if not JOURNAL.reached(change.uprn, 'converted'):
+            JOURNAL.record(change.uprn, 'queried')
+            yield change
+
+def uprn_of(html: str) -> str:
+    """
+    Gets the UPRN of the property an HTML file was written for
+    Args:
+        html (str): The path of the HTML file
+    Returns:
+        (str): The UPRN at the start of the file name
+    """
+    return ntpath.basename(html).split('-', 1)[0]
+
+def record_converted(result: converter.ConversionResult) -> int:
+    """
+    Records the letters in a successful conversion in the journal and
+    counts them as the run's letters, or adds them to the dead letters if
+    every attempt failed. The letters of a batch that failed are converted
+    again one at a time first, so one bad letter doesn't take the rest of
+    its batch with it
+    Args:
+        result (ConversionResult): The result of a single letter or a batch
+    Returns:
+        (int): The number of letters converted
+    """
+    if isinstance(result.html, converter.Document):
+        uprns = [result.html.key]
+    else:
+        htmls = [result.html] if isinstance(result.html, str) else result.html
+        uprns = [uprn_of(html) for html in htmls]
+    if result.ok:
+        JOURNAL.record_many(uprns, 'converted')
+        METRICS.letters += len(uprns)
+        return len(uprns)
+    if isinstance(result.html, list) and len(result.html) > 1:
+        return sum(record_converted(letter) for letter in split_batch(result))
+    for uprn in uprns:
+        DEAD_LETTERS.add(uprn, result)
+    return 0
+
+def split_batch(result: converter.ConversionResult) -> list:
+    """
+    Converts the letters of a batch that failed one at a time, into PDFs
+    that merge_pdfs() picks up in the batch's place
+    Args:
+        result (ConversionResult): The failed batch
+    Returns:
+        (list): The ConversionResult of each letter, in order
+    """
+    print(f'Converting the {len(result.html)} letters of {result.pdf} '
+          'one at a time')
+    if ntpath.basename(result.pdf).startswith('batch-'):
+        stem = result.pdf[:-len('.pdf')]
+    else:
+        stem = f'.\\pdfs\\changes\\batch-{next_batch():05}'
+    jobs = [(html, f'{stem}-{i:04}.pdf') for i, html in enumerate(result.html)]
+    results = converter.convert_all(jobs, FLAGS, None, PDF_CACHE, POLICY)
+    for letter in results:
+        print(letter)
+        METRICS.record('convert', letter.seconds)
+    return results
+
+def next_batch() -> int:
+    """
+    Gets the number of the first batch PDF to write, so batches left by an
+    interrupted run are merged rather than overwritten
+    Returns:
+        (int): One more than the highest batch number in pdfs/changes
+    """
+    batches = glob.glob('.\\pdfs\\changes\\batch-*.pdf')
+    if not batches:
+        return 0
+    # The letters of a failed batch are numbered after it, like
+    # batch-00001-0000.pdf
+    return max(int(ntpath.basename(batch)[6:-4].split('-')[0])
+               for batch in batches) + 1
+
+def compile_templates() -> letter_templates.Template:
+    """
+    Writes the shared stylesheet and compiles the letter with the date of
+    this run, so each letter only needs its address and table filling in
+    Returns:
+        (Template): The compiled letter
+    """
+    stylesheet = letter_templates.write_stylesheet(STYLESHEET, CSS)
+    date = datetime.datetime.now().strftime('%A %d %B %Y')
+    return letter_templates.Template(LETTER).bind(
+        stylesheet=stylesheet,
+        date=date)
+
+def create_html(change: CollectionChange, table: str) -> str:
     """
     Creates the HTML using the change information
     Args:
         change (CollectionChange): The changes to fill the template with
+        table (str): The HTML table with the property's collection days
     Returns:
         (str): The HTML template with the information filed in
     """
-    date = datetime.datetime.now().strftime('%A %d %B %Y')
-    html = '' \
-        '<!DOCTYPE html>\n' \
-        '<html>\n' \
-        '<head>\n' \
-        '<style>\n' \
-        'body {\n' \
-        'font-family: "Calibri", sans-serif;\n' \
-        '}\n' \
-        'h1 {\n' \
-        'font-weight: normal;\n' \
-        'text-align: center;\n' \
-        'font-size: 36pt;\n' \
-        'text-decoration: underline;\n' \
-        '}\n' \
-        'p {\n' \
-        'font-size: 12pt;\n' \
-        '}\n' \
-        '.addr {\n' \
-        'position: fixed;\n' \
-        'top: 5cm;\n' \
-        'height: 4cm;\n' \
-        'left: 1.8cm;\n' \
-        'width: 9cm;\n' \
-        'font-weight: bold;\n' \
-        'font-size: 12pt;\n' \
-        '}\n' \
-        '.content {\n' \
-        'position: fixed;\n' \
-        'top: 11cm;\n' \
-        'left: 1.8cm;\n' \
-        'width: 17cm;\n' \
-        'height: 13cm;\n' \
-        'font-family: "Calibri";\n' \
-        'font-size: 12pt;\n' \
-        '}\n' \
-        '.header {\n' \
-        'text-decoration: underline;\n' \
-        '}\n' \
-        '.signature {\n' \
-        'position: fixed;\n' \
-        'left: 1.8cm;\n' \
-        'top: 22cm;\n' \
-        '}\n' \
-        '.footer {\n' \
-        'position: fixed;\n' \
-        'left: 1.8cm;\n' \
-        'font-size: 9pt;\n' \
-        'top: 27.5cm;\n' \
-        'color: #808080;\n' \
-        '}\n' \
-        '.hdc-td-greenborder {\n' \
-        'font-size: 12pt;\n' \
-        '}\n' \
-        '#collections-table {\n' \
-        'color: #444444;\n' \
-        'margin: 0 auto;\n' \
-        '}\n' \
-        '.table {\n' \
-        'width: 450px;\n' \
-        '}\n' \
-        '.table-striped tbody tr:nth-of-type(odd) {\n' \
-        'background-color: #FFFFFF;\n' \
-        '}\n' \
-        'tr {\n' \
-        'border-bottom: 1px solid #C8C8C8;\n' \
-        '}\n' \
-        '</style>\n' \
-        '</head>\n' \
-        '<body>\n' \
-        '<section>\n' \
-        '<div class="addr">\n' \
-       f'{change.occup}<br>\n' \
-       f'{change.addr_str}\n' \
-        '</div>\n' \
-        '<br>\n' \
-        '<div class="content">\n' \
-        f'{date}\n' \
-        '<p>\n' \
-        'Dear Sir/Madam\n' \
-        '</p>\n' \
-        '<p class="header">\n' \
-        '<strong>Waste and Recycling Collections</strong>\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'At the start of June 2018 we implemented changes to our ' \
-        'collections for waste and recycling which meant changes for your ' \
-        'home. Unfortunately we have identified further amendments needed ' \
-        'to ensure the most efficient service deliver for our residents. ' \
-        'This only affects a small number of properties - but it includes ' \
-        'your home.\n' \
-        '</p>\n' \
-        '<p>\n' \
-        'Below are the details of the new fortnightly collection ' \
-        'arrangements for your property, which come into effect as ' \
-        'detailed below:\n' \
-        '</p>\n' \
-       f'{get_html_table(change.uprn)}\n' \
-        '<br>\n' \
-        'Please put your containers at your collection point by 6am. I ' \
-        'would like to apologise for any inconvenience caused as a result ' \
-        'of these further changes.\n' \
-        '</div>\n' \
-        '<div class="signature">\n' \
-        'Gary Brown\n' \
-        '<br>\n' \
-        '<span>\n' \
-        'Waste & Street Scene Manager\n' \
-        '</span>\n' \
-        '<br> WasteandStreetScene@hambleton.gov.uk\n' \
-        '</div>\n' \
-        '<div class="footer">\n' \
-        '<span style="color: #9EB4D0">\n' \
-        'Hambleton District Council\n' \
-        '</span>\n' \
-        '<br> Waste and Street Scene, Bridge End House\n' \
-        '<br> Darlington Road, Northallerton, North Yorkshire DL6 2PL\n' \
-        '<br>\n' \
-        '<span style="font-size: 7pt">\n' \
-        'Some of our calls are recorded. For further information visit ' \
-        'our website www.hambleton.gov.uk to view the Call Recording ' \
-        'Policy\n' \
-        '</span>\n' \
-        '</div style="page-break-after: always;">\n' \
-        '</body>\n' \
-        '</html>\n'
-    return html
+    with METRICS.time('render'):
+        return TEMPLATE.render(
+            occup=change.occup,
+            addr=change.addr_str,
+            table=table)
 
 def get_html_table(uprn: str) -> str:
     """
@@ -217,12 +546,229 @@ def get_html_table(uprn: str) -> str:
     Returns:
         (str): The HTML table with the change details
     """
-    with open('.\\changes_html_table.sql', 'r') as html_query_f:
-        html_query = html_query_f.read()
-    cursor = CONN.cursor()
-    cursor.execute(""" SET NOCOUNT ON; """ + html_query, uprn)
+    cursor = SQL.execute(
+        CONN, 'changes_html_table', uprn, prefix='SET NOCOUNT ON; ')
     return cursor.fetchone().html
 
+def get_html_tables(uprns: list, shapes: dict = None) -> dict:
+    """
+    Queries the SQL database for the collection calendar rows of many
+    properties at once and builds each property's HTML table from them
+    Args:
+        uprns (list): The UPRNs of the properties to get the tables for
+        shapes (dict): Filled in with the table_shape() of each UPRN, if
+        given
+    Returns:
+        (dict): The HTML table for each UPRN
+    """
+    tables = {}
+    for batch in converter.chunk(uprns, TABLE_BATCH_SIZE):
+        placeholders = ', '.join(['(?)'] * len(batch))
+        cursor = SQL.execute(
+            CONN,
+            'changes_calendar_bulk',
+            *batch,
+            prefix='SET NOCOUNT ON; ',
+            uprns=placeholders)
+        rows = {}
+        for row in cursor.fetchall():
+            rows.setdefault(str(row.uprn).strip(), []).append(row)
+        for uprn in batch:
+            uprn_rows = rows.get(str(uprn).strip(), [])
+            tables[uprn] = build_html_table(uprn_rows)
+            if shapes is not None:
+                shapes[uprn] = table_shape(uprn_rows)
+    return tables
+
+def shown_columns(rows: list) -> list:
+    """
+    Args:
+        rows (list): A property's rows from
+        tvfPropertyCollectionsCalendar_U_2
+    Returns:
+        (list): The (column, name) pairs of CALENDAR_COLUMNS the table
+        shows. A column is only shown if at least one week has a collection
+        for it
+    """
+    return [
+        (column, name) for column, name in CALENDAR_COLUMNS
+        if any(len(str(getattr(row, column) or '').rstrip()) > 0
+               for row in rows)]
+
+def table_shape(rows: list) -> tuple:
+    """
+    Gets what decides how a property's table is built, so the bulk built
+    tables can be checked against changes_html_table.sql for one property
+    of each kind
+    Args:
+        rows (list): A property's rows from
+        tvfPropertyCollectionsCalendar_U_2
+    Returns:
+        (tuple): The columns shown, whether any shown cell is NULL, and the
+        types of the values in the table
+    """
+    columns = [column for column, _ in shown_columns(rows)]
+    values = [getattr(row, column) for row in rows
+              for column in ['WeekCommencing'] + columns]
+    return (
+        tuple(columns),
+        any(value is None for value in values),
+        tuple(sorted({type(value).__name__ for value in values})))
+
+def build_html_table(rows: list) -> str:
+    """
+    Builds the same HTML table as changes_html_table.sql from a property's
+    collection calendar rows, following what p_pccQueryToHtmlTable and the
+    REPLACEs at the end of that query produce
+    Args:
+        rows (list): The property's rows from
+        tvfPropertyCollectionsCalendar_U_2
+    Returns:
+        (str): The HTML table with the change details
+    """
+    columns = shown_columns(rows)
+    width = (100 - 2) // (len(columns) + 1)
+    header = '<th>WeekCommencing</th>' + ''.join(
+        f'<th>{name}</th>' for _, name in columns)
+    body = ''
+    for row in rows:
+        values = [row.WeekCommencing] + [
+            getattr(row, column) for column, _ in columns]
+        body += '<tr xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        for value in values:
+            if value is None:
+                body += '<td xsi:nil="true"/>'
+            else:
+                body += f'<td>{xml_value(value)}</td>'
+        body += '</tr>'
+    html = '<div class="table"><table class="table" ' \
+        'style="text-align: center;border-collapse:collapse; ' \
+        f'height: 500px;"><tr>{header}</tr>{body}</table></div>'
+    replacements = [
+        ('|^', '<'),
+        ('|$', '>'),
+        ('|/', '/'),
+        ('<td xsi:nil="true"/>', '<td>'),
+        ('<td>', '<td id="licences" class="hdc-td-greenborder" '
+                 f'style="width:{width}%;">'),
+        ('<tr xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">',
+         '<tr>'),
+        ('<th>', '<th class="hdc-td-greenborder">'),
+        ('WeekCommencing', 'Week Starting'),
+        (' height: 500px;', ''),
+        ('<div class="table"', '<div id="collections-table" class="table "'),
+        ('NEWRecycling', 'Recycling'),
+        ('https://', 'http://'),
+        ('class="table" style="text-align: center;border-collapse:collapse;',
+         'class="table" style="text-align: center; border-collapse: '
+         'collapse; margin-bottom: 5px;')]
+    for old, new in replacements:
+        html = html.replace(old, new)
+    return html
+
+def xml_value(value) -> str:
+    """
+    Formats a value the way SQL Server's FOR XML does
+    Args:
+        value: The value of a column
+    Returns:
+        (str): The escaped text of the value
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        text = value.isoformat()
+    else:
+        text = str(value)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def get_tables(
+        changes: list,
+        cache: TableCache,
+        bulk: bool = True,
+        by_schedule: bool = True) -> dict:
+    """
+    Gets the HTML table for every change. Properties with the same schedule
+    days get the same table, so only one table is built per schedule
+    Args:
+        changes (list): The CollectionChange objects to get tables for
+        cache (TableCache): The tables already built this run
+        bulk (bool): Whether to try the bulk query at all
+        by_schedule (bool): Whether to share tables between properties with
+        the same schedule days, otherwise each UPRN gets its own table
+    Returns:
+        (dict): The HTML table for each UPRN
+    """
+    start = time.perf_counter()
+    keys = {}
+    to_fetch = {}
+    for change in changes:
+        key = change.schedule if by_schedule else change.uprn
+        keys[change.uprn] = key
+        if key in cache.tables or key in to_fetch:
+            cache.hits += 1
+        else:
+            to_fetch[key] = change.uprn
+            cache.misses += 1
+    fetched = fetch_tables(list(to_fetch.values()), bulk)
+    for key, uprn in to_fetch.items():
+        cache.tables[key] = fetched[uprn]
+    METRICS.record('table_fetch', time.perf_counter() - start, len(keys))
+    return {uprn: cache.tables[key] for uprn, key in keys.items()}
+
+def fetch_tables(uprns: list, bulk: bool = True) -> dict:
+    """
+    Gets the HTML table for each UPRN, using the bulk query unless its
+    output differs from changes_html_table.sql for a sample of properties.
+    The sample has one property for each shape of table not yet checked
+    this run, as the columns shown, NULL cells and the types of the values
+    are what build_html_table() could get wrong
+    Args:
+        uprns (list): The UPRNs of the properties to get tables for
+        bulk (bool): Whether to try the bulk query at all
+    Returns:
+        (dict): The HTML table for each UPRN
+    """
+    uprns = list(dict.fromkeys(uprns))
+    if bulk and uprns:
+        shapes = {}
+        tables = get_html_tables(uprns, shapes)
+        sample = {}
+        if not VERIFIED_SHAPES:
+            sample.update(dict.fromkeys(uprns[:TABLE_VERIFY_SAMPLE]))
+        for uprn in uprns:
+            if shapes[uprn] not in VERIFIED_SHAPES and \
+                    shapes[uprn] not in map(shapes.get, sample):
+                sample[uprn] = None
+        if all(tables[uprn] == get_html_table(uprn) for uprn in sample):
+            VERIFIED_SHAPES.update(shapes[uprn] for uprn in sample)
+            return tables
+        print('Bulk tables differ from changes_html_table.sql, '
+              'falling back to one query per property')
+    return {uprn: get_html_table(uprn) for uprn in uprns}
+
+def letter_name(change: CollectionChange) -> str:
+    """
+    Gets the name of the HTML and PDF files of a change's letter
+    Args:
+        change (CollectionChange): The change the letter is for
+    Returns:
+        (str): The file name without its extension
+    """
+    return f'{change.uprn}-{change.addr}'
+
+def document_job(change: CollectionChange, html: str) -> tuple:
+    """
+    Keeps a rendered letter in memory to be piped to wkhtmltopdf, instead
+    of saving it to file
+    Args:
+        change (CollectionChange): The change the letter is for
+        html (str): The HTML of the letter
+    Returns:
+        (tuple): The Document and the path to write its PDF to
+    """
+    JOURNAL.record(change.uprn, 'rendered')
+    return (converter.Document(html, str(change.uprn)),
+            f'.\\pdfs\\changes\\{letter_name(change)}.pdf')
+
 def save_html(html: str, change: CollectionChange) -> str:
     """
     Writes the HTML to file to be converted later
@@ -233,52 +779,209 @@ def save_html(html: str, change: CollectionChange) -> str:
     Returns:
         A string denoting success
     """
-    dir_path = f'.\\htmls\\changes'
-    file_path = f'{dir_path}\\{change.uprn}-{change.addr}.html'
-    with open(file_path, 'w+') as html_f:
-        html_f.write(html)
+    file_path = f'.\\htmls\\changes\\{letter_name(change)}.html'
+    with METRICS.time('write', size=len(html.encode())):
+        with open(file_path, 'w+') as html_f:
+            html_f.write(html)
+    JOURNAL.record(change.uprn, 'rendered')
     return f'Saved {file_path}'
 
-def convert_html() -> str:
+def convert_html(workers: int = None) -> str:
     """
-    Converts each HTML file to a PDF using wkhtmltopdf
+    Converts each HTML file to a PDF using a pool of wkhtmltopdf workers
+    Args:
+        workers (int): The number of conversions to run at once, defaults
+        to the number of CPUs
     Returns:
         A string denoting success
     """
-    exe = '"C:\\Program Files\\wkhtmltopdf\\bin\\wkhtmltopdf.exe"'
-    htmls = glob.glob('.\\htmls\\changes\\*.html')
-    count = 0
+    # Sorted so the merged PDF is always in the same order
+    htmls = sorted(glob.glob('.\\htmls\\changes\\*.html'))
+    jobs = []
     for html in htmls:
-        out_f = html[16:-5]
-        pdf = f'.\\pdfs\\changes\\{out_f}.pdf'
-        flags = '--disable-smart-shrinking ' \
-        '-B 0mm -L 0mm -R 0mm -T 0mm'
-        args = f'{exe} {flags} "{html}" "{pdf}"'
-        print(args)
-        subprocess.call(args, shell=False)
-        print(f'Converted {pdf}')
-        count += 1
+        out_f = ntpath.basename(html)[:-5]
+        jobs.append((html, f'.\\pdfs\\changes\\{out_f}.pdf'))
+    results = converter.convert_all(jobs, FLAGS, workers, PDF_CACHE, POLICY)
+    count = 0
+    for result in results:
+        print(result)
+        METRICS.record('convert', result.seconds)
+        count += record_converted(result)
     return f'Converted {count}/{len(htmls)} HTMLs to PDFs'
 
+def convert_documents(changes: list, tables: dict, workers: int = None) -> str:
+    """
+    Renders each letter and pipes it straight into wkhtmltopdf, so no HTML
+    is written to disk. Letters are only rendered as the workers are ready
+    for them
+    Args:
+        changes (list): The CollectionChange objects to write letters for
+        tables (dict): The HTML table for each UPRN
+        workers (int): The number of conversions to run at once, defaults
+        to the number of CPUs
+    Returns:
+        A string denoting success
+    """
+    jobs = (document_job(change, create_html(change, tables[change.uprn]))
+            for change in changes)
+    results = converter.convert_stream(
+        jobs, FLAGS, workers, PDF_CACHE, POLICY)
+    count = 0
+    for result in results:
+        print(result)
+        METRICS.record('convert', result.seconds)
+        count += record_converted(result)
+    return f'Converted {count}/{len(changes)} letters to PDFs'
+
+def convert_batches(sys_date: str, batch_size: int, workers: int = None) -> str:
+    """
+    Converts the HTML files in batches, passing each batch to a single
+    wkhtmltopdf process so that its pages come out as one PDF. A run that
+    fits in one batch is written straight to the output file, unless it is
+    to be sharded by page count or have its shared resources written once,
+    which only merging does. Otherwise each batch becomes one PDF that
+    merge_pdfs() joins together with any left by an interrupted run
+    Args:
+        sys_date (str): A string of the date in YYYYmmddHHMM format, used as
+        the file name for the output file
+        batch_size (int): The number of HTML files per wkhtmltopdf process
+        workers (int): The number of batches to convert at once, defaults
+        to the number of CPUs
+    Returns:
+        A string denoting success
+    """
+    htmls = sorted(glob.glob('.\\htmls\\changes\\*.html'))
+    batches = converter.chunk(htmls, batch_size)
+    resumed = glob.glob('.\\pdfs\\changes\\*.pdf')
+    if len(batches) == 1 and not (resumed or SHARD_PAGES or DEDUPE_RESOURCES):
+        jobs = [(batches[0], f'.\\pdfs\\changes\\out\\{sys_date}.pdf')]
+    else:
+        # Zero padded so merge_pdfs() picks the batches up in order
+        jobs = [(batch, f'.\\pdfs\\changes\\batch-{i:05}.pdf')
+                for i, batch in enumerate(batches, next_batch())]
+    results = converter.convert_all(jobs, FLAGS, workers, PDF_CACHE, POLICY)
+    count = 0
+    for result in results:
+        print(result)
+        METRICS.record('convert', result.seconds, len(result.html))
+        count += record_converted(result)
+    # A single batch that failed leaves its letters to merge instead
+    if glob.glob('.\\pdfs\\changes\\*.pdf'):
+        print(merge_pdfs(sys_date))
+    return f'Converted {count}/{len(htmls)} HTMLs to PDFs ' \
+        f'in {len(batches)} batches'
+
+def stream_letters(
+        changes,
+        cache: TableCache,
+        config: dict,
+        sys_date: str) -> str:
+    """
+    Gets the tables for, renders, saves and converts the letters as a
+    stream, so that conversion starts on the first letters while the rest
+    are still being fetched. The PDFs are merged once every letter is done
+    Args:
+        changes (iterable): The CollectionChange objects to write letters
+        for, usually from iter_changes()
+        cache (TableCache): The tables already built this run
+        config (dict): The settings from .config_chngs
+        sys_date (str): A string of the date in YYYYmmddHHMM format, used as
+        the file name for the output file
+    Returns:
+        A string denoting success
+    """
+    fetch_size = config.get('fetch_size', pipeline.FETCH_SIZE)
+    batch_size = config.get('batch_size', BATCH_SIZE)
+    in_memory = config.get('in_memory', False)
+
+    def with_tables():
+        for batch in pipeline.batched(changes, fetch_size):
+            tables = get_tables(
+                batch,
+                cache,
+                config.get('bulk_tables', True),
+                config.get('table_cache', True))
+            for change in batch:
+                yield change, tables[change.uprn]
+
+    def save(letter: tuple) -> str:
+        change, html = letter
+        print(save_html(html, change))
+        return f'.\\htmls\\changes\\{letter_name(change)}.html'
+
+    htmls = pipeline.stream(with_tables(), [
+        lambda letter: (letter[0], create_html(*letter)),
+        (lambda letter: document_job(*letter)) if in_memory else save])
+
+    first_batch = next_batch()
+
+    def jobs():
+        if in_memory:
+            yield from htmls
+        elif batch_size:
+            batches = pipeline.batched(htmls, batch_size)
+            for i, batch in enumerate(batches, first_batch):
+                yield batch, f'.\\pdfs\\changes\\batch-{i:05}.pdf'
+        else:
+            for html in htmls:
+                out_f = ntpath.basename(html)[:-5]
+                yield html, f'.\\pdfs\\changes\\{out_f}.pdf'
+
+    count = 0
+    total = 0
+    results = converter.convert_stream(
+        jobs(), FLAGS, config.get('workers'), PDF_CACHE, POLICY)
+    for result in results:
+        print(result)
+        if isinstance(result.html, (str, converter.Document)):
+            size = 1
+        else:
+            size = len(result.html)
+        METRICS.record('convert', result.seconds, size)
+        total += size
+        count += record_converted(result)
+    print(merge_pdfs(sys_date))
+    return f'Converted {count}/{total} HTMLs to PDFs'
+
 def merge_pdfs(sys_date: str) -> str:
     """
-    Merges each output PDF page into a single document
+    Merges each output PDF page into a single document, or into shards of
+    at most SHARD_PAGES pages and one postcode sector each if they are set.
+    Each shard is written and closed before the next one is started. With
+    DEDUPE_RESOURCES set, resources identical across letters, like their
+    embedded fonts, are written once in each shard
     Args:
         sys_date (str): A string of the date in YYYYmmddHHMM format, used as
         the file name for the output file
     Returns:
         A string denoting success
     """
-    pdfs = glob.glob('.\\pdfs\\changes\\*.pdf')
-    merger = PdfFileMerger()
+    pdfs = sorted(glob.glob('.\\pdfs\\changes\\*.pdf'))
+    if SHARD_BY_SECTOR:
+        pdfs.sort(key=pdf_merge.postcode_sector)
+    start = time.perf_counter()
     count = 0
-    for pdf in pdfs:
-        merger.append(PdfFileReader(pdf), 'rb')
-        count += 1
-    with open(f'.\\pdfs\\changes\\out\\{sys_date}.pdf', 'wb') as pdf_out:
-        merger.write(pdf_out)
-    merger.close()
-    return f'Merged {count}/{len(pdfs)} PDFs'
+    files = 0
+    size = 0
+    input_size = 0
+    out_path = f'.\\pdfs\\changes\\out\\{sys_date}'
+    shards = pdf_merge.merge(
+        pdfs, out_path, SHARD_PAGES, SHARD_BY_SECTOR, DEDUPE_RESOURCES)
+    for shard in shards:
+        print(f'Wrote {shard.pages} pages to {shard.path}, '
+              f'{shard.size} bytes from {shard.input_size}, '
+              f'{shard.shared} duplicate resources removed')
+        METRICS.record(
+            'merge', time.perf_counter() - start, shard.count, shard.size)
+        count += shard.count
+        files += 1
+        size += shard.size
+        input_size += shard.input_size
+        start = time.perf_counter()
+    saved = 1 - size / input_size if input_size else 0.0
+    return f'Merged {count}/{len(pdfs)} PDFs into {files} files, ' \
+        f'{size / 2 ** 20:.1f} MB from {input_size / 2 ** 20:.1f} MB ' \
+        f'({saved:.0%} smaller)'
 
 def clean_files() -> str:
     """
@@ -287,6 +990,7 @@ def clean_files() -> str:
     Returns:
         A string denoting success
     """
+    start = time.perf_counter()
     count = 0
     htmls_to_remove = glob.glob('.\\htmls\\changes\\*.html')
     pdfs_to_remove = glob.glob('.\\pdfs\\changes\\*.pdf')
@@ -294,24 +998,112 @@ def clean_files() -> str:
     for remove_f in to_remove:
         os.remove(remove_f)
         count += 1
+    METRICS.record('cleanup', time.perf_counter() - start, count)
     return f'Cleaned up {count} files'
 
 if __name__ == '__main__':
     sys_date = datetime.datetime.today().strftime('%Y%m%d%H%M')
     with open ('.\\.config_chngs', 'r') as config_f:
         config = json.load(config_f)
-    CONN = pyodbc.connect(
-        driver=config['driver'],
-        server=config['server'],
-        database=config['database'],
-        uid=config['uid'],
-        pwd=config['pwd'])
+    METRICS = metrics.Metrics('new_rounds_gen_html')
+    SQL = statements.Registry([
+        'changes_info',
+        'changes_html_table',
+        'changes_calendar_bulk',
+        'rounds_days',
+        'changes_addresses',
+        'llpg_checksums',
+        'llpg_addresses'])
+    POOL = connections.ConnectionPool(
+        lambda: pyodbc.connect(
+            driver=config['driver'],
+            server=config['server'],
+            database=config['database'],
+            uid=config['uid'],
+            pwd=config['pwd']),
+        config.get('connections', connections.POOL_SIZE))
+    # The main connection is kept for the whole run, the pool lends out
+    # any others that are needed
+    CONN = POOL.connect()
     table = get_latest_table()
-    changes = query_changes(table)
-    for change in changes:
-        html = create_html(change)
-        print(save_html(html, change))
-    print(convert_html())
-    print(merge_pdfs(sys_date))
+    if config.get('incremental'):
+        SNAPSHOT = load_snapshot(
+            table,
+            config.get('rounds_snapshot', '.\\rounds.snapshot'),
+            config.get('fetch_size', pipeline.FETCH_SIZE))
+        print(SNAPSHOT)
+        if config.get('address_index'):
+            ADDRESSES = load_addresses(
+                config.get('address_index_path', '.\\llpg.addresses'),
+                config.get('address_index_age', address_index.MAX_AGE),
+                config.get('fetch_size', pipeline.FETCH_SIZE))
+    # A journal left for an older snapshot table is discarded
+    JOURNAL = journal.Journal(
+        '.\\changes.journal' if config.get('journal', True) else None,
+        table)
+    if JOURNAL.stages:
+        # Only the HTML is redone, the converted PDFs are merged as they are
+        for html in glob.glob('.\\htmls\\changes\\*.html'):
+            os.remove(html)
+        print(f'Resuming from {JOURNAL}')
+    else:
+        print(clean_files())
+    table_cache = TableCache()
+    TEMPLATE = compile_templates()
+    PDF_CACHE = pdf_cache.from_config(config, CSS)
+    POLICY = converter.retry_policy(config)
+    DEAD_LETTERS = converter.DeadLetters(
+        config.get('dead_letters', '.\\changes_failed.json'))
+    SHARD_PAGES = config.get('shard_pages')
+    SHARD_BY_SECTOR = config.get('shard_by_sector', False)
+    DEDUPE_RESOURCES = config.get('dedupe_resources', False)
+    if SHARD_BY_SECTOR:
+        # Batches would mix sectors, so each letter gets a PDF of its own
+        config['batch_size'] = 0
+    if config.get('stream'):
+        # The table queries run while the changes are still being read, so
+        # the changes query needs a connection of its own
+        with POOL.connection() as changes_conn:
+            changes = unfinished(iter_changes(
+                table,
+                config.get('fetch_size', pipeline.FETCH_SIZE),
+                changes_conn))
+            print(stream_letters(changes, table_cache, config, sys_date))
+    else:
+        changes = list(unfinished(query_changes(table)))
+        tables = get_tables(
+            changes,
+            table_cache,
+            config.get('bulk_tables', True),
+            config.get('table_cache', True))
+        batch_size = config.get('batch_size', BATCH_SIZE)
+        if config.get('in_memory'):
+            print(convert_documents(changes, tables, config.get('workers')))
+            print(merge_pdfs(sys_date))
+        else:
+            for change in changes:
+                html = create_html(change, tables[change.uprn])
+                print(save_html(html, change))
+            if batch_size:
+                print(convert_batches(
+                    sys_date, batch_size, config.get('workers')))
+            else:
+                print(convert_html(config.get('workers')))
+                print(merge_pdfs(sys_date))
+    print(DEAD_LETTERS.write())
+    JOURNAL.clear()
     print(clean_files())
-    print(f'Done! Output at /pdfs/changes/{sys_date}.pdf')
\ No newline at end of file
+    print(table_cache)
+    print(letter_templates.render_report([TEMPLATE]))
+    print(SQL)
+    if ADDRESSES is not None:
+        print(ADDRESSES)
+        # Keeps the addresses of properties added since the last refresh
+        if ADDRESSES.dirty:
+            ADDRESSES.save(
+                config.get('address_index_path', '.\\llpg.addresses'))
+    print(METRICS)
+    print(METRICS.write(config.get('metrics_path', '.\\changes_metrics')))
+    if PDF_CACHE:
+        print(PDF_CACHE)
+    print(f'Done! Output at /pdfs/changes/out/{sys_date}*.pdf')
\ No newline at end of file
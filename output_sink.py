@@ -0,0 +1,236 @@
+"""
+output_sink.py
+Where gen_html.py writes its finished PDFs
+How it works:
+By default the PDFs are converted straight into the destination directory.
+With a staging directory set, they are converted into it instead, and once
+enough letters are ready they are published to the destination as one
+batch, on a pool of upload threads so a slow share doesn't hold up
+conversion. Each file, or the zip archive of a batch, is copied to the
+destination under a temporary name and then renamed, so nothing reading
+the destination sees half a file. A batch's files are only removed from
+staging once they have all been published, so an interrupted run can
+publish them again. A batch that can't be published is handed back with
+its error instead of stopping the run
+"""
+import os
+import time
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# The number of letters published together
+BATCH_SIZE = 50
+# The number of batches published at once
+WORKERS = 4
+
+
+class Batch():
+    """
+    Represents the letters published together
+    """
+    def __init__(self, number: int):
+        """
+        Args:
+            number (int): The number of the batch in the run
+        """
+        self.number = number
+        self.keys = []
+        self.paths = []
+        self.size = 0
+        self.seconds = 0.0
+        # Why the batch couldn't be published, if it couldn't
+        self.error = None
+
+
+class Sink():
+    """
+    Represents a destination directory the PDFs are converted straight into
+    """
+    def __init__(self, destination: str):
+        """
+        Args:
+            destination (str): The directory the PDFs end up in
+        """
+        self.destination = destination
+        self.directory = destination
+        self.published = 0
+
+    def __str__(self) -> str:
+        return f'Published {self.published} letters to {self.destination}'
+
+    def add(self, key: str, paths: list) -> list:
+        """
+        Adds a letter whose files are ready to publish
+        Args:
+            key (str): The journal key of the letter
+            paths (list): The letter's files, under directory
+        Returns:
+            (list): The Batch objects published since the last call
+        """
+        batch = Batch(self.published)
+        batch.keys.append(key)
+        batch.paths.extend(paths)
+        self.published += 1
+        return [batch]
+
+    def flush(self) -> list:
+        """
+        Publishes any letters still waiting and waits for every batch
+        Returns:
+            (list): The Batch objects published since the last call
+        """
+        return []
+
+    def close(self):
+        pass
+
+
+class StagedSink(Sink):
+    """
+    Represents a destination directory the PDFs are published to in
+    batches from a local staging directory
+    """
+    def __init__(
+            self,
+            destination: str,
+            staging: str,
+            run: str,
+            batch_size: int = BATCH_SIZE,
+            workers: int = WORKERS,
+            archive: bool = False):
+        """
+        Args:
+            destination (str): The directory the PDFs end up in
+            staging (str): The local directory to convert the PDFs into
+            run (str): Identifies the run, used to name its archives
+            batch_size (int): The number of letters published together
+            workers (int): The number of batches published at once
+            archive (bool): Whether to publish each batch as one zip
+            archive instead of as separate files
+        """
+        super().__init__(destination)
+        os.makedirs(staging, exist_ok=True)
+        self.directory = staging
+        self.run = run
+        self.batch_size = batch_size
+        self.archive = archive
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.batch = Batch(0)
+        self.batches = 0
+        self.pending = []
+
+    def __str__(self) -> str:
+        return f'Published {self.published} letters to ' \
+            f'{self.destination} in {self.batches} batches'
+
+    def add(self, key: str, paths: list) -> list:
+        self.batch.keys.append(key)
+        self.batch.paths.extend(paths)
+        if len(self.batch.keys) >= self.batch_size:
+            self._submit()
+        return self._finished(wait=False)
+
+    def flush(self) -> list:
+        if self.batch.keys:
+            self._submit()
+        return self._finished(wait=True)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def _submit(self):
+        self.pending.append(self.pool.submit(self._publish, self.batch))
+        self.batches += 1
+        self.batch = Batch(self.batches)
+
+    def _finished(self, wait: bool) -> list:
+        """
+        Args:
+            wait (bool): Whether to wait for the batches still publishing
+        Returns:
+            (list): The Batch objects that have finished publishing, in
+            order, with the error of any that failed
+        """
+        finished = []
+        while self.pending and (wait or self.pending[0].done()):
+            batch = self.pending.pop(0).result()
+            if batch.error is None:
+                self.published += len(batch.keys)
+            finished.append(batch)
+        return finished
+
+    def _destination(self, path: str) -> str:
+        """
+        Args:
+            path (str): The path of a file under the staging directory
+        Returns:
+            (str): The path to publish the file to
+        """
+        return f'{self.destination}{path[len(self.directory):]}'
+
+    def _publish(self, batch: Batch) -> Batch:
+        """
+        Copies a batch's files to the destination, then removes them from
+        staging
+        Args:
+            batch (Batch): The batch to publish
+        Returns:
+            (Batch): The batch, with its size and how long it took, or the
+            error that stopped it
+        """
+        try:
+            self._upload(batch)
+        except (IOError, FileNotFoundError) as error:
+            batch.error = error
+        return batch
+
+    def _upload(self, batch: Batch):
+        """
+        Args:
+            batch (Batch): The batch to publish
+        """
+        start = time.perf_counter()
+        if self.archive:
+            name = f'letters-{self.run}-{batch.number:05}.zip'
+            archive = f'{self.directory}\\{name}'
+            with zipfile.ZipFile(archive, 'w') as archive_f:
+                for path in batch.paths:
+                    # Archive names use forward slashes on every system
+                    arc_name = path[len(self.directory) + 1:]
+                    archive_f.write(path, arc_name.replace('\\', '/'))
+            uploads = [(archive, f'{self.destination}\\{name}')]
+        else:
+            uploads = [(path, self._destination(path))
+                       for path in batch.paths]
+        for source, target in uploads:
+            shutil.copyfile(source, f'{target}.part')
+            os.replace(f'{target}.part', target)
+            batch.size += os.path.getsize(target)
+        for source, _ in uploads:
+            os.remove(source)
+        if self.archive:
+            for path in batch.paths:
+                os.remove(path)
+        batch.seconds = time.perf_counter() - start
+
+
+def from_config(config: dict, destination: str, run: str) -> Sink:
+    """
+    Args:
+        config (dict): The settings from .config
+        destination (str): The directory the PDFs end up in
+        run (str): Identifies the run, used to name its archives
+    Returns:
+        (Sink): A StagedSink if staging_dir is set, otherwise a Sink that
+        converts straight into destination
+    """
+    if not config.get('staging_dir'):
+        return Sink(destination)
+    return StagedSink(
+        destination,
+        config['staging_dir'],
+        run,
+        config.get('publish_batch_size', BATCH_SIZE),
+        config.get('publish_workers', WORKERS),
+        config.get('publish_archive', False))
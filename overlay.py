@@ -0,0 +1,181 @@
+"""
+overlay.py
+Stamps each recipient's address onto a letter body converted only once
+How it works:
+The letter for each type of request is converted to a PDF once per run,
+with its address block left empty. Each letter is then made by copying
+that PDF and adding a second content stream to its first page, which
+writes the occupier and address lines in Helvetica Bold where the address
+block is. Helvetica is one of the fonts every PDF reader has, so nothing
+needs embedding and the per-letter cost is a few small writes instead of
+a full wkhtmltopdf render
+"""
+import io
+import html
+import time
+import converter
+
+# Points per millimetre
+MM = 72 / 25.4
+# The height of an A4 page in points
+PAGE_HEIGHT = 842
+FONT_SIZE = 13.5
+LEADING = 16.2
+
+
+class Stamp(converter.Document):
+    """
+    Represents a letter held as the lines to stamp onto the letter body
+    """
+    def __init__(self, lines: list, key: str, body: 'Overlay'):
+        """
+        Args:
+            lines (list): The occupier and address lines
+            key (str): Identifies the letter, like its case reference
+            body (Overlay): The letter body to stamp the lines onto
+        """
+        super().__init__(None, key)
+        self.lines = lines
+        self.body = body
+
+
+def address_lines(occup: str, addr: str) -> list:
+    """
+    Args:
+        occup (str): The occupier of the property
+        addr (str): The address, with <br> between its lines
+    Returns:
+        (list): The lines to stamp, as plain text
+    """
+    lines = [occup] + addr.split('<br>')
+    return [html.unescape(line).strip() for line in lines if line.strip()]
+
+
+def pdf_string(text: str) -> bytes:
+    """
+    Args:
+        text (str): A line of text
+    Returns:
+        (bytes): The line as a PDF literal string
+    """
+    data = text.encode('cp1252', errors='replace')
+    for char in [b'\\', b'(', b')']:
+        data = data.replace(char, b'\\' + char)
+    return b'(' + data + b')'
+
+
+class Overlay():
+    """
+    Represents a letter body PDF that addresses are stamped onto
+    """
+    def __init__(self, base: bytes, left: float, top: float):
+        """
+        Args:
+            base (bytes): The letter body PDF, with an empty address block
+            left (float): The millimetres from the left edge of the page to
+            the address block
+            top (float): The millimetres from the top edge of the page to
+            the first line of the address block
+        """
+        self.base = base
+        self.left = left * MM
+        self.top = PAGE_HEIGHT - top * MM - FONT_SIZE
+        self.stamps = 0
+        self.seconds = 0.0
+
+    def __str__(self) -> str:
+        rate = self.stamps / self.seconds if self.seconds else 0.0
+        return f'Stamped {self.stamps} addresses in {self.seconds:.3f}s ' \
+            f'({rate:.0f} letters/s)'
+
+    def content(self, lines: list) -> bytes:
+        """
+        Args:
+            lines (list): The lines to stamp
+        Returns:
+            (bytes): The content stream that draws the lines
+        """
+        # Each ' moves down a line before drawing, so start one line higher
+        ops = [b'BT', f'/FAddr {FONT_SIZE} Tf'.encode(),
+               f'{LEADING} TL'.encode(),
+               f'{self.left:.2f} {self.top + LEADING:.2f} Td'.encode()]
+        for line in lines:
+            ops.append(pdf_string(line) + b" '")
+        ops.append(b'ET')
+        return b'\n'.join(ops)
+
+    def stamp(self, lines: list, pdf: str):
+        """
+        Writes a copy of the letter body with the lines stamped on it
+        Args:
+            lines (list): The lines to stamp
+            pdf (str): The path to write the letter to
+        """
+        # Only stamping needs PyPDF2, so the rest of gen_html.py runs
+        # without it
+        from PyPDF2 import PdfFileReader, PdfFileWriter
+        from PyPDF2.generic import (
+            ArrayObject, DecodedStreamObject, DictionaryObject, NameObject)
+        reader = PdfFileReader(io.BytesIO(self.base))
+        writer = PdfFileWriter()
+        page = reader.getPage(0)
+        font = DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica-Bold'),
+            NameObject('/Encoding'): NameObject('/WinAnsiEncoding')})
+        if '/Resources' not in page:
+            page[NameObject('/Resources')] = DictionaryObject()
+        resources = page['/Resources'].getObject()
+        if '/Font' not in resources:
+            resources[NameObject('/Font')] = DictionaryObject()
+        resources['/Font'].getObject()[NameObject('/FAddr')] = \
+            writer._addObject(font)
+        stream = DecodedStreamObject()
+        stream.setData(self.content(lines))
+        contents = page.get('/Contents')
+        if contents is None:
+            contents = ArrayObject()
+        elif not isinstance(contents.getObject(), ArrayObject):
+            contents = ArrayObject([contents])
+        else:
+            contents = contents.getObject()
+        contents.append(writer._addObject(stream))
+        page[NameObject('/Contents')] = contents
+        for number in range(reader.getNumPages()):
+            writer.addPage(reader.getPage(number))
+        with open(pdf, 'wb') as pdf_f:
+            writer.write(pdf_f)
+
+
+def convert_stream(jobs):
+    """
+    Stamps each letter as its job arrives. Stamping is quick and holds the
+    interpreter, so the letters are stamped one at a time
+    Args:
+        jobs (iterable): (Stamp, pdf) tuples
+    Yields:
+        (ConversionResult): The outcome of each job, in order
+    """
+    for stamp, pdf in jobs:
+        start = time.perf_counter()
+        try:
+            stamp.body.stamp(stamp.lines, pdf)
+            error = None
+        except (IOError, ValueError) as stamp_error:
+            error = str(stamp_error)
+        seconds = time.perf_counter() - start
+        stamp.body.stamps += 1
+        stamp.body.seconds += seconds
+        yield converter.ConversionResult(
+            stamp, pdf, 0, seconds=seconds, error=error)
+
+
+def convert_all(jobs: list) -> list:
+    """
+    Args:
+        jobs (list): (Stamp, pdf) tuples
+    Returns:
+        (list): A ConversionResult for each job, in the same order as jobs
+    """
+    return list(convert_stream(jobs))
@@ -0,0 +1,152 @@
+"""
+pdf_cache.py
+On-disk PDF cache shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+Each PDF wkhtmltopdf produces is copied into a cache directory under a
+hash of the HTML it was converted from and the flags it was converted
+with. Converting the same HTML with the same flags again copies the cached
+PDF out instead of running wkhtmltopdf. Once the cache is bigger than its
+budget, the least recently used PDFs are removed
+"""
+import os
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class PdfCache():
+    """
+    Represents a directory of PDFs named by the hash of their source
+    """
+    def __init__(self, directory: str, max_bytes: int, salt: str = ''):
+        """
+        Args:
+            directory (str): The directory to keep the cached PDFs in
+            max_bytes (int): The most space the cached PDFs can take up
+            salt (str): Anything else the PDFs depend on that isn't in the
+            HTML, like the contents of a linked stylesheet
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.lock = threading.Lock()
+        # Keys to sizes, least recently used first
+        self.entries = OrderedDict()
+        cached = []
+        for name in os.listdir(directory):
+            if name.endswith('.pdf'):
+                stat = os.stat(os.path.join(directory, name))
+                cached.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(cached):
+            self.entries[key] = size
+            self.size += size
+
+    def __str__(self) -> str:
+        return f'PDF cache: {self.hits} hits, {self.misses} misses, ' \
+            f'{self.evictions} evicted, {len(self.entries)} PDFs using ' \
+            f'{self.size / 2 ** 20:.1f}/{self.max_bytes / 2 ** 20:.1f} MB'
+
+    def path(self, key: str) -> str:
+        """
+        Args:
+            key (str): The key of a cached PDF
+        Returns:
+            (str): The path the PDF is cached at
+        """
+        return os.path.join(self.directory, f'{key}.pdf')
+
+    def key(self, sources: list, flags: list) -> str:
+        """
+        Hashes everything a conversion's output depends on
+        Args:
+            sources (list): The bytes of each HTML file being converted
+            flags (list): The command line flags passed to wkhtmltopdf
+        Returns:
+            (str): The key of the conversion's PDF
+        """
+        digest = hashlib.sha256(self.salt.encode())
+        for flag in flags:
+            digest.update(b'\0' + flag.encode())
+        for source in sources:
+            digest.update(b'\0' + str(len(source)).encode() + b'\0' + source)
+        return digest.hexdigest()
+
+    def fetch(self, key: str, pdf: str) -> bool:
+        """
+        Copies a cached PDF to where a conversion would have written it
+        Args:
+            key (str): The key of the conversion
+            pdf (str): The path to write the PDF to
+        Returns:
+            (bool): True if the PDF was in the cache
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False
+            self.entries.move_to_end(key)
+        try:
+            shutil.copyfile(self.path(key), pdf)
+            # Keeps the order of use for the next run
+            os.utime(self.path(key))
+        # Another run sharing the directory evicted it in the meantime
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+                if key in self.entries:
+                    self.size -= self.entries.pop(key)
+            return False
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, pdf: str):
+        """
+        Adds a newly converted PDF to the cache, evicting the least recently
+        used PDFs if that takes the cache over its budget
+        Args:
+            key (str): The key of the conversion
+            pdf (str): The path of the PDF that was written
+        """
+        size = os.path.getsize(pdf)
+        if size > self.max_bytes:
+            return
+        # Copied under a temporary name so a half written PDF is never used
+        partial = f'{self.path(key)}.{threading.get_ident()}.part'
+        shutil.copyfile(pdf, partial)
+        os.replace(partial, self.path(key))
+        with self.lock:
+            self.size += size - self.entries.get(key, 0)
+            self.entries[key] = size
+            self.entries.move_to_end(key)
+            while self.size > self.max_bytes:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self.path(old_key))
+                except FileNotFoundError:
+                    pass
+
+
+def from_config(config: dict, salt: str = ''):
+    """
+    Opens the PDF cache if one is configured
+    Args:
+        config (dict): The settings from .config or .config_chngs
+        salt (str): Anything else the PDFs depend on that isn't in the HTML
+    Returns:
+        (PdfCache): The cache, or None if pdf_cache_mb isn't set
+    """
+    if not config.get('pdf_cache_mb'):
+        return None
+    return PdfCache(
+        config.get('pdf_cache_dir', '.\\pdf_cache'),
+        int(config['pdf_cache_mb'] * 2 ** 20),
+        salt)
@@ -0,0 +1,224 @@
+"""
+pdf_merge.py
+Joins the change of rounds letter PDFs into the files sent to the print room
+How it works:
+The PDFs are appended in order to a PdfFileMerger for the shard being
+built. Once the next PDF would take the shard past its page limit, or is
+for a different postcode sector, the shard is written out and closed before
+the next one is started, so only one shard's pages and files are open at
+once. Without shards every letter goes into the one output file, whose
+pages and files are all held open until it is written, so memory use is
+only bounded when shard_pages or shard_by_sector is set. Each shard is
+written under a temporary name first, so nothing picking the files up sees
+half a shard. wkhtmltopdf embeds its own copy of the fonts and images each
+letter uses, so before a shard is written the resources of its pages can
+be hashed and every reference to an identical object pointed at the first
+copy, which then is the only one written
+"""
+import os
+import re
+import ntpath
+import hashlib
+from PyPDF2 import PdfFileMerger, PdfFileReader
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, StreamObject)
+
+# The outward code and the sector digit of a UK postcode, like YO7 3AB
+POSTCODE = re.compile(r'\b([A-Z]{1,2}[0-9][A-Z0-9]?) ?([0-9])[A-Z]{2}\b')
+
+
+def postcode_sector(path: str) -> str:
+    """
+    Args:
+        path (str): The path of a letter's PDF, named after its address
+    Returns:
+        (str): The postcode sector of the address, like YO7-3, or an empty
+        string if there is no postcode in the name
+    """
+    matches = POSTCODE.findall(ntpath.basename(path).upper())
+    if not matches:
+        return ''
+    outward, sector = matches[-1]
+    return f'{outward}-{sector}'
+
+
+class Resources():
+    """
+    Represents the distinct resource objects seen across a shard's pages
+    """
+    def __init__(self):
+        # Digests of the objects hashed so far, by reader and object number
+        self.digests = {}
+        # The first reference seen to each distinct object, by digest
+        self.first = {}
+        # The copies that are no longer referred to, by reader and number
+        self.dropped = set()
+
+    def digest(self, obj, seen: frozenset = frozenset()) -> bytes:
+        """
+        Hashes an object by its contents, following any references in it
+        Args:
+            obj (PdfObject): The object to hash
+            seen (frozenset): The references being hashed further up, so a
+            reference back to one of them isn't followed again
+        Returns:
+            (bytes): The digest of the object
+        """
+        if isinstance(obj, IndirectObject):
+            ref = (id(obj.pdf), obj.idnum, obj.generation)
+            if ref in self.digests:
+                return self.digests[ref]
+            if ref in seen:
+                return repr(ref).encode()
+            digest = self.digest(obj.getObject(), seen | {ref})
+            self.digests[ref] = digest
+            return digest
+        sha = hashlib.sha256(type(obj).__name__.encode())
+        if isinstance(obj, DictionaryObject):
+            for key in sorted(obj):
+                # The page tree is never part of a resource's contents
+                if key not in ('/Parent', '/Length'):
+                    sha.update(key.encode())
+                    sha.update(self.digest(obj[key], seen))
+            if isinstance(obj, StreamObject):
+                sha.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            for item in obj:
+                sha.update(self.digest(item, seen))
+        else:
+            sha.update(repr(obj).encode())
+        return sha.digest()
+
+    def share(self, obj, keys: list = None):
+        """
+        Points each reference inside obj at the first copy of the object it
+        refers to, and does the same inside the first copies
+        Args:
+            obj (PdfObject): A page's resource dictionary or part of one
+            keys (list): Only look under these keys of obj, if given
+        """
+        if isinstance(obj, DictionaryObject):
+            items = [(key, value) for key, value in obj.items()
+                     if keys is None or key in keys]
+        elif isinstance(obj, ArrayObject):
+            items = list(enumerate(obj))
+        else:
+            return
+        for key, value in items:
+            if not isinstance(value, IndirectObject):
+                self.share(value)
+                continue
+            digest = self.digest(value)
+            first = self.first.get(digest)
+            if first is None:
+                self.first[digest] = value
+                self.share(value.getObject())
+            elif (first.pdf, first.idnum) != (value.pdf, value.idnum):
+                obj[key] = first
+                self.dropped.add((id(value.pdf), value.idnum))
+
+
+class Shard():
+    """
+    Represents one output file while its PDFs are being appended
+    """
+    def __init__(self, path: str, sector: str = '', dedupe: bool = False):
+        """
+        Args:
+            path (str): The path to write the shard to
+            sector (str): The postcode sector of the shard's letters, if
+            sharding by sector
+            dedupe (bool): Whether to write identical resources only once
+        """
+        self.path = path
+        self.sector = sector
+        self.dedupe = dedupe
+        self.merger = PdfFileMerger()
+        self.files = []
+        self.count = 0
+        self.pages = 0
+        self.size = 0
+        self.input_size = 0
+        self.shared = 0
+
+    def append(self, pdf_f, reader: PdfFileReader):
+        """
+        Args:
+            pdf_f (file): The open PDF, closed when the shard is written
+            reader (PdfFileReader): The reader over pdf_f
+        """
+        self.merger.append(reader)
+        self.files.append(pdf_f)
+        self.input_size += os.fstat(pdf_f.fileno()).st_size
+        self.count += 1
+        self.pages += reader.getNumPages()
+
+    def write(self):
+        """
+        Writes the shard to its path and closes its PDFs
+        """
+        if self.dedupe:
+            resources = Resources()
+            for page in self.merger.pages:
+                resources.share(page.pagedata, ['/Resources'])
+            self.shared = len(resources.dropped)
+        with open(f'{self.path}.tmp', 'wb') as out_f:
+            self.merger.write(out_f)
+        os.replace(f'{self.path}.tmp', self.path)
+        self.merger.close()
+        for pdf_f in self.files:
+            pdf_f.close()
+        self.files = []
+        self.size = os.path.getsize(self.path)
+
+
+def merge(
+        pdfs: list,
+        out_path: str,
+        shard_pages: int = None,
+        by_sector: bool = False,
+        dedupe: bool = False):
+    """
+    Merges the PDFs in order, into one file or into shards
+    Args:
+        pdfs (list): The paths of the PDFs to merge, in the order to merge
+        them. When sharding by sector, PDFs in the same sector must be next
+        to each other
+        out_path (str): The path of the output without the .pdf extension.
+        Shards add their sector and number to it
+        shard_pages (int): The most pages a shard can have, unless one PDF
+        has more on its own. Off unless set
+        by_sector (bool): Whether to start a new shard for each postcode
+        sector
+        dedupe (bool): Whether to write resources that are identical across
+        the PDFs, like embedded fonts, only once in each shard
+    Yields:
+        (Shard): Each shard once it has been written
+    """
+    sharded = bool(shard_pages) or by_sector
+    shard = None
+    number = 0
+    for pdf in pdfs:
+        pdf_f = open(pdf, 'rb')
+        reader = PdfFileReader(pdf_f)
+        sector = postcode_sector(pdf) if by_sector else ''
+        if shard and (
+                sector != shard.sector or (
+                    shard_pages and
+                    shard.pages + reader.getNumPages() > shard_pages)):
+            shard.write()
+            yield shard
+            shard = None
+        if not shard:
+            number += 1
+            if not sharded:
+                path = f'{out_path}.pdf'
+            elif sector:
+                path = f'{out_path}-{sector}-{number:03}.pdf'
+            else:
+                path = f'{out_path}-{number:03}.pdf'
+            shard = Shard(path, sector, dedupe)
+        shard.append(pdf_f, reader)
+    if shard:
+        shard.write()
+        yield shard
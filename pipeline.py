@@ -0,0 +1,162 @@
+"""
+pipeline.py
+Streaming helpers shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+Rows are read from the database a batch at a time and passed through a
+chain of stages, each running in its own thread and connected to the next
+by a bounded queue, so only a fixed number of letters are held in memory
+at once no matter how many the query returns. Several queries can be read
+at the same time and their rows passed on as they arrive
+"""
+import queue
+import threading
+
+# The number of rows to read from a cursor at a time
+FETCH_SIZE = 500
+# The number of items each queue between stages can hold
+QUEUE_SIZE = 100
+
+_DONE = object()
+
+
+class _Failure():
+    """
+    Carries an exception raised in a stage thread back to the consumer
+    """
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def fetch_batches(cursor, fetch_size: int = FETCH_SIZE):
+    """
+    Reads the results of an executed query a batch at a time
+    Args:
+        cursor (pyodbc.Cursor): The cursor the query was executed on
+        fetch_size (int): The number of rows to read at a time
+    Yields:
+        (list): Each batch of rows of the results
+    """
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def fetch_rows(cursor, fetch_size: int = FETCH_SIZE):
+    """
+    Reads the results of an executed query a batch at a time
+    Args:
+        cursor (pyodbc.Cursor): The cursor the query was executed on
+        fetch_size (int): The number of rows to read at a time
+    Yields:
+        (pyodbc.Row): Each row of the results
+    """
+    for rows in fetch_batches(cursor, fetch_size):
+        yield from rows
+
+
+def batched(items, size: int):
+    """
+    Groups an iterable into lists without reading it all into memory
+    Args:
+        items (iterable): The items to group
+        size (int): The maximum length of each group
+    Yields:
+        (list): Each group of items, in order
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def merge(sources: list, queue_size: int = QUEUE_SIZE):
+    """
+    Reads several iterables at the same time, each in its own thread, and
+    passes their items on as soon as they arrive
+    Args:
+        sources (list): The iterables to read, such as query generators
+        queue_size (int): The number of items that can be waiting before
+        the sources have to wait
+    Yields:
+        The items of every source. Each source's items stay in order, but
+        items from different sources are interleaved
+    """
+    merged = queue.Queue(queue_size)
+
+    def feed(source):
+        try:
+            for item in source:
+                merged.put(item)
+            merged.put(_DONE)
+        except BaseException as error:
+            merged.put(_Failure(error))
+
+    for source in sources:
+        threading.Thread(target=feed, args=(source,), daemon=True).start()
+    running = len(sources)
+    while running:
+        item = merged.get()
+        if item is _DONE:
+            running -= 1
+        elif isinstance(item, _Failure):
+            raise item.error
+        else:
+            yield item
+
+
+def stream(source, stages: list, queue_size: int = QUEUE_SIZE):
+    """
+    Passes every item from source through each stage in turn, running each
+    stage in its own thread
+    Args:
+        source (iterable): The items to process, read in a thread of its own
+        stages (list): The functions to apply to each item, in order
+        queue_size (int): The number of items each queue can hold before the
+        stage feeding it waits
+    Yields:
+        The output of the last stage for each item, in source order
+    """
+    queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+
+    def feed():
+        try:
+            for item in source:
+                queues[0].put(item)
+            queues[0].put(_DONE)
+        # log_error() exits with SystemExit, which has to reach the consumer
+        except BaseException as error:
+            queues[0].put(_Failure(error))
+
+    def work(stage, in_queue: queue.Queue, out_queue: queue.Queue):
+        while True:
+            item = in_queue.get()
+            if item is _DONE or isinstance(item, _Failure):
+                out_queue.put(item)
+                return
+            try:
+                out_queue.put(stage(item))
+            except BaseException as error:
+                out_queue.put(_Failure(error))
+                return
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(
+            target=work,
+            args=(stage, queues[i], queues[i + 1]),
+            daemon=True))
+    for thread in threads:
+        thread.start()
+    while True:
+        item = queues[-1].get()
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
@@ -11,4 +11,5 @@ JOIN wasscollections.dbo.MV_HDC_LLPG_ADDRESSES_CURRENT l
 	ON m.UPRN = l.UPRN
   	WHERE m.id NOT IN (12, 13, 17)
   	AND RecSacksRequested = 'yes' and m.RECYSacksLetterSent = 0
-  	AND AddedDateTime < @rec_cutoff
\ No newline at end of file
+  	AND AddedDateTime < @rec_cutoff
+ORDER BY case_ref
\ No newline at end of file
@@ -1,7 +1,5 @@
 --RECYCLING
-DECLARE @rec_cutoff datetime = '2018-06-07 12:00:00.00';
 UPDATE HDC_AF_GW_Missed_Collections.dbo.Missed_Collections
-SET RECYSacksLetterSent = 1 
-WHERE HDC_AF_GW_Missed_Collections.dbo.Missed_Collections.id NOT IN (12, 13, 17)
-AND RecSacksRequested = 'yes' and RECYSacksLetterSent = 0
-AND AddedDateTime < @rec_cutoff
\ No newline at end of file
+SET RECYSacksLetterSent = 1
+WHERE case_ref = ?
+AND RecSacksRequested = 'yes' AND RECYSacksLetterSent = 0
\ No newline at end of file
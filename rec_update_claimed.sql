@@ -0,0 +1,8 @@
+--RECYCLING
+UPDATE HDC_AF_GW_Missed_Collections.dbo.Missed_Collections
+SET RECYSacksLetterSent = 1
+OUTPUT inserted.case_ref
+WHERE ClaimedBy = ?
+AND ClaimExpires > GETDATE()
+AND case_ref IN (<case_refs>)
+AND RecSacksRequested = 'yes' AND RECYSacksLetterSent = 0
\ No newline at end of file
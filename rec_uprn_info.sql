@@ -0,0 +1,12 @@
+--RECYCLING
+DECLARE @rec_cutoff datetime = '2018-06-07 12:00:00.00';
+SELECT 
+	'The Occupier' AS occupier,
+	m.UPRN AS uprn,
+	case_ref,
+	RecSacksRequested AS rec_sacks_requested
+FROM HDC_AF_GW_Missed_Collections.dbo.Missed_Collections m
+  	WHERE m.id NOT IN (12, 13, 17)
+  	AND RecSacksRequested = 'yes' and m.RECYSacksLetterSent = 0
+  	AND AddedDateTime < @rec_cutoff
+ORDER BY case_ref
\ No newline at end of file
@@ -0,0 +1,27 @@
+SELECT
+      pvt.UPRN AS uprn,
+      ISNULL([REF], 0) AS days_ref,
+      ISNULL([RECY], 0) AS days_recy,
+      ISNULL([MIX], 0) AS days_mix,
+      ISNULL([GLASS], 0) AS days_glass,
+      ISNULL([GW], 0) AS days_gw
+FROM (
+      SELECT
+            UPRN,
+            psr.ServiceID,
+            MIN(r.ScheduleDayID) AS ScheduleDayID
+      FROM <rounds_table> psr
+            LEFT JOIN (
+            SELECT *
+            FROM dbo.Rounds
+            WHERE roundera = 2
+      ) r
+            ON psr.RoundID = r.RoundID AND psr.ServiceID = r.ServiceID
+      WHERE psr.RoundEra = 2
+      GROUP BY UPRN, psr.ServiceID
+) a
+PIVOT (
+      MIN(ScheduleDayID)
+      FOR serviceid
+      IN ([REF], [RECY], [MIX], [GLASS], [GW])
+) pvt
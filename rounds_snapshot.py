@@ -0,0 +1,133 @@
+"""
+rounds_snapshot.py
+A local copy of the schedule days in a PropertyServiceRounds_I_* table
+How it works:
+The snapshot tables never change once they are made, so the schedule days
+of every property in the newest one are read once, packed into two arrays
+sorted by UPRN and saved to a file. Later runs against the same table load
+the arrays back in one read and look properties up by binary search, so
+finding the changed properties only needs the live schedule days from the
+server. A change is found the same way changes_info.sql finds one
+"""
+import os
+import array
+import bisect
+
+# The services in the order their schedule days are stored
+SERVICES = ['REF', 'RECY', 'MIX', 'GLASS', 'GW']
+MAGIC = b'ROUNDS1\n'
+
+
+class Snapshot():
+    """
+    Represents the schedule days of every property in one rounds table
+    """
+    def __init__(self, table: str, uprns: array.array, days: array.array):
+        """
+        Args:
+            table (str): The name of the rounds table
+            uprns (array.array): The UPRNs, sorted
+            days (array.array): The schedule day of each service of each
+            UPRN in turn, 0 if the property doesn't have the service
+        """
+        self.table = table
+        self.uprns = uprns
+        self.days = days
+
+    def __len__(self) -> int:
+        return len(self.uprns)
+
+    def __str__(self) -> str:
+        return f'Rounds snapshot of {self.table}: {len(self)} properties'
+
+    @classmethod
+    def from_rows(cls, table: str, rows) -> 'Snapshot':
+        """
+        Args:
+            table (str): The name of the rounds table
+            rows (iterable): The (uprn, days) tuples of the table
+        Returns:
+            (Snapshot): The snapshot of the rows
+        """
+        uprns = array.array('q')
+        days = array.array('H')
+        for uprn, schedule in sorted(rows, key=lambda row: int(row[0])):
+            uprns.append(int(uprn))
+            days.extend(schedule)
+        return cls(table, uprns, days)
+
+    @classmethod
+    def load(cls, path: str, table: str):
+        """
+        Args:
+            path (str): The path of the snapshot file
+            table (str): The rounds table the snapshot has to be of
+        Returns:
+            (Snapshot): The saved snapshot, or None if there isn't one of
+            table
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as snapshot_f:
+            if snapshot_f.readline() != MAGIC:
+                return None
+            if snapshot_f.readline().decode().strip() != table:
+                return None
+            uprns = array.array('q')
+            days = array.array('H')
+            try:
+                count = int(snapshot_f.readline())
+                uprns.fromfile(snapshot_f, count)
+                days.fromfile(snapshot_f, count * len(SERVICES))
+            # A file cut short by an interrupted save is built again. One
+            # cut partway through a line or a value raises ValueError
+            except (EOFError, ValueError):
+                return None
+        return cls(table, uprns, days)
+
+    def save(self, path: str):
+        """
+        Writes the snapshot under a temporary name first, so a run that
+        dies while saving leaves the previous file as it was
+        Args:
+            path (str): The path of the snapshot file
+        """
+        with open(f'{path}.tmp', 'wb') as snapshot_f:
+            snapshot_f.write(MAGIC)
+            snapshot_f.write(f'{self.table}\n{len(self)}\n'.encode())
+            self.uprns.tofile(snapshot_f)
+            self.days.tofile(snapshot_f)
+        os.replace(f'{path}.tmp', path)
+
+    def get(self, uprn) -> tuple:
+        """
+        Args:
+            uprn: The UPRN of a property
+        Returns:
+            (tuple): The schedule days of the property, or None if it isn't
+            in the snapshot
+        """
+        uprn = int(uprn)
+        index = bisect.bisect_left(self.uprns, uprn)
+        if index == len(self.uprns) or self.uprns[index] != uprn:
+            return None
+        start = index * len(SERVICES)
+        return tuple(self.days[start:start + len(SERVICES)])
+
+    def changed(self, uprn, new: tuple) -> bool:
+        """
+        Args:
+            uprn: The UPRN of a property
+            new (tuple): The property's live schedule days
+        Returns:
+            (bool): True if the property is getting a change of rounds. As
+            in changes_info.sql, properties missing from the snapshot aren't,
+            and garden waste only counts if the property had it before
+        """
+        old = self.get(uprn)
+        if old is None:
+            return False
+        *old_days, old_gw = old
+        *new_days, new_gw = new
+        return tuple(old_days) != tuple(new_days) or (
+            old_gw != new_gw and old_gw != 0)
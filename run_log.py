@@ -0,0 +1,70 @@
+"""
+run_log.py
+Buffered run log used by gen_html.py
+How it works:
+Each event is kept in memory as a JSON object with the time it happened,
+the stage of the run it came from and a message. The events are appended
+to the log file in batches, so writing a letter doesn't open the log file
+each time, and whatever is left is written when the run ends, including
+when log_error() exits early
+"""
+import json
+import atexit
+import datetime
+import threading
+
+# The number of events held in memory before they are written out
+BUFFER_SIZE = 200
+
+
+class RunLog():
+    """
+    Represents the log file of a run and the events not yet written to it
+    """
+    def __init__(self, path: str, buffer_size: int = BUFFER_SIZE):
+        """
+        Args:
+            path (str): The path of the log file to append to
+            buffer_size (int): The number of events to hold before writing
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.events = []
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def event(self, stage: str, message: str, **fields):
+        """
+        Records something that happened during the run
+        Args:
+            stage (str): The part of the run the event came from, like
+            save or convert
+            message (str): A description of the event
+            fields: Anything else to record with the event, like the case
+            reference of the letter
+        """
+        entry = {
+            'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'stage': stage,
+            'message': message}
+        entry.update(fields)
+        with self.lock:
+            self.events.append(entry)
+            if len(self.events) < self.buffer_size:
+                return
+            events, self.events = self.events, []
+            self._write(events)
+
+    def flush(self):
+        """
+        Writes any events still held in memory
+        """
+        with self.lock:
+            events, self.events = self.events, []
+            self._write(events)
+
+    def _write(self, events: list):
+        if not events:
+            return
+        with open(self.path, 'a') as log:
+            log.write(''.join(f'{json.dumps(entry)}\n' for entry in events))
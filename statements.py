@@ -0,0 +1,198 @@
+"""
+statements.py
+SQL statement registry shared by gen_html.py and new_rounds_gen_html.py
+How it works:
+Every .sql file a script needs is read and checked once at startup, from
+the directory this file is in rather than the working directory. Each
+statement is then always executed on the same cursor of a connection, so
+pyodbc prepares it the first time and reuses the prepared statement after
+that. The registry counts how many times each statement ran and how long
+executing it took
+"""
+import os
+import time
+import threading
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class Statement():
+    """
+    Represents one .sql file and how it is run
+    """
+    def __init__(self, file_name: str, params: int = 0, markers: tuple = ()):
+        """
+        Args:
+            file_name (str): The name of the .sql file
+            params (int): The number of ? parameters the statement takes
+            markers (tuple): The <marker> text the script replaces before
+            running the statement
+        """
+        self.file_name = file_name
+        self.params = params
+        self.markers = markers
+        self.sql = None
+        self.executions = 0
+        self.seconds = 0.0
+
+    def load(self, directory: str) -> list:
+        """
+        Reads the statement and checks it matches how it is run
+        Args:
+            directory (str): The directory the .sql file is in
+        Returns:
+            (list): A message for each problem found, empty if none
+        """
+        path = os.path.join(directory, self.file_name)
+        try:
+            with open(path, 'r') as sql_f:
+                self.sql = sql_f.read()
+        except (IOError, FileNotFoundError) as error:
+            return [f'{self.file_name}: {error}']
+        problems = []
+        if not self.sql.strip():
+            problems.append(f'{self.file_name}: is empty')
+        if self.sql.count('?') != self.params:
+            problems.append(
+                f'{self.file_name}: expected {self.params} parameters, '
+                f'found {self.sql.count("?")}')
+        for marker in self.markers:
+            if marker not in self.sql:
+                problems.append(f'{self.file_name}: missing {marker}')
+        return problems
+
+    def text(self, **markers) -> str:
+        """
+        Args:
+            markers: The text to put in place of each <marker>
+        Returns:
+            (str): The SQL to execute
+        """
+        sql = self.sql
+        for marker, value in markers.items():
+            sql = sql.replace(f'<{marker}>', value)
+        return sql
+
+
+# Every statement either script runs
+STATEMENTS = {
+    'gw_address_info': Statement('gw_address_info.sql'),
+    'rec_address_info': Statement('rec_address_info.sql'),
+    'gw_uprn_info': Statement('gw_uprn_info.sql'),
+    'rec_uprn_info': Statement('rec_uprn_info.sql'),
+    'gw_address_new': Statement('gw_address_new.sql', params=2),
+    'rec_address_new': Statement('rec_address_new.sql', params=2),
+    'missed_claim': Statement('missed_claim.sql', params=3),
+    'missed_renew': Statement('missed_renew.sql', params=2),
+    'gw_address_claimed': Statement('gw_address_claimed.sql', params=1),
+    'rec_address_claimed': Statement('rec_address_claimed.sql', params=1),
+    'gw_update': Statement('gw_update.sql', params=1),
+    'rec_update': Statement('rec_update.sql', params=1),
+    'gw_update_claimed': Statement(
+        'gw_update_claimed.sql', params=1, markers=('<case_refs>',)),
+    'rec_update_claimed': Statement(
+        'rec_update_claimed.sql', params=1, markers=('<case_refs>',)),
+    'changes_info': Statement(
+        'changes_info.sql', markers=('<newest_table>',)),
+    'changes_html_table': Statement('changes_html_table.sql', params=1),
+    'changes_calendar_bulk': Statement(
+        'changes_calendar_bulk.sql', markers=('<uprns>',)),
+    'rounds_days': Statement('rounds_days.sql', markers=('<rounds_table>',)),
+    'changes_addresses': Statement(
+        'changes_addresses.sql', markers=('<uprns>',)),
+    'llpg_checksums': Statement('llpg_checksums.sql'),
+    'llpg_addresses': Statement('llpg_addresses.sql', markers=('<uprns>',))}
+
+
+class Registry():
+    """
+    Represents the statements a script runs, loaded once at startup
+    """
+    def __init__(self, names: list, directory: str = DIRECTORY):
+        """
+        Args:
+            names (list): The names in STATEMENTS the script runs
+            directory (str): The directory the .sql files are in
+        Raises:
+            ValueError: If a statement is missing or doesn't match how it
+            is run
+        """
+        self.statements = {}
+        problems = []
+        for name in names:
+            spec = STATEMENTS[name]
+            statement = Statement(spec.file_name, spec.params, spec.markers)
+            problems += statement.load(directory)
+            self.statements[name] = statement
+        if problems:
+            raise ValueError('Invalid SQL statements: ' + '; '.join(problems))
+        self.cursors = {}
+        self.lock = threading.Lock()
+
+    def __str__(self) -> str:
+        lines = ['SQL statements:']
+        for name, statement in self.statements.items():
+            if statement.executions:
+                lines.append(
+                    f'  {name}: {statement.executions} executions in '
+                    f'{statement.seconds:.3f}s')
+        return '\n'.join(lines)
+
+    def cursor(self, conn, name: str):
+        """
+        Gets the cursor a statement always runs on for a connection, so
+        the statement stays prepared between executions
+        Args:
+            conn (pyodbc.Connection): The connection to run the statement on
+            name (str): The name of the statement
+        Returns:
+            (pyodbc.Cursor): The cursor for the statement
+        """
+        with self.lock:
+            key = (id(conn), name)
+            if key not in self.cursors:
+                self.cursors[key] = conn.cursor()
+            return self.cursors[key]
+
+    def _timed(self, name: str, run):
+        statement = self.statements[name]
+        start = time.perf_counter()
+        result = run(statement)
+        seconds = time.perf_counter() - start
+        with self.lock:
+            statement.executions += 1
+            statement.seconds += seconds
+        return result
+
+    def execute(self, conn, name: str, *params, prefix: str = '', **markers):
+        """
+        Runs a statement
+        Args:
+            conn (pyodbc.Connection): The connection to run the statement on
+            name (str): The name of the statement
+            params: The values of the statement's ? parameters
+            prefix (str): SQL to run before the statement, like SET NOCOUNT
+            markers: The text to put in place of each <marker>
+        Returns:
+            (pyodbc.Cursor): The cursor with the statement's results
+        """
+        cursor = self.cursor(conn, name)
+        return self._timed(name, lambda statement: cursor.execute(
+            prefix + statement.text(**markers), *params))
+
+    def executemany(self, conn, name: str, params: list):
+        """
+        Runs a statement once for each set of parameters, sending them to
+        the server as a batch
+        Args:
+            conn (pyodbc.Connection): The connection to run the statement on
+            name (str): The name of the statement
+            params (list): A tuple of parameter values for each execution
+        Returns:
+            (pyodbc.Cursor): The cursor the statement ran on
+        """
+        cursor = self.cursor(conn, name)
+        cursor.fast_executemany = True
+        self._timed(name, lambda statement: cursor.executemany(
+            statement.text(), params))
+        return cursor
@@ -0,0 +1,71 @@
+"""
+capture_html_tables.py
+How to run:
+From the command line, run
+`py -3 -m tests.capture_html_tables <uprn> [<uprn> ...]`
+How it works:
+Saves the collection calendar rows of each property and the HTML table
+changes_html_table.sql returns for it to tests\\html_tables.json, for
+test_build_html_table to check build_html_table() against. Pick properties
+with different columns, empty weeks and garden collections
+"""
+import os
+import sys
+import json
+import pyodbc
+import statements
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'html_tables.json')
+COLUMNS = ['WeekCommencing', 'Refuse', 'Recycling', 'Mix', 'Glass', 'Garden']
+
+
+def encode(value):
+    """
+    Args:
+        value: The value of a column
+    Returns:
+        The value as JSON, with its type if JSON doesn't have one for it
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return {'type': type(value).__name__, 'value': str(value)}
+
+def capture(conn, sql: statements.Registry, uprn: str) -> dict:
+    """
+    Args:
+        conn (pyodbc.Connection): The connection to the SQL database
+        sql (statements.Registry): The changes_html_table and
+        changes_calendar_bulk statements
+        uprn (str): The UPRN of the property
+    Returns:
+        (dict): The property's calendar rows and HTML table
+    """
+    cursor = sql.execute(
+        conn, 'changes_calendar_bulk', uprn, prefix='SET NOCOUNT ON; ',
+        uprns='(?)')
+    rows = [{column: encode(getattr(row, column)) for column in COLUMNS}
+            for row in cursor.fetchall()]
+    cursor = sql.execute(
+        conn, 'changes_html_table', uprn, prefix='SET NOCOUNT ON; ')
+    return {'uprn': uprn, 'rows': rows, 'html': cursor.fetchone().html}
+
+if __name__ == '__main__':
+    with open('.\\.config_chngs', 'r') as config_f:
+        config = json.load(config_f)
+    SQL = statements.Registry(['changes_html_table', 'changes_calendar_bulk'])
+    CONN = pyodbc.connect(
+        driver=config['driver'],
+        server=config['server'],
+        database=config['database'],
+        uid=config['uid'],
+        pwd=config['pwd'])
+    fixtures = []
+    if os.path.exists(FIXTURES):
+        with open(FIXTURES, 'r') as fixtures_f:
+            fixtures = json.load(fixtures_f)
+    for uprn in sys.argv[1:]:
+        fixtures = [fixture for fixture in fixtures if fixture['uprn'] != uprn]
+        fixtures.append(capture(CONN, SQL, uprn))
+    with open(FIXTURES, 'w') as fixtures_f:
+        json.dump(fixtures, fixtures_f, indent=2)
+    print(f'Captured {len(sys.argv) - 1} tables to {FIXTURES}')
@@ -0,0 +1,109 @@
+"""
+test_address_index.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Checks that the local address index formats addresses the way the letter
+queries did, reads back what it saved and only fetches the addresses that
+are new or have changed
+"""
+import os
+import time
+import tempfile
+import unittest
+import address_index
+
+BLOCK = '1 High St\r\nThirsk\r\nNorth Yorkshire\r\nYO7 3AB'
+
+
+class Fetcher():
+    """
+    Stands in for the query that fetches addresses from the view
+    """
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, uprns: list) -> list:
+        self.batches.append(list(uprns))
+        return [(uprn, 1, f'{uprn} High St\r\nNorth Yorkshire\r\nYO7 3AB',
+                 f'{uprn} High St, YO7 3AB') for uprn in uprns]
+
+
+class TestAddressIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'llpg.addresses')
+        self.index = address_index.AddressIndex()
+        self.index.update([
+            ('100050000001', 11, BLOCK, '1 High St, Thirsk, YO7 3AB'),
+            (100050000002, -7, 'Caf\xe9 Row\r\nYO7 3AB', 'Caf\xe9 Row')])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_format_block(self):
+        self.assertEqual(address_index.format_block(BLOCK),
+                         '1 High St<br>Thirsk<br>YO7 3AB')
+
+    def test_get(self):
+        self.assertEqual(self.index.get('100050000001'), (
+            '1 High St<br>Thirsk<br>YO7 3AB', '1 High St, Thirsk, YO7 3AB'))
+        self.assertIsNone(self.index.get(100050000003))
+        self.assertEqual(self.index.lookups, 2)
+
+    def test_round_trip(self):
+        self.index.refreshed = 1000.5
+        self.index.save(self.path)
+        self.assertFalse(self.index.dirty)
+        loaded = address_index.AddressIndex.load(self.path)
+        self.assertEqual(loaded.addresses, self.index.addresses)
+        self.assertEqual(loaded.refreshed, 1000.5)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+    def test_missing_or_cut_short(self):
+        self.assertEqual(len(address_index.AddressIndex.load(self.path)), 0)
+        self.index.save(self.path)
+        with open(self.path, 'rb') as index_f:
+            saved = index_f.read()
+        # Wherever an interrupted save stopped, the index is built again
+        for size in range(len(saved)):
+            with self.subTest(size=size):
+                with open(self.path, 'wb') as index_f:
+                    index_f.write(saved[:size])
+                loaded = address_index.AddressIndex.load(self.path)
+                self.assertEqual(len(loaded), 0)
+
+    def test_refresh_fetches_new_and_changed(self):
+        fetch = Fetcher()
+        fetched = self.index.refresh(
+            [('100050000001', 11), ('100050000002', 8), ('100050000003', 3)],
+            fetch)
+        self.assertEqual(fetched, 2)
+        self.assertEqual(fetch.batches, [[100050000002, 100050000003]])
+        self.assertEqual(self.index.get(100050000003)[0],
+                         '100050000003 High St<br>YO7 3AB')
+        self.assertFalse(self.index.stale())
+
+    def test_refresh_drops_removed(self):
+        self.index.refresh([('100050000001', 11)], Fetcher())
+        self.assertEqual(list(self.index.addresses), [100050000001])
+
+    def test_resolve_fetches_missing(self):
+        fetch = Fetcher()
+        missing = self.index.resolve(
+            ['100050000001'] + [str(100050000010 + i) for i in range(5)],
+            fetch, batch_size=2)
+        self.assertEqual(missing, 5)
+        self.assertEqual([len(batch) for batch in fetch.batches], [2, 2, 1])
+        self.assertEqual(self.index.resolve(['100050000011'], fetch), 0)
+        self.assertTrue(self.index.dirty)
+
+    def test_stale(self):
+        self.assertTrue(self.index.stale())
+        self.index.refreshed = time.time() - 10
+        self.assertFalse(self.index.stale())
+        self.assertTrue(self.index.stale(max_age=5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+test_build_html_table.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Checks that build_html_table() makes the same HTML table as
+changes_html_table.sql for the calendar rows in html_tables.json, which
+capture_html_tables.py saves from the database. Tables worked out by hand
+would only check build_html_table() against itself, so the tests are
+skipped until tables have been captured
+"""
+import os
+import sys
+import json
+import decimal
+import datetime
+import unittest
+from types import SimpleNamespace
+
+try:
+    import pyodbc
+except ImportError:
+    # build_html_table() doesn't use the database
+    from benchmark import fake_pyodbc as pyodbc
+    sys.modules['pyodbc'] = pyodbc
+import new_rounds_gen_html
+from tests.capture_html_tables import FIXTURES
+
+TYPES = {
+    'date': datetime.date.fromisoformat,
+    'datetime': datetime.datetime.fromisoformat,
+    'Decimal': decimal.Decimal,
+    'int': int,
+}
+
+
+def decode(value):
+    """
+    Args:
+        value: The value of a column as capture_html_tables.py saved it
+    Returns:
+        The value of the column
+    """
+    if isinstance(value, dict):
+        return TYPES[value['type']](value['value'])
+    return value
+
+def load_fixtures() -> list:
+    """
+    Returns:
+        (list): The captured calendar rows and HTML table of each property
+    """
+    with open(FIXTURES, 'r') as fixtures_f:
+        fixtures = json.load(fixtures_f)
+    for fixture in fixtures:
+        fixture['rows'] = [
+            SimpleNamespace(**{column: decode(value)
+                               for column, value in row.items()})
+            for row in fixture['rows']]
+    return fixtures
+
+
+@unittest.skipUnless(
+    os.path.exists(FIXTURES),
+    'No tables captured yet, run `py -3 -m tests.capture_html_tables <uprn> '
+    '...` against the database first')
+class TestBuildHtmlTable(unittest.TestCase):
+    def test_matches_changes_html_table(self):
+        for fixture in load_fixtures():
+            with self.subTest(uprn=fixture['uprn']):
+                self.assertEqual(
+                    new_rounds_gen_html.build_html_table(fixture['rows']),
+                    fixture['html'])
+
+    def test_shapes_differ(self):
+        shapes = {new_rounds_gen_html.table_shape(fixture['rows'])
+                  for fixture in load_fixtures()}
+        self.assertEqual(len(shapes), len(load_fixtures()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+test_claim.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Leases missed collection requests in the benchmark's stand-in database
+and checks that a worker only marks, and counts as sent, the letters of
+requests that are still leased to it
+"""
+import sys
+import time
+import unittest
+from unittest import mock
+
+try:
+    import pyodbc
+except ImportError:
+    from benchmark import fake_pyodbc as pyodbc
+    sys.modules['pyodbc'] = pyodbc
+import gen_html
+import metrics
+import statements
+from benchmark import fake_pyodbc, synthetic
+
+
+class TestClaim(unittest.TestCase):
+    def setUp(self):
+        self.database = synthetic.Dataset(40)
+        self.state = fake_pyodbc.LocalState(self.database)
+        patches = {
+            'CONN': fake_pyodbc.Connection(self.database, self.state),
+            'SQL': statements.Registry([
+                'missed_renew', 'gw_update_claimed', 'rec_update_claimed']),
+            'METRICS': metrics.Metrics('gen_html')}
+        for name, value in patches.items():
+            patcher = mock.patch.object(gen_html, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def requests(self, cases: list) -> list:
+        """
+        Args:
+            cases (list): Missed collection reports in the stand-in database
+        Returns:
+            (list): A request for each letter the reports need
+        """
+        requests = []
+        for case in cases:
+            if case['gw_requested']:
+                requests.append(gen_html.GardenWasteRequest(
+                    'The Occupier', '', '', case['case_ref'], '1'))
+            if case['rec_requested']:
+                requests.append(gen_html.RecyclingRequest(
+                    'The Occupier', '', '', case['case_ref']))
+        return requests
+
+    def claimed(self, claim: str) -> list:
+        return [case for case in self.database.missed
+                if case.get('claim', (None,))[0] == claim]
+
+    def expire(self, case: dict):
+        case['claim'] = (case['claim'][0], time.time() - 1)
+
+    def sent(self, case: dict) -> bool:
+        return case['gw_sent'] or case['rec_sent']
+
+    def test_marks_requests_still_leased(self):
+        self.state.claim('worker-1', 10, 60)
+        self.state.claim('worker-2', 10, 60)
+        mine = self.claimed('worker-1')
+        # Both kinds of request are in the batch
+        self.assertEqual(
+            {case['gw_requested'] for case in mine}, {True, False})
+        flagged = gen_html.update_claimed(self.requests(mine), 'worker-1')
+        self.assertEqual({request.case_ref for request in flagged},
+                         {case['case_ref'] for case in mine})
+        self.assertTrue(all(self.sent(case) for case in mine))
+
+    def test_skips_requests_leased_to_another_worker(self):
+        self.state.claim('worker-1', 10, 60)
+        self.state.claim('worker-2', 10, 60)
+        theirs = self.claimed('worker-2')
+        flagged = gen_html.update_claimed(self.requests(theirs), 'worker-1')
+        self.assertEqual(flagged, [])
+        self.assertFalse(any(self.sent(case) for case in theirs))
+
+    def test_skips_expired_leases(self):
+        self.state.claim('worker-1', 10, 60)
+        mine = self.claimed('worker-1')
+        expired = mine[:4]
+        for case in expired:
+            self.expire(case)
+        flagged = gen_html.update_claimed(self.requests(mine), 'worker-1')
+        self.assertEqual({request.case_ref for request in flagged},
+                         {case['case_ref'] for case in mine[4:]})
+        self.assertFalse(any(self.sent(case) for case in expired))
+
+    def test_skips_letters_already_sent(self):
+        self.state.claim('worker-1', 10, 60)
+        requests = self.requests(self.claimed('worker-1'))
+        gen_html.update_claimed(requests, 'worker-1')
+        self.assertEqual(gen_html.update_claimed(requests, 'worker-1'), [])
+
+    def test_statements_check_the_lease(self):
+        for name in ['gw_update_claimed', 'rec_update_claimed']:
+            with self.subTest(name=name):
+                text = gen_html.SQL.statements[name].text(case_refs='?')
+                self.assertIn('WHERE ClaimedBy = ?', text)
+                self.assertIn('ClaimExpires > GETDATE()', text)
+
+    def test_renew_claim(self):
+        self.state.claim('worker-1', 10, 1)
+        self.assertTrue(gen_html.renew_claim('worker-1', 60))
+        self.assertTrue(all(case['claim'][1] > time.time() + 30
+                            for case in self.claimed('worker-1')))
+        for case in self.claimed('worker-1'):
+            self.expire(case)
+        self.assertFalse(gen_html.renew_claim('worker-1', 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+test_journal.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Checks that the checkpoint journal reads back what an interrupted run
+recorded, drops what it should and keeps every line whole when several
+threads record at once
+"""
+import os
+import json
+import tempfile
+import threading
+import unittest
+import journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.journal')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reached_counts_later_stages(self):
+        letters = journal.Journal(None)
+        letters.record('MC1', 'converted')
+        self.assertTrue(letters.reached('MC1', 'rendered'))
+        self.assertTrue(letters.reached('MC1', 'converted'))
+        self.assertFalse(letters.reached('MC1', 'published'))
+        self.assertFalse(letters.reached('MC2', 'queried'))
+
+    def test_never_goes_back_a_stage(self):
+        letters = journal.Journal(None)
+        letters.record('MC1', 'published')
+        letters.record('MC1', 'rendered')
+        self.assertTrue(letters.reached('MC1', 'published'))
+
+    def test_resumes_the_same_run(self):
+        letters = journal.Journal(self.path, 'run-1')
+        letters.record_many(['MC1', 100050000001], 'converted')
+        letters.close()
+        resumed = journal.Journal(self.path, 'run-1')
+        self.assertTrue(resumed.reached('MC1', 'converted'))
+        self.assertTrue(resumed.reached('100050000001', 'converted'))
+        resumed.close()
+
+    def test_discards_a_different_run(self):
+        letters = journal.Journal(self.path, 'run-1')
+        letters.record('MC1', 'converted')
+        letters.close()
+        other = journal.Journal(self.path, 'run-2')
+        self.assertFalse(other.reached('MC1', 'queried'))
+        other.close()
+
+    def test_skips_a_line_cut_short(self):
+        letters = journal.Journal(self.path, 'run-1')
+        letters.record('MC1', 'converted')
+        letters.close()
+        with open(self.path, 'a') as journal_f:
+            journal_f.write('{"key": "MC2", "sta')
+        resumed = journal.Journal(self.path, 'run-1')
+        resumed.record('MC3', 'rendered')
+        resumed.close()
+        resumed = journal.Journal(self.path, 'run-1')
+        self.assertTrue(resumed.reached('MC1', 'converted'))
+        self.assertFalse(resumed.reached('MC2', 'queried'))
+        self.assertTrue(resumed.reached('MC3', 'rendered'))
+        resumed.close()
+
+    def test_forget_rewrites_the_file(self):
+        letters = journal.Journal(self.path, 'run-1')
+        letters.record_many(['MC1', 'MC2', 'MC3'], 'converted')
+        letters.forget(['MC1', 'MC3'])
+        letters.record('MC4', 'rendered')
+        letters.close()
+        with open(self.path, 'r') as journal_f:
+            keys = [json.loads(line).get('key') for line in journal_f]
+        self.assertEqual(keys, [None, 'MC2', 'MC4'])
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+    def test_threads_write_whole_lines(self):
+        letters = journal.Journal(self.path, 'run-1')
+
+        def record(thread: int):
+            for i in range(200):
+                letters.record(f'MC{thread}-{i}', 'rendered')
+
+        threads = [threading.Thread(target=record, args=(thread,))
+                   for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        letters.close()
+        with open(self.path, 'r') as journal_f:
+            entries = [json.loads(line) for line in journal_f]
+        self.assertEqual(len(entries), 1 + 4 * 200)
+
+    def test_clear_removes_the_file(self):
+        letters = journal.Journal(self.path, 'run-1')
+        letters.record('MC1', 'converted')
+        letters.clear()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(letters.reached('MC1', 'queried'))
+
+
+if __name__ == '__main__':
+    unittest.main()
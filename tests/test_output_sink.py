@@ -0,0 +1,102 @@
+"""
+test_output_sink.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Stages letters in a temporary directory and checks that they are
+published to the destination in batches, and that a batch that can't be
+published is handed back and left in staging
+"""
+import os
+import zipfile
+import tempfile
+import unittest
+import output_sink
+
+
+class TestStagedSink(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.directory.name, 'share')
+        self.staging = os.path.join(self.directory.name, 'staging')
+        for directory in [self.destination, self.staging]:
+            os.makedirs(os.path.join(directory, 'gw'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def staged(self, sink: output_sink.Sink, name: str) -> str:
+        """
+        Args:
+            sink (Sink): The sink to stage the letter for
+            name (str): The name of the letter
+        Returns:
+            (str): The path of a letter written to the sink's directory
+        """
+        path = os.path.join(sink.directory, 'gw', f'{name}.pdf')
+        with open(path, 'wb') as pdf_f:
+            pdf_f.write(name.encode())
+        return path
+
+    def published(self) -> list:
+        return sorted(os.listdir(os.path.join(self.destination, 'gw')))
+
+    def test_sink_converts_into_destination(self):
+        sink = output_sink.from_config({}, self.destination, 'run')
+        self.assertEqual(sink.directory, self.destination)
+        batches = sink.add('MC1', [self.staged(sink, 'MC1')])
+        self.assertEqual([batch.keys for batch in batches], [['MC1']])
+        self.assertEqual(sink.flush(), [])
+
+    def test_publishes_in_batches(self):
+        sink = output_sink.StagedSink(
+            self.destination, self.staging, 'run', batch_size=2, workers=1)
+        finished = []
+        for i in range(5):
+            key = f'MC{i}'
+            finished += sink.add(key, [self.staged(sink, key)])
+        finished += sink.flush()
+        sink.close()
+        self.assertEqual([batch.keys for batch in finished],
+                         [['MC0', 'MC1'], ['MC2', 'MC3'], ['MC4']])
+        self.assertTrue(all(batch.error is None for batch in finished))
+        self.assertEqual(self.published(), [f'MC{i}.pdf' for i in range(5)])
+        self.assertEqual(os.listdir(os.path.join(self.staging, 'gw')), [])
+        self.assertEqual((sink.published, sink.batches), (5, 3))
+
+    def test_publishes_an_archive(self):
+        sink = output_sink.StagedSink(
+            self.destination, self.staging, 'run', batch_size=2, workers=1,
+            archive=True)
+        for key in ['MC0', 'MC1']:
+            sink.add(key, [self.staged(sink, key)])
+        sink.flush()
+        sink.close()
+        archive = f'{self.destination}\\letters-run-00000.zip'
+        with zipfile.ZipFile(archive) as archive_f:
+            self.assertEqual(sorted(archive_f.namelist()),
+                             ['gw/MC0.pdf', 'gw/MC1.pdf'])
+        self.assertEqual(os.listdir(os.path.join(self.staging, 'gw')), [])
+
+    def test_failed_batch_stays_staged(self):
+        sink = output_sink.StagedSink(
+            self.destination, self.staging, 'run', batch_size=10, workers=1)
+        os.makedirs(os.path.join(self.staging, 'rec'))
+        rec = os.path.join(self.staging, 'rec', 'MC1.pdf')
+        with open(rec, 'wb') as pdf_f:
+            pdf_f.write(b'MC1')
+        sink.add('MC0', [self.staged(sink, 'MC0')])
+        # The destination has no rec directory, so the copy fails
+        sink.add('MC1', [rec])
+        finished = sink.flush()
+        sink.close()
+        self.assertEqual(len(finished), 1)
+        self.assertIsInstance(finished[0].error, FileNotFoundError)
+        self.assertTrue(os.path.exists(rec))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.staging, 'gw', 'MC0.pdf')))
+        self.assertEqual(sink.published, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
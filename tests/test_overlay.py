@@ -0,0 +1,101 @@
+"""
+test_overlay.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Stamps addresses onto a small letter body made the way the benchmark's
+stand-in for wkhtmltopdf makes them, and checks the lines drawn and the
+pages kept
+"""
+import os
+import tempfile
+import unittest
+from PyPDF2 import PdfFileReader
+import overlay
+from benchmark.fake_converter import minimal_pdf
+
+
+def page_content(pdf: str, number: int = 0) -> bytes:
+    """
+    Args:
+        pdf (str): The path of a PDF
+        number (int): The number of the page, from 0
+    Returns:
+        (bytes): The data of every content stream of the page
+    """
+    with open(pdf, 'rb') as pdf_f:
+        contents = PdfFileReader(pdf_f).getPage(number).get('/Contents')
+        if contents is None:
+            return b''
+        contents = contents.getObject()
+        if not isinstance(contents, list):
+            contents = [contents]
+        return b'\n'.join(stream.getObject().getData()
+                          for stream in contents)
+
+
+class TestAddressLines(unittest.TestCase):
+    def test_splits_and_unescapes(self):
+        self.assertEqual(
+            overlay.address_lines(
+                'The Occupier', '1 Smith &amp; Sons<br> High St<br><br>'
+                'YO7 3AB'),
+            ['The Occupier', '1 Smith & Sons', 'High St', 'YO7 3AB'])
+
+    def test_pdf_string_escapes(self):
+        self.assertEqual(overlay.pdf_string('Flat (1) \\ B'),
+                         b'(Flat \\(1\\) \\\\ B)')
+        self.assertEqual(overlay.pdf_string('Caf\xe9'), b'(Caf\xe9)')
+
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pdf = os.path.join(self.directory.name, 'letter.pdf')
+        self.body = overlay.Overlay(minimal_pdf(2), 25.4, 43.4)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_content_draws_each_line(self):
+        content = self.body.content(['The Occupier', '1 High St'])
+        self.assertTrue(content.startswith(b'BT\n/FAddr 13.5 Tf'))
+        self.assertIn(b"(The Occupier) '\n(1 High St) '\nET", content)
+        # 25.4mm from the left is an inch
+        self.assertIn(b'72.00 ', content)
+
+    def test_stamp_adds_to_first_page(self):
+        self.body.stamp(['The Occupier', '1 High St'], self.pdf)
+        with open(self.pdf, 'rb') as pdf_f:
+            reader = PdfFileReader(pdf_f)
+            self.assertEqual(reader.getNumPages(), 2)
+            fonts = reader.getPage(0)['/Resources']['/Font']
+            self.assertEqual(fonts['/FAddr']['/BaseFont'], '/Helvetica-Bold')
+            # The letter's own font is still there
+            self.assertIn('/F1', fonts)
+        self.assertIn(b'(1 High St)', page_content(self.pdf))
+        self.assertEqual(page_content(self.pdf, 1), b'')
+
+    def test_stamps_are_independent(self):
+        first = os.path.join(self.directory.name, 'first.pdf')
+        self.body.stamp(['First'], first)
+        self.body.stamp(['Second'], self.pdf)
+        data = page_content(self.pdf)
+        self.assertIn(b'(Second)', data)
+        self.assertNotIn(b'(First)', data)
+
+    def test_convert_stream(self):
+        # A letter that can't be written fails without stopping the rest
+        unwritable = os.path.join(self.directory.name, 'missing', 'a.pdf')
+        jobs = [
+            (overlay.Stamp(['The Occupier'], 'gw-MC1', self.body), unwritable),
+            (overlay.Stamp(['The Occupier'], 'gw-MC2', self.body), self.pdf)]
+        results = overlay.convert_all(jobs)
+        self.assertEqual([result.ok for result in results], [False, True])
+        self.assertEqual([str(result.html) for result in results],
+                         ['gw-MC1', 'gw-MC2'])
+        self.assertEqual(self.body.stamps, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
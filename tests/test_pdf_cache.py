@@ -0,0 +1,107 @@
+"""
+test_pdf_cache.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Checks that the PDF cache keys conversions by everything they depend on
+and evicts the least recently used PDFs once it is over its budget
+"""
+import os
+import time
+import tempfile
+import unittest
+import pdf_cache
+
+
+class TestPdfCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, 'cache')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def pdf(self, name: str, size: int) -> str:
+        """
+        Args:
+            name (str): The name of the PDF
+            size (int): The number of bytes to write to it
+        Returns:
+            (str): The path of a PDF of the given size
+        """
+        path = os.path.join(self.directory.name, f'{name}.pdf')
+        with open(path, 'wb') as pdf_f:
+            pdf_f.write(name.encode().ljust(size, b'.'))
+        return path
+
+    def fetched(self, cache: pdf_cache.PdfCache, key: str) -> bool:
+        return cache.fetch(key, os.path.join(self.directory.name, 'out.pdf'))
+
+    def test_key_depends_on_flags_and_salt(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 1000)
+        salted = pdf_cache.PdfCache(self.cache_dir, 1000, 'stylesheet')
+        key = cache.key([b'<html>'], ['-q'])
+        self.assertEqual(key, cache.key([b'<html>'], ['-q']))
+        self.assertNotEqual(key, cache.key([b'<html>'], ['-q', '-s']))
+        self.assertNotEqual(key, salted.key([b'<html>'], ['-q']))
+        # The boundary between sources is part of the key
+        self.assertNotEqual(cache.key([b'ab', b'c'], []),
+                            cache.key([b'a', b'bc'], []))
+
+    def test_fetch_copies_a_stored_pdf(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 1000)
+        cache.store('a', self.pdf('a', 100))
+        out = os.path.join(self.directory.name, 'out.pdf')
+        self.assertTrue(cache.fetch('a', out))
+        with open(out, 'rb') as out_f:
+            self.assertTrue(out_f.read().startswith(b'a.'))
+        self.assertFalse(self.fetched(cache, 'b'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 300)
+        for key in ['a', 'b', 'c']:
+            cache.store(key, self.pdf(key, 100))
+        # Using a makes b the least recently used
+        self.assertTrue(self.fetched(cache, 'a'))
+        cache.store('d', self.pdf('d', 100))
+        self.assertEqual(list(cache.entries), ['c', 'a', 'd'])
+        self.assertFalse(os.path.exists(cache.path('b')))
+        self.assertFalse(self.fetched(cache, 'b'))
+        self.assertEqual((cache.size, cache.evictions), (300, 1))
+
+    def test_evicts_until_under_budget(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 300)
+        for key in ['a', 'b', 'c']:
+            cache.store(key, self.pdf(key, 100))
+        cache.store('d', self.pdf('d', 250))
+        self.assertEqual(list(cache.entries), ['d'])
+        self.assertEqual(cache.evictions, 3)
+
+    def test_storing_again_replaces_size(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 1000)
+        cache.store('a', self.pdf('a', 100))
+        cache.store('a', self.pdf('a', 150))
+        self.assertEqual(cache.size, 150)
+
+    def test_skips_pdf_over_budget(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 100)
+        cache.store('a', self.pdf('a', 101))
+        self.assertEqual(len(cache.entries), 0)
+        self.assertFalse(os.path.exists(cache.path('a')))
+
+    def test_reopens_in_order_of_use(self):
+        cache = pdf_cache.PdfCache(self.cache_dir, 1000)
+        for key in ['a', 'b', 'c']:
+            cache.store(key, self.pdf(key, 100))
+        # The order of use is kept in the modification times
+        now = time.time()
+        for age, key in enumerate(['b', 'c', 'a']):
+            os.utime(cache.path(key), (now - 10 + age, now - 10 + age))
+        reopened = pdf_cache.PdfCache(self.cache_dir, 1000)
+        self.assertEqual(list(reopened.entries), ['b', 'c', 'a'])
+        self.assertEqual(reopened.size, 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
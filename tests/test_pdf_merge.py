@@ -0,0 +1,107 @@
+"""
+test_pdf_merge.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Merges small PDFs made the way the benchmark's stand-in for wkhtmltopdf
+makes them, each embedding its own copy of the same font, and checks the
+shards written and the resources shared between letters
+"""
+import os
+import tempfile
+import unittest
+from PyPDF2 import PdfFileReader
+import pdf_merge
+from benchmark.fake_converter import minimal_pdf
+
+
+class TestPostcodeSector(unittest.TestCase):
+    def test_last_postcode_in_name(self):
+        self.assertEqual(
+            pdf_merge.postcode_sector('.\\pdfs\\1 High St, YO7 3AB.pdf'),
+            'YO7-3')
+        self.assertEqual(
+            pdf_merge.postcode_sector('1 High St, dl6 2xy.pdf'), 'DL6-2')
+
+    def test_no_postcode(self):
+        self.assertEqual(pdf_merge.postcode_sector('100050000001.pdf'), '')
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_path = os.path.join(self.directory.name, 'out')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def letters(self, names: list, pages: int = 2) -> list:
+        """
+        Args:
+            names (list): The names of the letters, with their postcodes
+            pages (int): The number of pages in each letter
+        Returns:
+            (list): The paths of the letters' PDFs
+        """
+        paths = []
+        for name in names:
+            path = os.path.join(self.directory.name, f'{name}.pdf')
+            with open(path, 'wb') as pdf_f:
+                pdf_f.write(minimal_pdf(pages))
+            paths.append(path)
+        return paths
+
+    def pages(self, path: str) -> int:
+        with open(path, 'rb') as pdf_f:
+            return PdfFileReader(pdf_f).getNumPages()
+
+    def test_unsharded_output(self):
+        pdfs = self.letters(['a', 'b', 'c'])
+        shards = list(pdf_merge.merge(pdfs, self.out_path))
+        self.assertEqual([shard.path for shard in shards],
+                         [f'{self.out_path}.pdf'])
+        self.assertEqual((shards[0].count, shards[0].pages), (3, 6))
+        self.assertEqual(self.pages(f'{self.out_path}.pdf'), 6)
+
+    def test_shards_by_pages(self):
+        pdfs = self.letters(['a', 'b', 'c', 'd', 'e'])
+        shards = list(pdf_merge.merge(pdfs, self.out_path, shard_pages=5))
+        self.assertEqual(
+            [os.path.basename(shard.path) for shard in shards],
+            ['out-001.pdf', 'out-002.pdf', 'out-003.pdf'])
+        self.assertEqual([shard.pages for shard in shards], [4, 4, 2])
+        for shard in shards:
+            self.assertEqual(self.pages(shard.path), shard.pages)
+            self.assertFalse(os.path.exists(f'{shard.path}.tmp'))
+
+    def test_letter_bigger_than_a_shard(self):
+        pdfs = self.letters(['a', 'b'], pages=3)
+        shards = list(pdf_merge.merge(pdfs, self.out_path, shard_pages=2))
+        self.assertEqual([shard.pages for shard in shards], [3, 3])
+
+    def test_shards_by_sector(self):
+        pdfs = self.letters(
+            ['1 High St YO7 3AB', '2 High St YO7 3AD', '1 Main St DL6 2XY'])
+        shards = list(pdf_merge.merge(pdfs, self.out_path, by_sector=True))
+        self.assertEqual(
+            [os.path.basename(shard.path) for shard in shards],
+            ['out-YO7-3-001.pdf', 'out-DL6-2-002.pdf'])
+        self.assertEqual([shard.count for shard in shards], [2, 1])
+
+    def test_dedupe_writes_shared_font_once(self):
+        pdfs = self.letters(['a', 'b', 'c', 'd'])
+        plain = list(pdf_merge.merge(pdfs, f'{self.out_path}-plain'))[0]
+        deduped = list(pdf_merge.merge(pdfs, self.out_path, dedupe=True))[0]
+        self.assertEqual((plain.shared, deduped.shared), (0, 3))
+        self.assertLess(deduped.size, plain.size / 2)
+        self.assertEqual(self.pages(deduped.path), 8)
+        with open(deduped.path, 'rb') as pdf_f:
+            reader = PdfFileReader(pdf_f)
+            fonts = {reader.getPage(number)['/Resources'].raw_get('/Font')
+                     .getObject().raw_get('/F1').idnum
+                     for number in range(reader.getNumPages())}
+        self.assertEqual(len(fonts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
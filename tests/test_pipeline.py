@@ -0,0 +1,94 @@
+"""
+test_pipeline.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Checks that the streaming helpers pass every item on in order and that an
+error in any thread reaches the consumer
+"""
+import unittest
+import pipeline
+
+
+class FakeCursor():
+    """
+    Represents an executed query whose rows are read with fetchmany()
+    """
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.fetches = 0
+
+    def fetchmany(self, size: int) -> list:
+        self.fetches += 1
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def failing(items: list):
+    yield from items
+    raise ValueError('The query failed')
+
+
+class TestFetch(unittest.TestCase):
+    def test_fetch_batches(self):
+        cursor = FakeCursor(list(range(7)))
+        batches = list(pipeline.fetch_batches(cursor, 3))
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(cursor.fetches, 4)
+
+    def test_fetch_rows(self):
+        cursor = FakeCursor(list(range(7)))
+        self.assertEqual(list(pipeline.fetch_rows(cursor, 3)), list(range(7)))
+
+    def test_batched(self):
+        self.assertEqual(list(pipeline.batched(iter(range(5)), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(pipeline.batched([], 2)), [])
+
+
+class TestMerge(unittest.TestCase):
+    def test_keeps_each_source_in_order(self):
+        sources = [(('gw', i) for i in range(300)),
+                   (('rec', i) for i in range(200))]
+        merged = list(pipeline.merge(sources, queue_size=10))
+        self.assertEqual(len(merged), 500)
+        for kind in ['gw', 'rec']:
+            numbers = [i for item_kind, i in merged if item_kind == kind]
+            self.assertEqual(numbers, sorted(numbers))
+
+    def test_raises_a_source_error(self):
+        sources = [iter(range(5)), failing([10, 11])]
+        with self.assertRaises(ValueError):
+            list(pipeline.merge(sources))
+
+
+class TestStream(unittest.TestCase):
+    def test_applies_each_stage_in_order(self):
+        stages = [lambda item: item * 2, lambda item: item + 1]
+        streamed = list(pipeline.stream(range(500), stages, queue_size=5))
+        self.assertEqual(streamed, [item * 2 + 1 for item in range(500)])
+
+    def test_raises_a_source_error(self):
+        with self.assertRaises(ValueError):
+            list(pipeline.stream(failing([1, 2]), [str]))
+
+    def test_raises_a_stage_error(self):
+        def stage(item):
+            if item == 3:
+                raise KeyError(item)
+            return item
+
+        with self.assertRaises(KeyError):
+            list(pipeline.stream(range(10), [stage, str]))
+
+    def test_passes_system_exit_on(self):
+        # log_error() exits with SystemExit from inside a stage
+        def stage(item):
+            raise SystemExit(1)
+
+        with self.assertRaises(SystemExit):
+            list(pipeline.stream(range(3), [stage]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+test_rounds_snapshot.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Checks that a saved rounds snapshot reads back the same, and that it finds
+a change of rounds exactly where changes_info.sql does. That query compares
+the old and new schedule days with a missing service as 0, leaves out
+properties that aren't in both tables, and only counts a garden waste
+change if the property had garden waste before
+"""
+import os
+import tempfile
+import unittest
+import rounds_snapshot
+
+TABLE = 'PropertyServiceRounds_I_2018100100000'
+# The schedule days of REF, RECY, MIX, GLASS and GW
+DAYS = (1, 2, 3, 4, 5)
+
+
+class TestChanged(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = rounds_snapshot.Snapshot.from_rows(TABLE, [
+            ('100050000002', DAYS),
+            ('100050000001', (1, 2, 3, 4, 0)),
+            (100050000003, (0, 2, 3, 4, 5))])
+
+    def test_sorted_by_uprn(self):
+        self.assertEqual(list(self.snapshot.uprns),
+                         [100050000001, 100050000002, 100050000003])
+        self.assertEqual(self.snapshot.get('100050000002'), DAYS)
+        self.assertIsNone(self.snapshot.get(100050000004))
+
+    def test_same_days(self):
+        self.assertFalse(self.snapshot.changed('100050000002', DAYS))
+
+    def test_collection_day_moved(self):
+        for service in range(4):
+            new = list(DAYS)
+            new[service] = 7
+            with self.subTest(service=rounds_snapshot.SERVICES[service]):
+                self.assertTrue(
+                    self.snapshot.changed('100050000002', tuple(new)))
+
+    def test_service_added_or_dropped(self):
+        # ISNULL(..., 0) makes a missing service 0, so 0 <> 1 is a change
+        self.assertTrue(self.snapshot.changed('100050000003', DAYS))
+        self.assertTrue(
+            self.snapshot.changed('100050000002', (1, 0, 3, 4, 5)))
+
+    def test_garden_waste_moved_or_dropped(self):
+        self.assertTrue(
+            self.snapshot.changed('100050000002', (1, 2, 3, 4, 6)))
+        self.assertTrue(
+            self.snapshot.changed('100050000002', (1, 2, 3, 4, 0)))
+
+    def test_garden_waste_added(self):
+        # oldGW is NULL when it was 0, so GW IS NOT NULL AND oldGW IS NOT
+        # NULL is false for a property that starts garden waste
+        self.assertFalse(self.snapshot.changed('100050000001', DAYS))
+        self.assertTrue(
+            self.snapshot.changed('100050000001', (2, 2, 3, 4, 5)))
+
+    def test_property_not_in_snapshot(self):
+        # The old days come from a LEFT JOIN, and NULL <> x is never true
+        self.assertFalse(self.snapshot.changed('100050000004', DAYS))
+
+
+class TestSaveLoad(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'rounds.snapshot')
+        self.snapshot = rounds_snapshot.Snapshot.from_rows(
+            TABLE, [(str(100050000000 + i), DAYS) for i in range(10)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.snapshot.save(self.path)
+        loaded = rounds_snapshot.Snapshot.load(self.path, TABLE)
+        self.assertEqual(loaded.uprns, self.snapshot.uprns)
+        self.assertEqual(loaded.days, self.snapshot.days)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+    def test_other_table(self):
+        self.snapshot.save(self.path)
+        self.assertIsNone(rounds_snapshot.Snapshot.load(
+            self.path, 'PropertyServiceRounds_I_2019010100000'))
+
+    def test_missing_or_cut_short(self):
+        self.assertIsNone(rounds_snapshot.Snapshot.load(self.path, TABLE))
+        self.snapshot.save(self.path)
+        with open(self.path, 'rb') as snapshot_f:
+            saved = snapshot_f.read()
+        # Wherever an interrupted save stopped, the snapshot is built again
+        for size in range(len(saved)):
+            with self.subTest(size=size):
+                with open(self.path, 'wb') as snapshot_f:
+                    snapshot_f.write(saved[:size])
+                self.assertIsNone(
+                    rounds_snapshot.Snapshot.load(self.path, TABLE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+test_watch.py
+How to run:
+From the command line, run `py -3 -m pytest tests`
+How it works:
+Runs gen_html.watch() against stand-ins for polling the database and
+sending letters, and checks how far the high watermark moves when letters
+fail, how often a failed letter is tried again, and what is kept between
+batches
+"""
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import pyodbc
+except ImportError:
+    # watch() only reaches the database through poll_requests()
+    from benchmark import fake_pyodbc as pyodbc
+    sys.modules['pyodbc'] = pyodbc
+import converter
+import gen_html
+import journal
+import metrics
+import run_log
+
+
+class Requests():
+    """
+    Represents the missed collection requests a watched database receives
+    """
+    def __init__(self, ids: list, failures: dict = None):
+        """
+        Args:
+            ids (list): The ids of the requests, in the order they arrive
+            failures (dict): The number of times the letter of each id
+            fails before it converts
+        """
+        self.requests = {id_: SimpleNamespace(key=f'MC{id_}') for id_ in ids}
+        self.failures = dict(failures or {})
+        self.sent = set()
+        # The ids of the requests in each batch sent
+        self.batches = []
+
+    def poll(self, watermark: int, limit: int) -> tuple:
+        polled = [(id_, request) for id_, request in self.requests.items()
+                  if id_ > watermark and id_ not in self.sent][:limit]
+        if len(polled) == limit:
+            return polled, polled[-1][0]
+        return polled, max([watermark] + [id_ for id_, _ in polled])
+
+    def send(self, requests: list, workers: int = None) -> list:
+        ids = {request.key: id_ for id_, request in self.requests.items()}
+        self.batches.append([ids[request.key] for request in requests])
+        sent = []
+        for request in requests:
+            id_ = ids[request.key]
+            if self.failures.get(id_, 0) > 0:
+                self.failures[id_] -= 1
+                gen_html.JOURNAL.record(request.key, 'rendered')
+                continue
+            self.sent.add(id_)
+            gen_html.JOURNAL.record(request.key, 'flagged')
+            sent.append(request)
+        return sent
+
+
+class TestWatermark(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.watermark')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_no_watermark(self):
+        self.assertEqual(gen_html.read_watermark(self.path), 0)
+
+    def test_round_trip(self):
+        gen_html.write_watermark(self.path, 120)
+        self.assertEqual(gen_html.read_watermark(self.path), 120)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+    def test_retry_holds_watermark_back(self):
+        gen_html.write_watermark(self.path, 120, retry=104)
+        self.assertEqual(gen_html.read_watermark(self.path), 103)
+        gen_html.write_watermark(self.path, 90, retry=104)
+        self.assertEqual(gen_html.read_watermark(self.path), 90)
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.watermark = os.path.join(self.directory.name, 'test.watermark')
+        self.config = {
+            'watermark': self.watermark,
+            'watch_batch_size': 10,
+            'watch_interval': 0,
+            'watch_attempts': 2,
+            'metrics_path': os.path.join(self.directory.name, 'metrics')}
+        patches = {
+            'JOURNAL': journal.Journal(None),
+            'DEAD_LETTERS': converter.DeadLetters(
+                os.path.join(self.directory.name, 'failed.json')),
+            'METRICS': metrics.Metrics('gen_html'),
+            'LOG': run_log.RunLog(
+                os.path.join(self.directory.name, 'test.log'))}
+        for name, value in patches.items():
+            patcher = mock.patch.object(gen_html, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def watch(self, requests: Requests, polls: int) -> int:
+        with mock.patch.object(gen_html, 'poll_requests', requests.poll), \
+                mock.patch.object(gen_html, 'send_letters', requests.send):
+            return gen_html.watch(dict(self.config, watch_polls=polls))
+
+    def test_sends_every_letter(self):
+        requests = Requests(range(1, 6))
+        self.assertEqual(self.watch(requests, 2), 5)
+        self.assertEqual(gen_html.read_watermark(self.watermark), 5)
+        self.assertEqual(gen_html.JOURNAL.stages, {})
+
+    def test_full_batches_move_on(self):
+        requests = Requests(range(1, 26))
+        self.assertEqual(self.watch(requests, 3), 25)
+        self.assertEqual([len(batch) for batch in requests.batches],
+                         [10, 10, 5])
+
+    def test_failed_letter_holds_watermark(self):
+        requests = Requests(range(1, 6), failures={3: 1})
+        self.watch(requests, 1)
+        self.assertEqual(gen_html.read_watermark(self.watermark), 2)
+        self.assertEqual(gen_html.JOURNAL.stages, {'MC3': 'rendered'})
+        # Carries on from the watermark, so MC3 is polled again
+        self.assertEqual(self.watch(requests, 1), 1)
+        self.assertEqual(requests.batches[-1], [3])
+        self.assertEqual(gen_html.read_watermark(self.watermark), 3)
+        self.assertEqual(gen_html.JOURNAL.stages, {})
+
+    def test_gives_up_after_watch_attempts(self):
+        requests = Requests(range(1, 6), failures={3: 10})
+        self.assertEqual(self.watch(requests, 4), 4)
+        self.assertEqual(
+            [batch for batch in requests.batches if 3 in batch],
+            [[1, 2, 3, 4, 5], [3]])
+        # Moved past MC3, but the next run starts just before it
+        self.assertEqual(gen_html.read_watermark(self.watermark), 2)
+        self.assertEqual(gen_html.JOURNAL.stages, {})
+
+    def test_next_run_retries_given_up_letter(self):
+        requests = Requests(range(1, 6), failures={3: 10})
+        self.watch(requests, 2)
+        requests.requests[6] = SimpleNamespace(key='MC6')
+        self.assertEqual(self.watch(requests, 1), 1)
+        self.assertEqual(requests.batches[-1], [3, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()